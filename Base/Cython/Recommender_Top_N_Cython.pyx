@@ -0,0 +1,427 @@
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+#cython: boundscheck=False
+#cython: wraparound=False
+#cython: initializedcheck=False
+#cython: language_level=3
+#cython: nonecheck=False
+#cython: cdivision=True
+#cython: unpack_method_calls=True
+#cython: overflowcheck=False
+
+
+import numpy as np
+cimport numpy as np
+import threading
+
+cimport cython
+from cython.parallel import prange, threadid
+
+from libc.math cimport INFINITY
+
+import scipy.sparse as sps
+
+
+
+cdef inline bint is_worse(double value_a, long id_a, double value_b, long id_b) nogil:
+    """
+    Returns True if element a should be ranked after element b, ties are broken in favour of the lower index
+    """
+    return value_a < value_b or (value_a == value_b and id_a > id_b)
+
+
+
+# Flags of the items in the per-thread item mask
+cdef char ITEM_TOUCHED = 1
+cdef char ITEM_SEEN = 2
+
+
+
+cdef class Recommender_Top_N_Cython:
+    """
+    Computes the scores and the top-N of a batch of users for a similarity based recommender, in a single pass.
+    The scores of a user are the product of its row in first_matrix and second_matrix:
+        item-based: first_matrix = URM_train, second_matrix = W_sparse
+        user-based: first_matrix = W_sparse, second_matrix = URM_train
+    Each thread accumulates the scores of a user in its own sparse accumulator and keeps the best ones in a heap.
+    The accumulators belong to the object, so concurrent recommend calls from different Python threads are serialized.
+    """
+
+    cdef long n_items, n_threads
+
+    # Read-only views, the matrices may be memory mapped
+    cdef const int[:] URM_train_indptr, URM_train_indices
+    cdef const int[:] first_indptr, first_indices, second_indptr, second_indices
+    cdef const float[:] first_data, second_data
+
+    # Each thread has its own accumulator, item mask and heap, one row per thread
+    cdef double[:,:] item_scores
+    cdef char[:,:] item_mask
+    cdef int[:,:] touched_items
+    cdef double[:,:] heap_values
+    cdef int[:,:] heap_ids
+
+    # Guards the accumulators, which are indexed by the OpenMP thread id and not by the calling thread
+    cdef object recommend_lock
+
+
+
+    def __init__(self, URM_train, W_sparse, item_based = True, n_threads = 1):
+        """
+        :param URM_train:
+        :param W_sparse:        Similarity, item-item if item_based else user-user
+        :param item_based:
+        :param n_threads:       Number of OpenMP threads the users are distributed among, the result does not depend on it
+        """
+
+        super(Recommender_Top_N_Cython, self).__init__()
+
+        if n_threads is None or n_threads < 1:
+            raise ValueError("Recommender_Top_N_Cython: value for paramether 'n_threads' must be a positive integer."
+                             " Passed value was '{}'".format(n_threads))
+
+        # The matrices are only copied if their format or type is different
+        URM_train = URM_train.tocsr().astype(np.float32, copy=False)
+        W_sparse = W_sparse.tocsr().astype(np.float32, copy=False)
+
+        if item_based:
+            first_matrix, second_matrix = URM_train, W_sparse
+        else:
+            first_matrix, second_matrix = W_sparse, URM_train
+
+        self.n_items = URM_train.shape[1]
+        self.n_threads = n_threads
+
+        self.URM_train_indptr = URM_train.indptr.astype(np.int32, copy=False)
+        self.URM_train_indices = URM_train.indices.astype(np.int32, copy=False)
+
+        self.first_indptr = first_matrix.indptr.astype(np.int32, copy=False)
+        self.first_indices = first_matrix.indices.astype(np.int32, copy=False)
+        self.first_data = first_matrix.data
+
+        self.second_indptr = second_matrix.indptr.astype(np.int32, copy=False)
+        self.second_indices = second_matrix.indices.astype(np.int32, copy=False)
+        self.second_data = second_matrix.data
+
+        self.item_scores = np.zeros((self.n_threads, self.n_items), dtype=np.float64)
+        self.item_mask = np.zeros((self.n_threads, self.n_items), dtype=np.int8)
+        self.touched_items = np.zeros((self.n_threads, self.n_items), dtype=np.int32)
+
+        self.heap_values = np.zeros((self.n_threads, 1), dtype=np.float64)
+        self.heap_ids = np.zeros((self.n_threads, 1), dtype=np.int32)
+
+        self.recommend_lock = threading.Lock()
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef long heapPush(self, int thread_id, long heap_size, long cutoff, double value, long item_id) nogil:
+        """
+        Add an element to the heap of thread_id, whose root is the worst element selected so far
+        :return: the new heap size
+        """
+
+        cdef long heap_position, child_position, best_child_position
+
+        if heap_size < cutoff:
+
+            # Add as a leaf and sift up while it is worse than its parent
+            heap_position = heap_size
+            heap_size += 1
+
+            while heap_position > 0:
+                child_position = heap_position
+                heap_position = (child_position - 1) // 2
+
+                if is_worse(value, item_id, self.heap_values[thread_id, heap_position], self.heap_ids[thread_id, heap_position]):
+                    self.heap_values[thread_id, child_position] = self.heap_values[thread_id, heap_position]
+                    self.heap_ids[thread_id, child_position] = self.heap_ids[thread_id, heap_position]
+                else:
+                    heap_position = child_position
+                    break
+
+            self.heap_values[thread_id, heap_position] = value
+            self.heap_ids[thread_id, heap_position] = item_id
+
+        elif is_worse(self.heap_values[thread_id, 0], self.heap_ids[thread_id, 0], value, item_id):
+            self.heapSiftDown(thread_id, heap_size, value, item_id)
+
+        return heap_size
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void heapSiftDown(self, int thread_id, long heap_size, double value, long item_id) nogil:
+        """
+        Replace the root of the heap of thread_id and sift it down while a child is worse than it
+        """
+
+        cdef long heap_position = 0, child_position, best_child_position
+
+        while True:
+            best_child_position = 2*heap_position + 1
+
+            if best_child_position >= heap_size:
+                break
+
+            child_position = best_child_position + 1
+
+            if child_position < heap_size and \
+                is_worse(self.heap_values[thread_id, child_position], self.heap_ids[thread_id, child_position],
+                         self.heap_values[thread_id, best_child_position], self.heap_ids[thread_id, best_child_position]):
+                best_child_position = child_position
+
+            if is_worse(self.heap_values[thread_id, best_child_position], self.heap_ids[thread_id, best_child_position], value, item_id):
+                self.heap_values[thread_id, heap_position] = self.heap_values[thread_id, best_child_position]
+                self.heap_ids[thread_id, heap_position] = self.heap_ids[thread_id, best_child_position]
+                heap_position = best_child_position
+            else:
+                break
+
+        self.heap_values[thread_id, heap_position] = value
+        self.heap_ids[thread_id, heap_position] = item_id
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef long accumulateUserScores(self, long user_id, int thread_id) nogil:
+        """
+        Accumulate the nonzero scores of user_id in the accumulator of thread_id
+        :return: the number of touched items
+        """
+
+        cdef long first_index, second_index, neighbour_id, item_id, n_touched = 0
+        cdef double first_value
+
+        for first_index in range(self.first_indptr[user_id], self.first_indptr[user_id + 1]):
+
+            neighbour_id = self.first_indices[first_index]
+            first_value = self.first_data[first_index]
+
+            for second_index in range(self.second_indptr[neighbour_id], self.second_indptr[neighbour_id + 1]):
+
+                item_id = self.second_indices[second_index]
+
+                if not self.item_mask[thread_id, item_id] & ITEM_TOUCHED:
+                    self.item_mask[thread_id, item_id] |= ITEM_TOUCHED
+                    self.touched_items[thread_id, n_touched] = item_id
+                    n_touched += 1
+
+                self.item_scores[thread_id, item_id] += first_value * self.second_data[second_index]
+
+        return n_touched
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void selectUserTopN(self, long user_index, int thread_id, long n_touched, long cutoff, char[:] removed_items_mask,
+                             int[:,:] ranking, float[:,:] ranking_scores) nogil:
+        """
+        Write the top-N of the user in ranking, ranked as the dense scores would be: the positive scores, then the items
+        with score zero in increasing index order, then the negative scores and finally the removed items
+        """
+
+        cdef long touched_index, item_id, heap_size = 0, heap_position, n_written = 0, n_positive = 0, n_negative_written
+        cdef double value, last_value
+        cdef long last_id
+        cdef bint removed
+
+        for touched_index in range(n_touched):
+
+            item_id = self.touched_items[thread_id, touched_index]
+            value = self.item_scores[thread_id, item_id]
+
+            if value != 0.0 and not self.item_mask[thread_id, item_id] & ITEM_SEEN and not removed_items_mask[item_id]:
+                heap_size = self.heapPush(thread_id, heap_size, cutoff, value, item_id)
+
+        # Sort the heap in place moving the worst element at the end, the best ones are first
+        heap_position = heap_size
+
+        while heap_position > 1:
+            heap_position -= 1
+
+            last_value = self.heap_values[thread_id, heap_position]
+            last_id = self.heap_ids[thread_id, heap_position]
+
+            self.heap_values[thread_id, heap_position] = self.heap_values[thread_id, 0]
+            self.heap_ids[thread_id, heap_position] = self.heap_ids[thread_id, 0]
+
+            self.heapSiftDown(thread_id, heap_position, last_value, last_id)
+
+        while n_positive < heap_size and self.heap_values[thread_id, n_positive] > 0.0:
+            ranking[user_index, n_written] = self.heap_ids[thread_id, n_positive]
+            ranking_scores[user_index, n_written] = <float> self.heap_values[thread_id, n_positive]
+            n_positive += 1
+            n_written += 1
+
+        if n_written == cutoff:
+            return
+
+        # Not enough positive scores, the items with score zero follow
+        for item_id in range(self.n_items):
+
+            if n_written == cutoff:
+                return
+
+            removed = self.item_mask[thread_id, item_id] & ITEM_SEEN or removed_items_mask[item_id]
+
+            if not removed and self.item_scores[thread_id, item_id] == 0.0:
+                ranking[user_index, n_written] = item_id
+                ranking_scores[user_index, n_written] = 0.0
+                n_written += 1
+
+        n_negative_written = n_positive
+
+        while n_written < cutoff and n_negative_written < heap_size:
+            ranking[user_index, n_written] = self.heap_ids[thread_id, n_negative_written]
+            ranking_scores[user_index, n_written] = <float> self.heap_values[thread_id, n_negative_written]
+            n_negative_written += 1
+            n_written += 1
+
+        for item_id in range(self.n_items):
+
+            if n_written == cutoff:
+                return
+
+            removed = self.item_mask[thread_id, item_id] & ITEM_SEEN or removed_items_mask[item_id]
+
+            if removed:
+                ranking[user_index, n_written] = item_id
+                ranking_scores[user_index, n_written] = -INFINITY
+                n_written += 1
+
+
+
+
+    def recommend(self, user_id_array, long cutoff, bint remove_seen_flag = True, removed_items_mask = None,
+                  bint return_sparse_scores = False):
+        """
+        Computes the top-N of the users in user_id_array
+        :param user_id_array:
+        :param cutoff:
+        :param remove_seen_flag:
+        :param removed_items_mask:      Boolean mask of the items removed for all the users, None if no item is removed
+        :param return_sparse_scores:    If True also returns the csr_matrix of all the scores, without removing any item
+        :return: ranking int32 array (len(user_id_array), cutoff), the float32 scores of the ranking and the sparse scores or None
+        """
+
+        with self.recommend_lock:
+            return self._recommend(user_id_array, cutoff, remove_seen_flag, removed_items_mask, return_sparse_scores)
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def _recommend(self, user_id_array, long cutoff, bint remove_seen_flag, removed_items_mask, bint return_sparse_scores):
+
+        cdef long n_users = len(user_id_array)
+        cdef long user_index, user_id, touched_index, item_id, seen_index, n_touched, sparse_pointer
+        cdef int thread_id
+
+        cutoff = min(cutoff, self.n_items)
+
+        cdef int[:] user_id_array_view = np.array(user_id_array, dtype=np.int32)
+
+        cdef char[:] removed_items_mask_view
+        if removed_items_mask is None:
+            removed_items_mask_view = np.zeros(self.n_items, dtype=np.int8)
+        else:
+            removed_items_mask_view = np.array(removed_items_mask, dtype=np.int8)
+
+        cdef int[:,:] ranking = np.zeros((n_users, cutoff), dtype=np.int32)
+        cdef float[:,:] ranking_scores = np.zeros((n_users, cutoff), dtype=np.float32)
+
+        if self.heap_values.shape[1] < cutoff:
+            self.heap_values = np.zeros((self.n_threads, cutoff), dtype=np.float64)
+            self.heap_ids = np.zeros((self.n_threads, cutoff), dtype=np.int32)
+
+
+        # Each user writes its sparse scores in its own slice, whose size is an upper bound of its touched items
+        cdef long[:] sparse_start = np.zeros(n_users + 1, dtype=np.int64)
+        cdef int[:] sparse_nnz = np.zeros(n_users, dtype=np.int32)
+        cdef int[:] sparse_indices = np.zeros(0, dtype=np.int32)
+        cdef float[:] sparse_data = np.zeros(0, dtype=np.float32)
+
+        if return_sparse_scores:
+            first_indptr = np.array(self.first_indptr)
+            first_indices = np.array(self.first_indices)
+            second_row_nnz = np.diff(np.array(self.second_indptr)).astype(np.int64)
+
+            user_start = first_indptr[np.array(user_id_array_view)]
+            user_end = first_indptr[np.array(user_id_array_view) + 1]
+
+            work_cumsum = np.concatenate(([0], np.cumsum(second_row_nnz[first_indices])))
+            upper_bound = np.minimum(work_cumsum[user_end] - work_cumsum[user_start], self.n_items)
+
+            sparse_start = np.concatenate(([0], np.cumsum(upper_bound))).astype(np.int64)
+            sparse_indices = np.zeros(sparse_start[n_users], dtype=np.int32)
+            sparse_data = np.zeros(sparse_start[n_users], dtype=np.float32)
+
+
+        for user_index in prange(n_users, nogil=True, schedule='dynamic', num_threads=self.n_threads):
+
+            thread_id = threadid()
+            user_id = user_id_array_view[user_index]
+
+            n_touched = self.accumulateUserScores(user_id, thread_id)
+
+            if return_sparse_scores:
+                sparse_pointer = sparse_start[user_index]
+
+                for touched_index in range(n_touched):
+                    item_id = self.touched_items[thread_id, touched_index]
+                    sparse_indices[sparse_pointer + touched_index] = item_id
+                    sparse_data[sparse_pointer + touched_index] = <float> self.item_scores[thread_id, item_id]
+
+                sparse_nnz[user_index] = n_touched
+
+            if remove_seen_flag:
+                for seen_index in range(self.URM_train_indptr[user_id], self.URM_train_indptr[user_id + 1]):
+                    self.item_mask[thread_id, self.URM_train_indices[seen_index]] |= ITEM_SEEN
+
+            self.selectUserTopN(user_index, thread_id, n_touched, cutoff, removed_items_mask_view, ranking, ranking_scores)
+
+            # Clean the accumulator and the mask for the next user
+            for touched_index in range(n_touched):
+                item_id = self.touched_items[thread_id, touched_index]
+                self.item_scores[thread_id, item_id] = 0.0
+                self.item_mask[thread_id, item_id] = 0
+
+            if remove_seen_flag:
+                for seen_index in range(self.URM_train_indptr[user_id], self.URM_train_indptr[user_id + 1]):
+                    self.item_mask[thread_id, self.URM_train_indices[seen_index]] = 0
+
+
+        scores = None
+
+        if return_sparse_scores:
+
+            # Move the filled part of each user slice next to the previous one, the destination never overtakes the source
+            sparse_pointer = 0
+
+            with nogil:
+                for user_index in range(n_users):
+                    for touched_index in range(sparse_nnz[user_index]):
+                        sparse_indices[sparse_pointer] = sparse_indices[sparse_start[user_index] + touched_index]
+                        sparse_data[sparse_pointer] = sparse_data[sparse_start[user_index] + touched_index]
+                        sparse_pointer += 1
+
+            scores_indptr = np.zeros(n_users + 1, dtype=np.int64)
+            scores_indptr[1:] = np.cumsum(sparse_nnz)
+
+            scores = sps.csr_matrix((np.array(sparse_data[:sparse_pointer]), np.array(sparse_indices[:sparse_pointer]), scores_indptr),
+                                    shape=(n_users, self.n_items))
+
+        return np.array(ranking), np.array(ranking_scores), scores
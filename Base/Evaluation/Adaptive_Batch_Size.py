@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+
+def get_peak_rss():
+    """
+    :return: the peak resident set size of the process in bytes, or None if it cannot be measured
+    """
+
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak_rss
+
+    return peak_rss * 1024
+
+
+
+
+class Adaptive_Batch_Size(object):
+    """
+    Chooses the number of users of each evaluation batch.
+    - The batch is at most the number of users whose scores fit in memory_budget. Before the first batch the scores are
+        assumed to be float64 and dense, then the bytes per user measured on the previous batches are used.
+    - During the first n_tuning_batches the size is doubled or halved following the throughput, in users per second,
+        then the size with the best throughput is kept.
+    - If a batch raises the peak RSS of the process above peak_rss_ceiling the batch size is halved and never grows above it again.
+    """
+
+    def __init__(self, n_items, memory_budget = 8e8, peak_rss_ceiling = None, initial_batch_size = 1000,
+                 min_batch_size = 1, max_batch_size = None, n_tuning_batches = 6):
+        """
+        :param n_items:
+        :param memory_budget:           Bytes available for the scores of a batch
+        :param peak_rss_ceiling:        Bytes, maximum peak RSS of the process. If None it is not checked
+        :param initial_batch_size:
+        :param min_batch_size:
+        :param max_batch_size:          If None only the memory budget limits the batch size
+        :param n_tuning_batches:        Number of batches used to search the batch size with the best throughput
+        """
+
+        super(Adaptive_Batch_Size, self).__init__()
+
+        if memory_budget is None or memory_budget <= 0:
+            raise ValueError("Adaptive_Batch_Size: value for paramether 'memory_budget' must be a positive number. Passed value was '{}'".format(memory_budget))
+
+        if min_batch_size < 1 or (max_batch_size is not None and max_batch_size < min_batch_size):
+            raise ValueError("Adaptive_Batch_Size: 'min_batch_size' must be a positive integer not greater than 'max_batch_size'."
+                             " Passed values were '{}' and '{}'".format(min_batch_size, max_batch_size))
+
+        self.n_items = n_items
+        self.memory_budget = memory_budget
+        self.peak_rss_ceiling = peak_rss_ceiling
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.n_tuning_batches = n_tuning_batches
+
+        # Dense float64 scores until the first batch is measured
+        self.bytes_per_user = max(1, n_items) * 8
+
+        # Upper bound set when a batch exceeds the peak RSS ceiling
+        self.rss_max_batch_size = None
+
+        self.n_batches = 0
+        self.tuning_direction = 1
+        self.best_batch_size = None
+        self.best_throughput = None
+        self.last_throughput = None
+
+        self.batch_size = self._clip_batch_size(initial_batch_size)
+
+
+
+    def _get_max_batch_size(self):
+
+        max_batch_size = int(self.memory_budget // self.bytes_per_user)
+
+        if self.max_batch_size is not None:
+            max_batch_size = min(max_batch_size, self.max_batch_size)
+
+        if self.rss_max_batch_size is not None:
+            max_batch_size = min(max_batch_size, self.rss_max_batch_size)
+
+        return max(self.min_batch_size, max_batch_size)
+
+
+    def _clip_batch_size(self, batch_size):
+        return int(max(self.min_batch_size, min(batch_size, self._get_max_batch_size())))
+
+
+    def get_batch_size(self):
+        return self.batch_size
+
+
+
+    def update(self, n_users, elapsed_time, scores_bytes = None, peak_rss_before = None, peak_rss_after = None):
+        """
+        Reports the measures of a batch and chooses the size of the next one
+        :param n_users:             Number of users in the batch, the last one may be smaller than the batch size
+        :param elapsed_time:        Seconds spent on the batch
+        :param scores_bytes:        Bytes of the scores of the batch
+        :param peak_rss_before:     Peak RSS of the process before and after the batch, see get_peak_rss
+        :param peak_rss_after:
+        """
+
+        self.n_batches += 1
+
+        if scores_bytes is not None and n_users > 0:
+            self.bytes_per_user = max(1, scores_bytes / n_users)
+
+        if self.peak_rss_ceiling is not None and peak_rss_before is not None and peak_rss_after is not None and \
+                peak_rss_after > peak_rss_before and peak_rss_after > self.peak_rss_ceiling:
+
+            self.rss_max_batch_size = max(self.min_batch_size, n_users // 2)
+            self.best_batch_size = None
+            self.best_throughput = None
+
+            print("Adaptive_Batch_Size: peak RSS {:.2E} bytes exceeds the ceiling {:.2E} bytes, batch size reduced to {}".format(
+                peak_rss_after, self.peak_rss_ceiling, self.rss_max_batch_size))
+
+        # Batches smaller than the batch size, e.g., the last one, are not representative of the throughput
+        if self.n_batches <= self.n_tuning_batches and n_users == self.batch_size and elapsed_time > 0:
+
+            throughput = n_users / elapsed_time
+
+            if self.best_throughput is None or throughput > self.best_throughput:
+                self.best_throughput = throughput
+                self.best_batch_size = self.batch_size
+
+            # Keep moving in the same direction while the throughput improves, otherwise go back
+            if self.last_throughput is not None and throughput < self.last_throughput:
+                self.tuning_direction = -self.tuning_direction
+
+            self.last_throughput = throughput
+
+            if self.n_batches < self.n_tuning_batches:
+                next_batch_size = self.batch_size * 2 if self.tuning_direction > 0 else self.batch_size // 2
+            else:
+                next_batch_size = self.best_batch_size
+
+        elif self.n_batches >= self.n_tuning_batches and self.best_batch_size is not None:
+            next_batch_size = self.best_batch_size
+
+        else:
+            next_batch_size = self.batch_size
+
+        self.batch_size = self._clip_batch_size(next_batch_size)
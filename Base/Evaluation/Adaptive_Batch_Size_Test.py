@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Evaluation.Adaptive_Batch_Size import Adaptive_Batch_Size
+from Base.Evaluation.Evaluator import EvaluatorHoldout
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_memory_budget(self):
+
+        # 1000 float64 scores per user, at most 100 users fit in the budget
+        batch_size_object = Adaptive_Batch_Size(1000, memory_budget = 8e5, initial_batch_size = 1000)
+        assert batch_size_object.get_batch_size() == 100, "Memory budget not respected"
+
+        # The scores are float32, now 200 users fit
+        batch_size_object.update(100, 1.0, scores_bytes = 100*1000*4)
+        assert batch_size_object.get_batch_size() == 200, "Measured scores size not used"
+
+
+    def test_throughput_tuning(self):
+
+        # The throughput is best with 64 users
+        def get_elapsed_time(batch_size):
+            return batch_size / (1000 - abs(np.log2(batch_size) - 6) * 100)
+
+        batch_size_object = Adaptive_Batch_Size(1000, initial_batch_size = 8, n_tuning_batches = 8)
+
+        for _ in range(20):
+            batch_size = batch_size_object.get_batch_size()
+            batch_size_object.update(batch_size, get_elapsed_time(batch_size))
+
+        assert batch_size_object.get_batch_size() == 64, "Batch size with the best throughput not selected"
+
+
+    def test_peak_rss_ceiling(self):
+
+        batch_size_object = Adaptive_Batch_Size(1000, initial_batch_size = 400, peak_rss_ceiling = 1e9)
+
+        batch_size_object.update(400, 1.0, peak_rss_before = 5e8, peak_rss_after = 2e9)
+        assert batch_size_object.get_batch_size() == 200, "Batch size not reduced when exceeding the peak RSS ceiling"
+
+        for _ in range(10):
+            batch_size = batch_size_object.get_batch_size()
+            batch_size_object.update(batch_size, batch_size / 100.0, peak_rss_before = 2e9, peak_rss_after = 2e9)
+
+        assert batch_size_object.get_batch_size() <= 200, "Batch size above the peak RSS limit"
+
+
+    def test_evaluation_equals_fixed_batch_size(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(500, 300, density=0.05, format="csr", dtype=np.float64)
+        URM_test = sps.random(500, 300, density=0.02, format="csr", dtype=np.float64)
+
+        recommender = ItemKNNCFRecommender(URM_train)
+        recommender.fit(topK=20)
+
+        evaluator = EvaluatorHoldout(URM_test, [5, 10], memory_budget = 300*8*30)
+
+        results_adaptive, n_users_adaptive = evaluator._run_evaluation_on_selected_users(recommender, evaluator.usersToEvaluate)
+        results_fixed, n_users_fixed = evaluator._run_evaluation_on_selected_users(recommender, evaluator.usersToEvaluate, block_size = 1000)
+
+        assert n_users_adaptive == n_users_fixed, "Different number of users evaluated"
+
+        for cutoff in [5, 10]:
+            for metric in ["PRECISION", "RECALL", "NDCG", "RMSE"]:
+                assert np.isclose(results_adaptive[cutoff][metric], results_fixed[cutoff][metric]), "Results depend on the batch size"
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import scipy.sparse as sps
+
+
+
+def get_item_popularity(URM_train):
+    """
+    :return: the number of non-zero interactions of each item, as used by the Novelty
+    """
+
+    URM_train = sps.csc_matrix(URM_train)
+    URM_train.eliminate_zeros()
+
+    return np.ediff1d(URM_train.indptr)
+
+
+
+
+class Evaluation_Context(object):
+    """
+    Test data of a split computed once and shared by all the evaluators built on it, e.g., by all the
+    evaluations of a hyperparameter search. Pass it to an evaluator in place of URM_test.
+    - The test URM as CSR with sorted indices
+    - The relevant items of all users in one contiguous buffer, the indices of the test URM, those of user u are in
+        relevant_items[relevant_items_offsets[u]:relevant_items_offsets[u+1]]
+    - The item popularity of the train data, used by the Novelty
+
+    It only contains numpy arrays and sparse matrices, therefore it can be pickled and sent to other processes.
+    """
+
+    def __init__(self, URM_test, URM_train = None):
+        """
+        :param URM_test:
+        :param URM_train:       Train data of the recommenders evaluated on this split, for the item popularity.
+                                If None the popularity is computed from the URM_train of the first recommender evaluated
+                                and reused as long as the recommenders have the same URM_train object.
+                                If a recommender has a URM_train with a different shape or number of interactions
+                                the popularity is computed from the URM_train of the recommender
+        """
+
+        super(Evaluation_Context, self).__init__()
+
+        if isinstance(URM_test, list):
+            raise ValueError("Evaluation_Context: List of URM_test not supported")
+
+        self.URM_test = sps.csr_matrix(URM_test, copy=True)
+        self.URM_test.sort_indices()
+
+        self.n_users, self.n_items = self.URM_test.shape
+
+        self.relevant_items = self.URM_test.indices
+        self.relevant_items_rating = self.URM_test.data
+        self.relevant_items_offsets = self.URM_test.indptr
+        self.n_relevant_items = np.ediff1d(self.URM_test.indptr)
+
+        if URM_train is not None:
+
+            if URM_train.shape[1] != self.n_items:
+                raise ValueError("Evaluation_Context: URM_train and URM_test have a different number of items, {} and {}".format(URM_train.shape[1], self.n_items))
+
+            self.item_popularity = get_item_popularity(URM_train)
+            self._URM_train_shape = URM_train.shape
+            self._URM_train_nnz = URM_train.nnz
+        else:
+            self.item_popularity = None
+            self._URM_train_shape = None
+            self._URM_train_nnz = None
+
+        # URM_train the last popularity was computed from, when not provided
+        self._item_popularity_URM_train = None
+        self._item_popularity_cache = None
+
+
+
+    def __getstate__(self):
+
+        # The cached popularity refers to a URM_train object of this process
+        state = self.__dict__.copy()
+        state["_item_popularity_URM_train"] = None
+        state["_item_popularity_cache"] = None
+
+        return state
+
+
+
+    def get_users_to_evaluate(self, minRatingsPerUser = 1, ignore_users = None):
+        """
+        :return: sorted array of the users with at least minRatingsPerUser test interactions, except ignore_users
+        """
+
+        users_to_evaluate_mask = self.n_relevant_items >= minRatingsPerUser
+
+        if ignore_users is not None:
+            users_to_evaluate_mask[np.asarray(ignore_users, dtype=np.int64)] = False
+
+        return np.arange(self.n_users)[users_to_evaluate_mask]
+
+
+
+    def get_user_relevant_items(self, user_id):
+        return self.relevant_items[self.relevant_items_offsets[user_id]:self.relevant_items_offsets[user_id+1]]
+
+
+    def get_user_test_ratings(self, user_id):
+        return self.relevant_items_rating[self.relevant_items_offsets[user_id]:self.relevant_items_offsets[user_id+1]]
+
+
+
+    def get_item_popularity(self, URM_train):
+        """
+        :param URM_train:   Train data of the recommender being evaluated, not used if the context has its own URM_train
+                            with the same shape and number of interactions
+        :return: the popularity of each item
+        """
+
+        if self.item_popularity is not None:
+
+            if URM_train is None or (URM_train.shape == self._URM_train_shape and URM_train.nnz == self._URM_train_nnz):
+                return self.item_popularity
+
+            if self._item_popularity_URM_train is not URM_train:
+                print("WARNING: Evaluation_Context: URM_train of the recommender different from the one of the context, "
+                      "shape {} and {} interactions instead of {} and {}. Computing the item popularity from the one of the recommender".format(
+                    URM_train.shape, URM_train.nnz, self._URM_train_shape, self._URM_train_nnz))
+
+        if self._item_popularity_URM_train is not URM_train:
+            self._item_popularity_cache = get_item_popularity(URM_train)
+            self._item_popularity_URM_train = URM_train
+
+        return self._item_popularity_cache
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, pickle
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Evaluation.Evaluation_Context import Evaluation_Context
+from Base.Evaluation.Evaluator import EvaluatorHoldout
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_shared_context_equals_URM_test(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(500, 300, density=0.05, format="csr", dtype=np.float64)
+        URM_test = sps.random(500, 300, density=0.02, format="csc", dtype=np.float64)
+
+        recommender = ItemKNNCFRecommender(URM_train)
+        recommender.fit(topK=20)
+
+        evaluation_context = Evaluation_Context(URM_test, URM_train = URM_train)
+
+        # The context is sent to other processes by pickling it
+        evaluation_context = pickle.loads(pickle.dumps(evaluation_context))
+
+        results_URM_test, _ = EvaluatorHoldout(URM_test, [5, 10], ignore_users = np.arange(20)).evaluateRecommender(recommender)
+        results_context, _ = EvaluatorHoldout(evaluation_context, [5, 10], ignore_users = np.arange(20)).evaluateRecommender(recommender)
+
+        for cutoff in [5, 10]:
+            for metric, value in results_URM_test[cutoff].items():
+                assert np.allclose(value, results_context[cutoff][metric], equal_nan = True), "{} different with the shared context".format(metric)
+
+        URM_test = URM_test.tocsr()
+
+        for user_id in [0, 250, 499]:
+            assert np.array_equal(evaluation_context.get_user_relevant_items(user_id), URM_test[user_id].indices)
+            assert np.array_equal(evaluation_context.get_user_test_ratings(user_id), URM_test[user_id].data)
+
+        assert evaluation_context.relevant_items.dtype == np.int32
+
+
+    def test_popularity_of_different_URM_train(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(500, 300, density=0.05, format="csr", dtype=np.float64)
+        URM_train_other = sps.random(500, 300, density=0.1, format="csr", dtype=np.float64)
+        URM_test = sps.random(500, 300, density=0.02, format="csr", dtype=np.float64)
+
+        evaluation_context = Evaluation_Context(URM_test, URM_train = URM_train)
+
+        assert np.array_equal(evaluation_context.get_item_popularity(URM_train), np.ediff1d(URM_train.tocsc().indptr))
+
+        # The popularity of the context is not used for a recommender with a different URM_train
+        assert np.array_equal(evaluation_context.get_item_popularity(URM_train_other), np.ediff1d(URM_train_other.tocsc().indptr))
+
+        recommender = ItemKNNCFRecommender(URM_train_other)
+        recommender.fit(topK=20)
+
+        results_URM_test, _ = EvaluatorHoldout(URM_test, [5]).evaluateRecommender(recommender)
+        results_context, _ = EvaluatorHoldout(evaluation_context, [5]).evaluateRecommender(recommender)
+
+        assert results_URM_test[5]["NOVELTY"] == results_context[5]["NOVELTY"]
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
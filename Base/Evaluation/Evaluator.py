@@ -8,12 +8,16 @@ Created on 26/06/18
 
 import numpy as np
 import scipy.sparse as sps
+from scipy.stats import norm
 import time, sys, copy
+import multiprocessing
 
 from enum import Enum
 
-from Base.Evaluation.metrics import roc_auc, precision, precision_min_test_len, recall, recall_min_test_len, MAP, ndcg, rr, arhr, rmse, \
-    Novelty, Coverage_Item, Metrics_Object, Coverage_User, Gini_Diversity, Shannon_Entropy, Diversity_MeanInterList, Diversity_Herfindahl
+from Base.Evaluation.Adaptive_Batch_Size import Adaptive_Batch_Size, get_peak_rss
+from Base.Evaluation.Evaluation_Context import Evaluation_Context
+from Base.Evaluation.metrics import average_precision_batch, MAP, Novelty, Coverage_Item, Metrics_Object, Coverage_User, Gini_Diversity, Shannon_Entropy, \
+    Diversity_MeanInterList, Diversity_Herfindahl
 
 
 class EvaluatorMetrics(Enum):
@@ -41,7 +45,7 @@ class EvaluatorMetrics(Enum):
 
 
 
-def create_empty_metrics_dict(n_items, n_users, URM_train, ignore_items, ignore_users, cutoff, diversity_similarity_object):
+def create_empty_metrics_dict(n_items, n_users, URM_train, ignore_items, ignore_users, cutoff, diversity_similarity_object, item_popularity = None):
 
     empty_dict = {}
 
@@ -68,7 +72,7 @@ def create_empty_metrics_dict(n_items, n_users, URM_train, ignore_items, ignore_
             empty_dict[metric.value] = Diversity_Herfindahl(n_items, ignore_items)
 
         elif metric == EvaluatorMetrics.NOVELTY:
-            empty_dict[metric.value] = Novelty(URM_train)
+            empty_dict[metric.value] = Novelty(URM_train, item_popularity = item_popularity)
 
         elif metric == EvaluatorMetrics.MAP:
             empty_dict[metric.value] = MAP()
@@ -132,43 +136,31 @@ class Evaluator(object):
         self.minRatingsPerUser = minRatingsPerUser
         self.exclude_seen = exclude_seen
 
-        if not isinstance(URM_test_list, list):
-            self.URM_test = URM_test_list.copy()
-            URM_test_list = [URM_test_list]
+        # The test data can be shared with other evaluators through an Evaluation_Context
+        if isinstance(URM_test_list, Evaluation_Context):
+            self.evaluation_context = URM_test_list
+        elif not isinstance(URM_test_list, list):
+            self.evaluation_context = Evaluation_Context(URM_test_list)
         else:
             raise ValueError("List of URM_test not supported")
 
         self.diversity_object = diversity_object
 
-        self.n_users = URM_test_list[0].shape[0]
-        self.n_items = URM_test_list[0].shape[1]
+        self.n_users = self.evaluation_context.n_users
+        self.n_items = self.evaluation_context.n_items
 
-        # Prune users with an insufficient number of ratings
         # During testing CSR is faster
-        self.URM_test_list = []
-        usersToEvaluate_mask = np.zeros(self.n_users, dtype=np.bool)
-
-        for URM_test in URM_test_list:
-
-            URM_test = sps.csr_matrix(URM_test)
-            self.URM_test_list.append(URM_test)
-
-            rows = URM_test.indptr
-            numRatings = np.ediff1d(rows)
-            new_mask = numRatings >= minRatingsPerUser
-
-            usersToEvaluate_mask = np.logical_or(usersToEvaluate_mask, new_mask)
-
-        self.usersToEvaluate = np.arange(self.n_users)[usersToEvaluate_mask]
-
+        self.URM_test = self.evaluation_context.URM_test
+        self.URM_test_list = [self.URM_test]
 
         if ignore_users is not None:
             print("Ignoring {} Users".format(len(ignore_users)))
             self.ignore_users_ID = np.array(ignore_users)
-            self.usersToEvaluate = set(self.usersToEvaluate) - set(ignore_users)
         else:
             self.ignore_users_ID = np.array([])
 
+        # Prune users with an insufficient number of ratings
+        self.usersToEvaluate = self.evaluation_context.get_users_to_evaluate(minRatingsPerUser, ignore_users = ignore_users)
 
         self.usersToEvaluate = list(self.usersToEvaluate)
 
@@ -187,18 +179,130 @@ class Evaluator(object):
 
 
 
-    def get_user_relevant_items(self, user_id):
+    def evaluateRecommenderMetric(self, recommender_object, metric, cutoff = None, n_users_sample = None, random_seed = 42, confidence = 0.95):
+        """
+        Evaluates a single metric at a single cutoff, e.g., for the validation steps of the early stopping.
+        This implementation evaluates all the metrics and has no confidence interval, subclasses may provide a faster one
+        :param metric:              name of the metric, see EvaluatorMetrics
+        :param cutoff:              if None the first one of cutoff_list
+        :param n_users_sample:      if not None, the metric is computed on a fixed random sample of n_users_sample users
+        :param random_seed:         seed of the sample, the same seed gives the same users in all the calls
+        :param confidence:          confidence level of the interval
+        :return: the value of the metric and the half width of its confidence interval, None if not available
+        """
+
+        if n_users_sample is not None:
+            raise ValueError("{}: sampling the users is not supported by this evaluator class".format(self.EVALUATOR_NAME))
+
+        if cutoff is None:
+            cutoff = self.cutoff_list[0]
+
+        results_dict, _ = self.evaluateRecommender(recommender_object)
 
-        assert self.URM_test.getformat() == "csr", "Evaluator_Base_Class: URM_test is not CSR, this will cause errors in getting relevant items"
+        return results_dict[cutoff][metric], None
 
-        return self.URM_test.indices[self.URM_test.indptr[user_id]:self.URM_test.indptr[user_id+1]]
+
+
+    def get_user_relevant_items(self, user_id):
+        return self.evaluation_context.get_user_relevant_items(user_id)
 
 
     def get_user_test_ratings(self, user_id):
+        return self.evaluation_context.get_user_test_ratings(user_id)
+
 
-        assert self.URM_test.getformat() == "csr", "Evaluator_Base_Class: URM_test is not CSR, this will cause errors in relevant items ratings"
 
-        return self.URM_test.data[self.URM_test.indptr[user_id]:self.URM_test.indptr[user_id+1]]
+    def _create_empty_results_dict(self, recommender_object, n_users):
+        """
+        :return: the results dictionary, where the metrics not computed by a Metrics_Object are arrays with the value of each user
+        """
+
+        results_dict = {}
+
+        # Computed once for all the cutoffs and reused while the URM_train does not change
+        item_popularity = self.evaluation_context.get_item_popularity(recommender_object.get_URM_train())
+
+        for cutoff in self.cutoff_list:
+            results_dict[cutoff] = create_empty_metrics_dict(self.n_items, self.n_users,
+                                                             recommender_object.get_URM_train(),
+                                                             self.ignore_items_ID,
+                                                             self.ignore_users_ID,
+                                                             cutoff,
+                                                             self.diversity_object,
+                                                             item_popularity = item_popularity)
+
+            # The values of each user are summed at the end, in this way they do not depend on how the users are split
+            for key, value in results_dict[cutoff].items():
+                if not isinstance(value, Metrics_Object):
+                    results_dict[cutoff][key] = np.zeros(n_users, dtype=np.float64)
+
+        return results_dict
+
+
+
+    def _add_batch_metrics(self, results_dict, batch_user_slice, test_user_batch_array, URM_test_batch, recommended_items_batch, rmse_batch):
+        """
+        Computes the metrics of a batch of users and adds them to results_dict
+        :param batch_user_slice:            position of the users in the arrays of results_dict
+        :param URM_test_batch:              rows of URM_test of the users, with sorted indices
+        :param recommended_items_batch:     matrix (n_users, max_cutoff) with the ranking of each user, padded with -1 if shorter
+        :param rmse_batch:                  RMSE of each user, it does not depend on the cutoff
+        """
+
+        n_relevant_array = np.ediff1d(URM_test_batch.indptr)
+        recommended_mask = recommended_items_batch >= 0
+
+        is_relevant_batch, relevance_batch = _get_csr_values(URM_test_batch,
+                                                             np.repeat(np.arange(len(test_user_batch_array)), recommended_items_batch.shape[1]),
+                                                             recommended_items_batch.ravel())
+
+        # The padding must not match the last item of the previous row
+        is_relevant_batch = np.logical_and(is_relevant_batch.reshape(recommended_items_batch.shape), recommended_mask)
+        relevance_batch = np.where(is_relevant_batch, relevance_batch.reshape(recommended_items_batch.shape), 0.0)
+
+        accuracy_metrics_dict = _compute_accuracy_metrics_batch(is_relevant_batch, relevance_batch, n_relevant_array,
+                                                                _ideal_dcg_batch(URM_test_batch), self.cutoff_list)
+
+        for cutoff in self.cutoff_list:
+
+            results_current_cutoff = results_dict[cutoff]
+
+            for key, values in accuracy_metrics_dict[cutoff].items():
+                results_current_cutoff[key][batch_user_slice] = values
+
+            results_current_cutoff[EvaluatorMetrics.RMSE.value][batch_user_slice] = rmse_batch
+            results_current_cutoff[EvaluatorMetrics.MAP.value].add_recommendations_batch(is_relevant_batch[:, 0:cutoff], n_relevant_array)
+
+            recommended_items_current_cutoff = recommended_items_batch[:, 0:cutoff]
+
+            metric_object_list = [results_current_cutoff[metric.value] for metric in [EvaluatorMetrics.NOVELTY,
+                                                                                    EvaluatorMetrics.DIVERSITY_GINI,
+                                                                                    EvaluatorMetrics.SHANNON_ENTROPY,
+                                                                                    EvaluatorMetrics.COVERAGE_ITEM,
+                                                                                    EvaluatorMetrics.DIVERSITY_MEAN_INTER_LIST,
+                                                                                    EvaluatorMetrics.DIVERSITY_HERFINDAHL,
+                                                                                    EvaluatorMetrics.DIVERSITY_SIMILARITY]
+                                  if metric.value in results_current_cutoff]
+
+            coverage_user_object = results_current_cutoff[EvaluatorMetrics.COVERAGE_USER.value]
+
+            if recommended_mask[:, 0:cutoff].all():
+                for metric_object in metric_object_list:
+                    metric_object.add_recommendations_batch(recommended_items_current_cutoff)
+
+                coverage_user_object.add_recommendations_batch(recommended_items_current_cutoff, test_user_batch_array)
+
+            else:
+                # Rankings shorter than the cutoff are added one at a time without the padding
+                for batch_user_index in range(len(test_user_batch_array)):
+
+                    recommended_items = recommended_items_current_cutoff[batch_user_index]
+                    recommended_items = recommended_items[recommended_items >= 0]
+
+                    for metric_object in metric_object_list:
+                        metric_object.add_recommendations(recommended_items)
+
+                    coverage_user_object.add_recommendations(recommended_items, test_user_batch_array[batch_user_index])
 
 
 
@@ -313,10 +417,28 @@ class EvaluatorHoldout(Evaluator):
 
     EVALUATOR_NAME = "EvaluatorHoldout"
 
+    # More chunks than processes balance users requiring a different time
+    PARALLEL_CHUNKS_PER_PROCESS = 4
+
     def __init__(self, URM_test_list, cutoff_list, minRatingsPerUser=1, exclude_seen=True,
                  diversity_object = None,
                  ignore_items = None,
-                 ignore_users = None):
+                 ignore_users = None,
+                 memory_budget = 8e8,
+                 peak_rss_ceiling = None,
+                 n_processes = 1):
+        """
+        :param memory_budget:       Bytes available for the scores of a batch of users, see Adaptive_Batch_Size
+        :param peak_rss_ceiling:    Bytes, the batch size is reduced if the peak RSS of the process exceeds it. If None it is not checked
+        :param n_processes:         Number of processes evaluating the users, if None all the available cores are used.
+                                    The results are identical to the ones of a single process
+        """
+
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+
+        if n_processes < 1:
+            raise ValueError("EvaluatorHoldout: value for paramether 'n_processes' must be a positive integer. Passed value was '{}'".format(n_processes))
 
 
         super(EvaluatorHoldout, self).__init__(URM_test_list, cutoff_list,
@@ -324,15 +446,91 @@ class EvaluatorHoldout(Evaluator):
                                                minRatingsPerUser=minRatingsPerUser, exclude_seen=exclude_seen,
                                                ignore_items = ignore_items, ignore_users = ignore_users)
 
+        self.memory_budget = memory_budget
+        self.peak_rss_ceiling = peak_rss_ceiling
+        self.n_processes = n_processes
+
+        # Test data of the users evaluated by evaluateRecommenderMetric, for each (n_users_sample, random_seed)
+        self._metric_users_batch_cache = {}
 
 
 
 
     def _run_evaluation_on_selected_users(self, recommender_object, usersToEvaluate, block_size = None):
+        """
+        :param block_size:      Number of users of each batch, if None it is chosen by an Adaptive_Batch_Size
+        """
+
+        if self.n_processes > 1 and len(usersToEvaluate) > 1:
+            results_dict, n_users_evaluated = self._run_parallel_evaluation_on_selected_users(recommender_object, usersToEvaluate, block_size = block_size)
+        else:
+            results_dict, n_users_evaluated = self._evaluate_users(recommender_object, usersToEvaluate, block_size = block_size)
+
+        _sum_user_values(results_dict)
+
+        return results_dict, n_users_evaluated
+
+
 
 
+    def _run_parallel_evaluation_on_selected_users(self, recommender_object, usersToEvaluate, block_size = None):
+        """
+        Splits the users in contiguous chunks evaluated by a pool of processes and merges the results in the order of the users.
+        Where fork is available the processes inherit the recommender, otherwise it is pickled once for each process.
+        """
+
+        n_processes = min(self.n_processes, len(usersToEvaluate))
+        n_chunks = min(n_processes * self.PARALLEL_CHUNKS_PER_PROCESS, len(usersToEvaluate))
+
+        # Each process has its own batches
+        chunk_args_list = [(users_chunk, block_size, self.memory_budget/n_processes)
+                           for users_chunk in np.array_split(np.array(usersToEvaluate), n_chunks)]
+
+        start_time = time.time()
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            _parallel_worker_init(self, recommender_object)
+            pool = multiprocessing.get_context("fork").Pool(processes = n_processes)
+        else:
+            pool = multiprocessing.Pool(processes = n_processes, initializer = _parallel_worker_init, initargs = (self, recommender_object))
+
+        try:
+            with pool:
+                chunk_results_list = pool.starmap(_parallel_worker_evaluate_users, chunk_args_list)
+        finally:
+            _parallel_worker_init(None, None)
+
+        results_dict = _merge_results_dict([chunk_results_dict for chunk_results_dict, _ in chunk_results_list])
+        n_users_evaluated = sum(n_users_evaluated_chunk for _, n_users_evaluated_chunk in chunk_results_list)
+
+        print("EvaluatorHoldout: Processed {} users with {} processes in {:.2f} seconds. Users per second: {:.0f}".format(
+                      n_users_evaluated, n_processes,
+                      time.time()-start_time,
+                      float(n_users_evaluated)/(time.time()-start_time)))
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        return results_dict, n_users_evaluated
+
+
+
+
+    def _evaluate_users(self, recommender_object, usersToEvaluate, block_size = None, memory_budget = None):
+        """
+        :param block_size:      Number of users of each batch, if None it is chosen by an Adaptive_Batch_Size
+        :param memory_budget:   Bytes available for the scores of a batch, if None the one of the evaluator
+        :return: the results dictionary, where the metrics not computed by a Metrics_Object are arrays with the value of each user
+        """
+
+        if memory_budget is None:
+            memory_budget = self.memory_budget
+
         if block_size is None:
-            block_size = min(1000, int(1e8/self.n_items))
+            batch_size_object = Adaptive_Batch_Size(self.n_items, memory_budget = memory_budget,
+                                                    peak_rss_ceiling = self.peak_rss_ceiling)
+        else:
+            batch_size_object = None
 
 
 
@@ -340,23 +538,28 @@ class EvaluatorHoldout(Evaluator):
         start_time_print = time.time()
 
 
-        results_dict = {}
-
-        for cutoff in self.cutoff_list:
-            results_dict[cutoff] = create_empty_metrics_dict(self.n_items, self.n_users,
-                                                             recommender_object.get_URM_train(),
-                                                             self.ignore_items_ID,
-                                                             self.ignore_users_ID,
-                                                             cutoff,
-                                                             self.diversity_object)
+        results_dict = self._create_empty_results_dict(recommender_object, len(usersToEvaluate))
 
         n_users_evaluated = 0
 
+        # The sparse scores do not have the seen and ignored items removed, they are removed when computing the RMSE
+        URM_train = recommender_object.URM_train
+
+        removed_items_mask = np.zeros(self.n_items, dtype=bool)
+
+        if self.ignore_items_flag:
+            removed_items_mask[self.ignore_items_ID.astype(np.int)] = True
+
         # Start from -block_size to ensure it to be 0 at the first block
         user_batch_start = 0
         user_batch_end = 0
 
-        while user_batch_start < len(self.usersToEvaluate):
+        while user_batch_start < len(usersToEvaluate):
+
+            if batch_size_object is not None:
+                block_size = batch_size_object.get_batch_size()
+                batch_start_time = time.time()
+                batch_peak_rss = get_peak_rss()
 
             user_batch_end = user_batch_start + block_size
             user_batch_end = min(user_batch_end, len(usersToEvaluate))
@@ -370,70 +573,59 @@ class EvaluatorHoldout(Evaluator):
                                                                       cutoff = self.max_cutoff,
                                                                       remove_top_pop_flag=False,
                                                                       remove_CustomItems_flag=self.ignore_items_flag,
-                                                                      return_scores = True
+                                                                      return_scores = True,
+                                                                      sparse_scores = True
                                                                      )
 
 
-            # Compute recommendation quality for each user in batch
-            for batch_user_index in range(len(recommended_items_batch_list)):
+            # All the users of the batch have a ranking of max_cutoff items
+            recommended_items_batch = np.array(recommended_items_batch_list, dtype=np.int64).reshape((len(test_user_batch_array), -1))
 
-                test_user = test_user_batch_array[batch_user_index]
-
-                relevant_items = self.get_user_relevant_items(test_user)
-                relevant_items_rating = self.get_user_test_ratings(test_user)
+            # Being the URM CSR, the indices are the non-zero column indexes
+            URM_test_batch = self.URM_test[test_user_batch_array]
+            URM_test_batch.sort_indices()
 
-                all_items_predicted_ratings = scores_batch[batch_user_index]
-                user_rmse = rmse(all_items_predicted_ratings, relevant_items, relevant_items_rating)
+            relevant_user_index = np.repeat(np.arange(len(test_user_batch_array)), np.ediff1d(URM_test_batch.indptr))
 
-                # Being the URM CSR, the indices are the non-zero column indexes
-                recommended_items = recommended_items_batch_list[batch_user_index]
-                is_relevant = np.in1d(recommended_items, relevant_items, assume_unique=True)
+            # The RMSE does not depend on the cutoff
+            if sps.issparse(scores_batch):
+                _, relevant_items_predicted_ratings = _get_csr_values(scores_batch, relevant_user_index, URM_test_batch.indices)
+                relevant_items_removed_mask = removed_items_mask[URM_test_batch.indices]
 
-                n_users_evaluated += 1
+                if self.exclude_seen:
+                    relevant_items_seen_mask, _ = _get_csr_values(URM_train[test_user_batch_array], relevant_user_index, URM_test_batch.indices)
+                    relevant_items_removed_mask = np.logical_or(relevant_items_removed_mask, relevant_items_seen_mask)
 
-                for cutoff in self.cutoff_list:
+                relevant_items_predicted_ratings[relevant_items_removed_mask] = -np.inf
 
-                    results_current_cutoff = results_dict[cutoff]
+            else:
+                relevant_items_predicted_ratings = scores_batch[relevant_user_index, URM_test_batch.indices]
 
-                    is_relevant_current_cutoff = is_relevant[0:cutoff]
-                    recommended_items_current_cutoff = recommended_items[0:cutoff]
+            rmse_batch = _rmse_batch(relevant_items_predicted_ratings, URM_test_batch.data, relevant_user_index, len(test_user_batch_array))
 
-                    results_current_cutoff[EvaluatorMetrics.ROC_AUC.value]              += roc_auc(is_relevant_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.PRECISION.value]            += precision(is_relevant_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.PRECISION_TEST_LEN.value]   += precision_min_test_len(is_relevant_current_cutoff, len(relevant_items))
-                    results_current_cutoff[EvaluatorMetrics.RECALL.value]               += recall(is_relevant_current_cutoff, relevant_items)
-                    results_current_cutoff[EvaluatorMetrics.RECALL_TEST_LEN.value]      += recall_min_test_len(is_relevant_current_cutoff, relevant_items)
-                    results_current_cutoff[EvaluatorMetrics.MRR.value]                  += rr(is_relevant_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.NDCG.value]                 += ndcg(recommended_items_current_cutoff, relevant_items, relevance=self.get_user_test_ratings(test_user), at=cutoff)
-                    results_current_cutoff[EvaluatorMetrics.HIT_RATE.value]             += is_relevant_current_cutoff.sum()
-                    results_current_cutoff[EvaluatorMetrics.ARHR.value]                 += arhr(is_relevant_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.RMSE.value]                 += user_rmse
+            self._add_batch_metrics(results_dict, slice(n_users_evaluated, n_users_evaluated + len(test_user_batch_array)),
+                                    test_user_batch_array, URM_test_batch, recommended_items_batch, rmse_batch)
 
-                    results_current_cutoff[EvaluatorMetrics.MAP.value].add_recommendations(is_relevant_current_cutoff, relevant_items)
-                    results_current_cutoff[EvaluatorMetrics.NOVELTY.value].add_recommendations(recommended_items_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.DIVERSITY_GINI.value].add_recommendations(recommended_items_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.SHANNON_ENTROPY.value].add_recommendations(recommended_items_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.COVERAGE_ITEM.value].add_recommendations(recommended_items_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.COVERAGE_USER.value].add_recommendations(recommended_items_current_cutoff, test_user)
-                    results_current_cutoff[EvaluatorMetrics.DIVERSITY_MEAN_INTER_LIST.value].add_recommendations(recommended_items_current_cutoff)
-                    results_current_cutoff[EvaluatorMetrics.DIVERSITY_HERFINDAHL.value].add_recommendations(recommended_items_current_cutoff)
+            n_users_evaluated += len(test_user_batch_array)
 
-                    if EvaluatorMetrics.DIVERSITY_SIMILARITY.value in results_current_cutoff:
-                        results_current_cutoff[EvaluatorMetrics.DIVERSITY_SIMILARITY.value].add_recommendations(recommended_items_current_cutoff)
+            if time.time() - start_time_print > 30 or n_users_evaluated==len(usersToEvaluate):
+                print("EvaluatorHoldout: Processed {} ( {:.2f}% ) in {:.2f} seconds. Users per second: {:.0f}".format(
+                              n_users_evaluated,
+                              100.0* float(n_users_evaluated)/len(usersToEvaluate),
+                              time.time()-start_time,
+                              float(n_users_evaluated)/(time.time()-start_time)))
 
+                sys.stdout.flush()
+                sys.stderr.flush()
 
-                if time.time() - start_time_print > 30 or n_users_evaluated==len(self.usersToEvaluate):
-                    print("EvaluatorHoldout: Processed {} ( {:.2f}% ) in {:.2f} seconds. Users per second: {:.0f}".format(
-                                  n_users_evaluated,
-                                  100.0* float(n_users_evaluated)/len(self.usersToEvaluate),
-                                  time.time()-start_time,
-                                  float(n_users_evaluated)/(time.time()-start_time)))
+                start_time_print = time.time()
 
-                    sys.stdout.flush()
-                    sys.stderr.flush()
 
-                    start_time_print = time.time()
+            if batch_size_object is not None:
+                scores_bytes = scores_batch.data.nbytes + scores_batch.indices.nbytes if sps.issparse(scores_batch) else scores_batch.nbytes
 
+                batch_size_object.update(len(test_user_batch_array), time.time() - batch_start_time, scores_bytes = scores_bytes,
+                                         peak_rss_before = batch_peak_rss, peak_rss_after = get_peak_rss())
 
 
         return results_dict, n_users_evaluated
@@ -498,424 +690,453 @@ class EvaluatorHoldout(Evaluator):
 
 
 
+    # Metrics with a value for each user that evaluateRecommenderMetric computes from the ranking alone
+    USER_METRICS_LIST = [EvaluatorMetrics.ROC_AUC.value,
+                         EvaluatorMetrics.PRECISION.value,
+                         EvaluatorMetrics.PRECISION_TEST_LEN.value,
+                         EvaluatorMetrics.RECALL.value,
+                         EvaluatorMetrics.RECALL_TEST_LEN.value,
+                         EvaluatorMetrics.MAP.value,
+                         EvaluatorMetrics.MRR.value,
+                         EvaluatorMetrics.NDCG.value,
+                         EvaluatorMetrics.HIT_RATE.value,
+                         EvaluatorMetrics.ARHR.value]
 
 
+    def _get_metric_users_batch_list(self, n_users_sample, random_seed):
+        """
+        Selects the users and precomputes the test data of each batch once, the following calls reuse it
+        :return: list of tuples (test_user_batch_array, URM_test_batch, n_relevant_array, ideal_dcg_array)
+        """
 
-#
-#
-# import multiprocessing
-# from functools import partial
-#
-#
-#
-# class _ParallelEvaluator_batch(Evaluator):
-#     """EvaluatorHoldout"""
-#
-#     EVALUATOR_NAME = "SequentialEvaluator_Class"
-#
-#     def __init__(self, URM_test_list, cutoff_list, minRatingsPerUser=1, exclude_seen=True,
-#                  diversity_object = None,
-#                  ignore_items = None,
-#                  ignore_users = None):
-#
-#
-#         super(_ParallelEvaluator_batch, self).__init__(URM_test_list, cutoff_list,
-#                             diversity_object = diversity_object,
-#                             minRatingsPerUser=minRatingsPerUser, exclude_seen=exclude_seen,
-#                             ignore_items = ignore_items, ignore_users = ignore_users)
-#
-#
-#
-#     def evaluateRecommender(self, recommender_object):
-#         """
-#         :param recommender_object: the trained recommender object, a Recommender subclass
-#         :param URM_test_list: list of URMs to test the recommender against, or a single URM object
-#         :param cutoff_list: list of cutoffs to be use to report the scores, or a single cutoff
-#         """
-#
-#         results_dict, n_users_evaluated = self._run_evaluation_on_selected_users(recommender_object, self.usersToEvaluate)
-#
-#         return (results_dict, n_users_evaluated)
-#
-#
-#
-# def _run_parallel_evaluator(evaluator_object, recommender_object):
-#
-#     results_dict, _ = evaluator_object.evaluateRecommender(recommender_object)
-#
-#     return results_dict
-#
-#
-#
-# def _merge_results_dict(results_dict_1, results_dict_2, n_users_2):
-#
-#     assert results_dict_1.keys() == results_dict_2.keys(), "_merge_results_dict: the two result dictionaries have different cutoff values"
-#
-#
-#     merged_dict = copy.deepcopy(results_dict_1)
-#
-#     for cutoff in merged_dict.keys():
-#
-#         merged_dict_cutoff = merged_dict[cutoff]
-#         results_dict_2_cutoff = results_dict_2[cutoff]
-#
-#         for key in merged_dict_cutoff.keys():
-#
-#             result_metric = merged_dict_cutoff[key]
-#
-#             if result_metric is Metrics_Object:
-#                 merged_dict_cutoff[key].merge_with_other(results_dict_2_cutoff[key])
-#             else:
-#                 merged_dict_cutoff[key] = result_metric + results_dict_2_cutoff[key]*n_users_2
-#
-
-
-#
-# class ParallelEvaluator(Evaluator):
-#     """ParallelEvaluator"""
-#
-#     EVALUATOR_NAME = "ParallelEvaluator_Class"
-#
-#     def __init__(self, URM_test_list, cutoff_list, minRatingsPerUser=1, exclude_seen=True,
-#                  diversity_object = None,
-#                  ignore_items = None,
-#                  ignore_users = None):
-#
-#         assert False, "ParallelEvaluator is not a stable implementation"
-#
-#         super(ParallelEvaluator, self).__init__(URM_test_list, cutoff_list,
-#                             diversity_object = diversity_object,
-#                             minRatingsPerUser=minRatingsPerUser, exclude_seen=exclude_seen,
-#                             ignore_items = ignore_items, ignore_users = ignore_users)
-#
-#
-#
-#     def evaluateRecommender(self, recommender_object, n_processes = None):
-#         """
-#         :param recommender_object: the trained recommender object, a Recommender subclass
-#         :param URM_test_list: list of URMs to test the recommender against, or a single URM object
-#         :param cutoff_list: list of cutoffs to be use to report the scores, or a single cutoff
-#         """
-#
-#         if n_processes is None:
-#             n_processes = int(multiprocessing.cpu_count()/2)
-#
-#         start_time = time.time()
-#
-#
-#         # Split the users to evaluate
-#         n_processes = min(n_processes, len(self.usersToEvaluate))
-#         batch_len = int(len(self.usersToEvaluate)/n_processes)
-#         batch_len = max(batch_len, 1)
-#
-#         sequential_evaluators_list = []
-#         sequential_evaluators_n_users_list = []
-#
-#         for n_evaluator in range(n_processes):
-#
-#             stat_user = n_evaluator*batch_len
-#             end_user = min((n_evaluator+1)*batch_len, len(self.usersToEvaluate))
-#
-#             if n_evaluator == n_processes-1:
-#                 end_user = len(self.usersToEvaluate)
-#
-#
-#             batch_users = self.usersToEvaluate[stat_user:end_user]
-#             sequential_evaluators_n_users_list.append(len(batch_users))
-#
-#             not_in_batch_users = np.in1d(self.usersToEvaluate, batch_users, invert=True)
-#             not_in_batch_users = np.array(self.usersToEvaluate)[not_in_batch_users]
-#
-#             new_evaluator = _ParallelEvaluator_batch(self.URM_test, self.cutoff_list, ignore_users=not_in_batch_users)
-#
-#             sequential_evaluators_list.append(new_evaluator)
-#
-#
-#
-#         if self.ignore_items_flag:
-#             recommender_object.set_items_to_ignore(self.ignore_items_ID)
-#
-#
-#         run_parallel_evaluator_partial = partial(_run_parallel_evaluator, recommender_object = recommender_object)
-#
-#         pool = multiprocessing.Pool(processes = n_processes, maxtasksperchild=1)
-#         resultList = pool.map(run_parallel_evaluator_partial, sequential_evaluators_list)
-#
-#
-#
-#         print("ParallelEvaluator: Processed {} ( {:.2f}% ) in {:.2f} seconds. Users per second: {:.0f}".format(
-#                       len(self.usersToEvaluate),
-#                       100.0* float(len(self.usersToEvaluate))/len(self.usersToEvaluate),
-#                       time.time()-start_time,
-#                       float(len(self.usersToEvaluate))/(time.time()-start_time)))
-#
-#         sys.stdout.flush()
-#         sys.stderr.flush()
-#
-#
-#
-#         results_dict = {}
-#         n_users_evaluated = 0
-#
-#         for cutoff in self.cutoff_list:
-#              results_dict[cutoff] = create_empty_metrics_dict(self.n_items, self.n_users,
-#                                                              recommender_object.URM_train,
-#                                                              self.ignore_items_ID,
-#                                                              self.ignore_users_ID,
-#                                                              cutoff,
-#                                                              self.diversity_object)
-#
-#
-#         for new_result_index in range(len(resultList)):
-#
-#             new_result, n_users_evaluated_batch = resultList[new_result_index]
-#             n_users_evaluated += n_users_evaluated_batch
-#
-#             results_dict = _merge_results_dict(results_dict, new_result, n_users_evaluated_batch)
-#
-#
-#
-#
-#
-#
-#         for cutoff in self.cutoff_list:
-#             for key in results_dict[cutoff].keys():
-#                 results_dict[cutoff][key] /= len(self.usersToEvaluate)
-#
-#
-#
-#
-#
-#         if n_users_evaluated > 0:
-#
-#             for cutoff in self.cutoff_list:
-#
-#                 results_current_cutoff = results_dict[cutoff]
-#
-#                 for key in results_current_cutoff.keys():
-#
-#                     value = results_current_cutoff[key]
-#
-#                     if isinstance(value, Metrics_Object):
-#                         results_current_cutoff[key] = value.get_metric_value()
-#                     else:
-#                         results_current_cutoff[key] = value/n_users_evaluated
-#
-#                 precision_ = results_current_cutoff[EvaluatorMetrics.PRECISION.value]
-#                 recall_ = results_current_cutoff[EvaluatorMetrics.RECALL.value]
-#
-#                 if precision_ + recall_ != 0:
-#                     results_current_cutoff[EvaluatorMetrics.F1.value] = 2 * (precision_ * recall_) / (precision_ + recall_)
-#
-#
-#         else:
-#             print("WARNING: No users had a sufficient number of relevant items")
-#
-#
-#
-#
-#         sequential_evaluators_list = None
-#         sequential_evaluators_n_users_list = None
-#
-#
-#         if self.ignore_items_flag:
-#             recommender_object.reset_items_to_ignore()
-#
-#
-#
-#         results_run_string = get_result_string(results_dict)
-#
-#         return (results_dict, results_run_string)
-#
-#
-#
+        cache_key = (n_users_sample, random_seed)
 
+        if cache_key in self._metric_users_batch_cache:
+            return self._metric_users_batch_cache[cache_key]
 
+        usersToEvaluate = np.array(self.usersToEvaluate, dtype=np.int64)
 
+        if n_users_sample is not None and n_users_sample < len(usersToEvaluate):
+            usersToEvaluate = np.sort(np.random.RandomState(random_seed).choice(usersToEvaluate, n_users_sample, replace=False))
 
+        # Users whose dense scores fit in the memory budget
+        block_size = max(1, int(self.memory_budget // (max(1, self.n_items) * 8)))
 
-class EvaluatorNegativeItemSample(Evaluator):
-    """EvaluatorNegativeItemSample"""
+        users_batch_list = []
 
-    EVALUATOR_NAME = "EvaluatorNegativeItemSample"
+        for user_batch_start in range(0, len(usersToEvaluate), block_size):
 
-    def __init__(self, URM_test_list, URM_test_negative, cutoff_list, minRatingsPerUser=1, exclude_seen=True,
-                 diversity_object = None,
-                 ignore_items = None,
-                 ignore_users = None):
-        """
+            test_user_batch_array = usersToEvaluate[user_batch_start:user_batch_start + block_size]
 
-        :param URM_test_list:
-        :param URM_test_negative: Items to rank together with the test items
-        :param cutoff_list:
-        :param minRatingsPerUser:
-        :param exclude_seen:
-        :param diversity_object:
-        :param ignore_items:
-        :param ignore_users:
+            URM_test_batch = self.URM_test[test_user_batch_array]
+            URM_test_batch.sort_indices()
+
+            users_batch_list.append((test_user_batch_array, URM_test_batch, np.ediff1d(URM_test_batch.indptr), _ideal_dcg_batch(URM_test_batch)))
+
+        self._metric_users_batch_cache[cache_key] = users_batch_list
+
+        return users_batch_list
+
+
+
+    def evaluateRecommenderMetric(self, recommender_object, metric, cutoff = None, n_users_sample = None, random_seed = 42, confidence = 0.95):
+        """
+        Evaluates a single metric at a single cutoff, e.g., for the validation steps of the early stopping.
+        The metrics in USER_METRICS_LIST are computed from the ranking alone, without the scores and the other metrics.
+        The confidence interval is the normal approximation of the mean of the users, with the finite population correction,
+        therefore it is zero when all the users are evaluated
+        :param metric:              name of the metric, see EvaluatorMetrics
+        :param cutoff:              if None the first one of cutoff_list
+        :param n_users_sample:      if not None, the metric is computed on a fixed random sample of n_users_sample users
+        :param random_seed:         seed of the sample, the same seed gives the same users in all the calls
+        :param confidence:          confidence level of the interval
+        :return: the value of the metric and the half width of its confidence interval
         """
 
+        if cutoff is None:
+            cutoff = self.cutoff_list[0]
 
-        super(EvaluatorNegativeItemSample, self).__init__(URM_test_list, cutoff_list,
-                                                          diversity_object = diversity_object,
-                                                          minRatingsPerUser=minRatingsPerUser, exclude_seen=exclude_seen,
-                                                          ignore_items = ignore_items, ignore_users = ignore_users)
+        if metric not in self.USER_METRICS_LIST:
+            if n_users_sample is not None:
+                raise ValueError("EvaluatorHoldout: sampling the users is supported only for metrics in {}, provided was '{}'".format(self.USER_METRICS_LIST, metric))
 
+            return super(EvaluatorHoldout, self).evaluateRecommenderMetric(recommender_object, metric, cutoff = cutoff)
 
-        self.URM_test_negative = sps.csr_matrix(URM_test_negative)
+        if self.ignore_items_flag:
+            recommender_object.set_items_to_ignore(self.ignore_items_ID)
 
+        user_values_list = []
 
+        for test_user_batch_array, URM_test_batch, n_relevant_array, ideal_dcg_array in self._get_metric_users_batch_list(n_users_sample, random_seed):
 
-    def user_specific_remove_items(self, recommender_object, user_id):
+            recommended_items_batch_list = recommender_object.recommend(test_user_batch_array,
+                                                                        remove_seen_flag=self.exclude_seen,
+                                                                        cutoff = cutoff,
+                                                                        remove_top_pop_flag=False,
+                                                                        remove_CustomItems_flag=self.ignore_items_flag)
 
-        self.ignore_items_flag = True
+            recommended_items_batch = np.array(recommended_items_batch_list, dtype=np.int64).reshape((len(test_user_batch_array), -1))
 
-        self._global_ignore_items_ID = self.ignore_items_ID.copy()
+            is_relevant_batch, relevance_batch = _get_csr_values(URM_test_batch,
+                                                                 np.repeat(np.arange(len(test_user_batch_array)), recommended_items_batch.shape[1]),
+                                                                 recommended_items_batch.ravel())
 
-        #items_to_remove_for_user = self.__all_items.copy()
-        items_to_remove_for_user_mask = self.__all_items_mask.copy()
+            is_relevant_batch = is_relevant_batch.reshape(recommended_items_batch.shape)
+            relevance_batch = relevance_batch.reshape(recommended_items_batch.shape)
 
-        ### ADD negative samples
-        start_pos = self.URM_test_negative.indptr[user_id]
-        end_pos = self.URM_test_negative.indptr[user_id+1]
+            if metric == EvaluatorMetrics.MAP.value:
+                user_values_list.append(average_precision_batch(is_relevant_batch, n_relevant_array))
+            else:
+                accuracy_metrics_dict = _compute_accuracy_metrics_batch(is_relevant_batch, relevance_batch, n_relevant_array, ideal_dcg_array, [cutoff])
+                user_values_list.append(accuracy_metrics_dict[cutoff][metric])
 
-        items_to_remove_for_user_mask[self.URM_test_negative.indices[start_pos:end_pos]] = False
+        if self.ignore_items_flag:
+            recommender_object.reset_items_to_ignore()
+
+        user_values = np.concatenate(user_values_list) if len(user_values_list) > 0 else np.zeros(0)
+        n_users = len(user_values)
 
-        ### ADD positive samples
-        start_pos = self.URM_test.indptr[user_id]
-        end_pos = self.URM_test.indptr[user_id+1]
+        if n_users == 0:
+            print("WARNING: No users had a sufficient number of relevant items")
+            return 0.0, 0.0
 
-        items_to_remove_for_user_mask[self.URM_test.indices[start_pos:end_pos]] = False
+        metric_value = user_values.sum()/n_users
 
-        recommender_object.set_items_to_ignore(self.__all_items[items_to_remove_for_user_mask])
+        # The value on all the users is exact
+        if n_users == len(self.usersToEvaluate):
+            return metric_value, 0.0
 
+        if n_users < 2:
+            return metric_value, np.inf
 
+        finite_population_correction = np.sqrt((len(self.usersToEvaluate) - n_users) / (len(self.usersToEvaluate) - 1))
+        standard_error = np.std(user_values, ddof=1) / np.sqrt(n_users) * finite_population_correction
 
+        return metric_value, norm.ppf(0.5 + confidence/2) * standard_error
 
-    def get_user_specific_items_to_compute(self, user_id):
 
-        items_to_compute_for_user_mask = self.__no_items_mask.copy()
 
-        ### ADD negative samples
-        start_pos = self.URM_test_negative.indptr[user_id]
-        end_pos = self.URM_test_negative.indptr[user_id+1]
 
-        items_to_compute_for_user_mask[self.URM_test_negative.indices[start_pos:end_pos]] = True
 
-        ### ADD positive samples
-        start_pos = self.URM_test.indptr[user_id]
-        end_pos = self.URM_test.indptr[user_id+1]
 
-        items_to_compute_for_user_mask[self.URM_test.indices[start_pos:end_pos]] = True
 
-        return self.__all_items[items_to_compute_for_user_mask]
 
+def _get_csr_values(csr_matrix, row_array, col_array):
+    """
+    Looks up the cells (row_array[i], col_array[i]) of csr_matrix all at once
+    :return: the mask of the cells present in the matrix and their values, zero for the missing ones
+    """
 
+    if not csr_matrix.has_sorted_indices:
+        csr_matrix = csr_matrix.sorted_indices()
 
+    n_cols = csr_matrix.shape[1]
 
-    def evaluateRecommender(self, recommender_object):
+    # The cells are sorted by row and column, therefore their flat index is increasing
+    cell_row = np.repeat(np.arange(csr_matrix.shape[0], dtype=np.int64), np.ediff1d(csr_matrix.indptr))
+    cell_key = cell_row * n_cols + csr_matrix.indices
+
+    query_key = np.asarray(row_array, dtype=np.int64) * n_cols + np.asarray(col_array, dtype=np.int64)
+
+    if len(cell_key) == 0:
+        return np.zeros(len(query_key), dtype=bool), np.zeros(len(query_key), dtype=np.float64)
+
+    position = np.minimum(np.searchsorted(cell_key, query_key), len(cell_key) - 1)
+
+    found_mask = cell_key[position] == query_key
+    values = np.where(found_mask, csr_matrix.data[position], 0.0)
+
+    return found_mask, values
+
+
+
+def _rmse_batch(relevant_items_predicted_ratings, relevant_items_rating, relevant_user_index, n_users):
+    """
+    RMSE of each user on the relevant items, those with a non finite prediction are ignored as in rmse
+    """
+
+    squared_error = (relevant_items_predicted_ratings - relevant_items_rating)**2
+    finite_prediction_mask = np.isfinite(squared_error)
+
+    squared_error_sum = np.bincount(relevant_user_index, weights=np.where(finite_prediction_mask, squared_error, 0.0), minlength=n_users)
+    n_finite_predictions = np.bincount(relevant_user_index, weights=finite_prediction_mask, minlength=n_users)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(squared_error_sum/n_finite_predictions)
+
+
+
+def _ideal_dcg_batch(URM_test_batch):
+    """
+    DCG of the test ratings of each row sorted by decreasing rating, as in ndcg it does not depend on the cutoff
+    """
+
+    relevant_user_index = np.repeat(np.arange(URM_test_batch.shape[0]), np.ediff1d(URM_test_batch.indptr))
+
+    # Sort the ratings of each row by decreasing value
+    sorting = np.lexsort((-URM_test_batch.data, relevant_user_index))
+    rank = np.arange(len(sorting)) - URM_test_batch.indptr[relevant_user_index]
+
+    gain = (np.power(2, URM_test_batch.data[sorting]) - 1) / np.log(rank + 2)
+
+    return np.bincount(relevant_user_index, weights=gain, minlength=URM_test_batch.shape[0])
+
+
+
+def _compute_accuracy_metrics_batch(is_relevant_batch, relevance_batch, n_relevant_array, ideal_dcg_array, cutoff_list):
+    """
+    Computes the accuracy metrics of each user for all the cutoffs at once, with cumulative sums over the ranking
+    :param is_relevant_batch:   boolean matrix (n_users, max_cutoff), whether each recommended item is relevant
+    :param relevance_batch:     matrix (n_users, max_cutoff), test rating of each recommended item, zero if not relevant
+    :param n_relevant_array:    number of relevant items of each user
+    :param ideal_dcg_array:     see _ideal_dcg_batch
+    :param cutoff_list:
+    :return: dictionary {cutoff: {metric: array with the value of each user}}
+    """
+
+    max_cutoff = is_relevant_batch.shape[1]
+    rank = np.arange(max_cutoff, dtype=np.float64)
+
+    is_relevant_batch = is_relevant_batch.astype(np.float64)
+
+    # Value of each metric for all the prefixes of the ranking
+    hits_cumulative = np.cumsum(is_relevant_batch, axis=1)
+    arhr_cumulative = np.cumsum(is_relevant_batch / (rank + 1), axis=1)
+    relevant_rank_cumulative = np.cumsum(is_relevant_batch * rank, axis=1)
+    dcg_cumulative = np.cumsum((np.power(2, relevance_batch) - 1) / np.log(rank + 2), axis=1)
+
+    # Position of the first relevant item, max_cutoff if there is none
+    first_relevant_rank = np.where(hits_cumulative[:, -1] > 0, np.argmax(is_relevant_batch, axis=1), max_cutoff)
+
+    results_dict = {}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        for cutoff in cutoff_list:
+
+            hits = hits_cumulative[:, cutoff-1]
+            n_negatives = cutoff - hits
+            dcg = dcg_cumulative[:, cutoff-1]
+
+            # Each relevant item in position k precedes the cutoff-1-k items after it, minus the relevant ones
+            roc_auc_numerator = (cutoff - 1) * hits - relevant_rank_cumulative[:, cutoff-1] - hits * (hits - 1) / 2
+            roc_auc = np.where(n_negatives == 0, 1.0, np.where(hits == 0, 0.0, roc_auc_numerator / (hits * n_negatives)))
+
+            results_dict[cutoff] = {
+                EvaluatorMetrics.ROC_AUC.value:             roc_auc,
+                EvaluatorMetrics.PRECISION.value:           hits / cutoff,
+                EvaluatorMetrics.PRECISION_TEST_LEN.value:  hits / np.minimum(n_relevant_array, cutoff),
+                EvaluatorMetrics.RECALL.value:              hits / n_relevant_array,
+                EvaluatorMetrics.RECALL_TEST_LEN.value:     hits / np.minimum(n_relevant_array, cutoff),
+                EvaluatorMetrics.MRR.value:                 np.where(first_relevant_rank < cutoff, 1 / (first_relevant_rank + 1), 0.0),
+                EvaluatorMetrics.NDCG.value:                np.where(dcg == 0.0, 0.0, dcg / ideal_dcg_array),
+                EvaluatorMetrics.HIT_RATE.value:            hits,
+                EvaluatorMetrics.ARHR.value:                arhr_cumulative[:, cutoff-1],
+            }
+
+    return results_dict
+
+
+
+def _sum_user_values(results_dict):
+    """
+    Replaces the arrays with the value of each user with their sum
+    """
+
+    for results_current_cutoff in results_dict.values():
+        for key, value in results_current_cutoff.items():
+            if isinstance(value, np.ndarray):
+                results_current_cutoff[key] = value.sum()
+
+
+
+def _merge_results_dict(results_dict_list):
+    """
+    Merges the results of consecutive groups of users, in the given order
+    """
+
+    merged_dict = results_dict_list[0]
+
+    for results_dict in results_dict_list[1:]:
+
+        assert merged_dict.keys() == results_dict.keys(), "_merge_results_dict: the result dictionaries have different cutoff values"
+
+        for cutoff in merged_dict.keys():
+
+            merged_dict_cutoff = merged_dict[cutoff]
+            results_dict_cutoff = results_dict[cutoff]
+
+            for key in merged_dict_cutoff.keys():
+
+                if isinstance(merged_dict_cutoff[key], Metrics_Object):
+                    merged_dict_cutoff[key].merge_with_other(results_dict_cutoff[key])
+                else:
+                    merged_dict_cutoff[key] = np.concatenate((merged_dict_cutoff[key], results_dict_cutoff[key]))
+
+    return merged_dict
+
+
+
+# Set in the parent process before the fork, or by the initializer of each process
+_parallel_evaluator_object = None
+_parallel_recommender_object = None
+
+# Only set in the processes of the pool
+_parallel_worker_single_threaded = False
+
+
+def _set_single_threaded(recommender_object):
+
+    if hasattr(recommender_object, "recommend_n_threads"):
+        recommender_object.recommend_n_threads = 1
+        recommender_object._top_n_object_cache = None
+
+
+def _parallel_worker_init(evaluator_object, recommender_object):
+
+    global _parallel_evaluator_object, _parallel_recommender_object
+
+    _parallel_evaluator_object = evaluator_object
+    _parallel_recommender_object = recommender_object
+
+
+def _parallel_worker_evaluate_users(usersToEvaluate, block_size, memory_budget):
+
+    global _parallel_worker_single_threaded
+
+    # The OpenMP threads of the parent do not exist in a forked process, entering a parallel region
+    # with them hangs. Once in each process the compiled top-N is dropped and built again for a single thread
+    if not _parallel_worker_single_threaded:
+        _set_single_threaded(_parallel_recommender_object)
+        _parallel_worker_single_threaded = True
+
+    return _parallel_evaluator_object._evaluate_users(_parallel_recommender_object, usersToEvaluate,
+                                                      block_size = block_size, memory_budget = memory_budget)
+
+
+
+
+
+
+class EvaluatorNegativeItemSample(Evaluator):
+    """EvaluatorNegativeItemSample"""
+
+    EVALUATOR_NAME = "EvaluatorNegativeItemSample"
+
+    def __init__(self, URM_test_list, URM_test_negative, cutoff_list, minRatingsPerUser=1, exclude_seen=True,
+                 diversity_object = None,
+                 ignore_items = None,
+                 ignore_users = None):
         """
-        :param recommender_object: the trained recommender object, a Recommender subclass
-        :param URM_test_list: list of URMs to test the recommender against, or a single URM object
-        :param cutoff_list: list of cutoffs to be use to report the scores, or a single cutoff
+
+        :param URM_test_list:
+        :param URM_test_negative: Items to rank together with the test items
+        :param cutoff_list:
+        :param minRatingsPerUser:
+        :param exclude_seen:
+        :param diversity_object:
+        :param ignore_items:
+        :param ignore_users:
         """
 
 
+        super(EvaluatorNegativeItemSample, self).__init__(URM_test_list, cutoff_list,
+                                                          diversity_object = diversity_object,
+                                                          minRatingsPerUser=minRatingsPerUser, exclude_seen=exclude_seen,
+                                                          ignore_items = ignore_items, ignore_users = ignore_users)
 
-        results_dict = {}
 
-        for cutoff in self.cutoff_list:
-            results_dict[cutoff] = create_empty_metrics_dict(self.n_items, self.n_users,
-                                                             recommender_object.URM_train,
-                                                             self.ignore_items_ID,
-                                                             self.ignore_users_ID,
-                                                             cutoff,
-                                                             self.diversity_object)
+        self.URM_test_negative = sps.csr_matrix(URM_test_negative)
 
 
 
+    def _run_evaluation_on_selected_users(self, recommender_object, usersToEvaluate, block_size = 1000):
+        """
+        Ranks for each user only its candidates, its test items and negative items, in batches of users.
+        The ignored items and, if exclude_seen, the seen items are removed from the candidates
+        :param block_size:      Number of users of each batch
+        """
+
         start_time = time.time()
         start_time_print = time.time()
 
-        n_eval = 0
+        results_dict = self._create_empty_results_dict(recommender_object, len(usersToEvaluate))
 
-        self.__all_items = np.arange(0, self.n_items, dtype=np.int)
-        self.__all_items_mask = np.ones(len(self.__all_items), dtype=np.bool)
-        self.__no_items_mask = np.zeros(len(self.__all_items), dtype=np.bool)
+        n_users_evaluated = 0
 
-        if self.ignore_items_flag:
-            recommender_object.set_items_to_ignore(self.ignore_items_ID)
+        URM_train = recommender_object.URM_train
 
+        removed_items_mask = np.zeros(self.n_items, dtype=bool)
 
+        if self.ignore_items_flag:
+            removed_items_mask[self.ignore_items_ID.astype(np.int)] = True
 
-        for test_user in self.usersToEvaluate:
 
-            # Being the URM CSR, the indices are the non-zero column indexes
-            relevant_items = self.get_user_relevant_items(test_user)
-            relevant_items_rating = self.get_user_test_ratings(test_user)
+        for user_batch_start in range(0, len(usersToEvaluate), block_size):
 
-            n_eval += 1
+            test_user_batch_array = np.array(usersToEvaluate[user_batch_start:user_batch_start + block_size])
+            n_batch_users = len(test_user_batch_array)
 
-            self.user_specific_remove_items(recommender_object, test_user)
-            items_to_compute = self.get_user_specific_items_to_compute(test_user)
+            URM_test_batch = self.URM_test[test_user_batch_array]
+            URM_test_batch.sort_indices()
 
-            recommended_items, all_items_predicted_ratings = recommender_object.recommend(np.atleast_1d(test_user),
-                                                              remove_seen_flag=self.exclude_seen,
-                                                              cutoff = self.max_cutoff,
-                                                              remove_top_pop_flag=False,
-                                                              items_to_compute = items_to_compute,
-                                                              remove_CustomItems_flag=self.ignore_items_flag,
-                                                              return_scores = True
-                                                             )
+            URM_test_negative_batch = self.URM_test_negative[test_user_batch_array]
 
+            # The candidates of each user, duplicates are summed and their indices are sorted
+            candidate_matrix = sps.csr_matrix((np.ones(URM_test_batch.nnz + URM_test_negative_batch.nnz),
+                                               (np.concatenate((np.repeat(np.arange(n_batch_users), np.ediff1d(URM_test_batch.indptr)),
+                                                                np.repeat(np.arange(n_batch_users), np.ediff1d(URM_test_negative_batch.indptr)))),
+                                                np.concatenate((URM_test_batch.indices, URM_test_negative_batch.indices)))),
+                                              shape = (n_batch_users, self.n_items))
+            candidate_matrix.sort_indices()
 
-            recommended_items = np.array(recommended_items[0])
-            user_rmse = rmse(all_items_predicted_ratings[0], relevant_items, relevant_items_rating)
+            candidate_user_index = np.repeat(np.arange(n_batch_users), np.ediff1d(candidate_matrix.indptr))
+            candidate_items = candidate_matrix.indices
 
-            recommender_object.reset_items_to_ignore()
+            candidate_mask = ~removed_items_mask[candidate_items]
 
-            is_relevant = np.in1d(recommended_items, relevant_items, assume_unique=True)
+            if self.exclude_seen:
+                candidate_seen_mask, _ = _get_csr_values(URM_train[test_user_batch_array], candidate_user_index, candidate_items)
+                candidate_mask = np.logical_and(candidate_mask, ~candidate_seen_mask)
 
+            candidate_user_index = candidate_user_index[candidate_mask]
+            candidate_items = candidate_items[candidate_mask]
 
+            candidate_indptr = np.zeros(n_batch_users + 1, dtype=np.int64)
+            candidate_indptr[1:] = np.cumsum(np.bincount(candidate_user_index, minlength=n_batch_users))
 
-            for cutoff in self.cutoff_list:
+            # Only the candidates are scored
+            candidate_scores = recommender_object.score_candidates(test_user_batch_array, np.split(candidate_items, candidate_indptr[1:-1]))
+            candidate_scores = np.concatenate(candidate_scores).astype(np.float64)
 
-                results_current_cutoff = results_dict[cutoff]
+            # Rank the candidates of each user by decreasing score, the rows remain in order
+            sorting = np.lexsort((-candidate_scores, candidate_user_index))
+            candidate_rank = np.arange(len(sorting)) - candidate_indptr[candidate_user_index]
+            ranked_mask = candidate_rank < self.max_cutoff
 
-                is_relevant_current_cutoff = is_relevant[0:cutoff]
-                recommended_items_current_cutoff = recommended_items[0:cutoff]
+            recommended_items_batch = np.full((n_batch_users, self.max_cutoff), -1, dtype=np.int64)
+            recommended_items_batch[candidate_user_index[ranked_mask], candidate_rank[ranked_mask]] = candidate_items[sorting][ranked_mask]
 
-                results_current_cutoff[EvaluatorMetrics.ROC_AUC.value]              += roc_auc(is_relevant_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.PRECISION.value]            += precision(is_relevant_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.PRECISION_TEST_LEN.value]   += precision_min_test_len(is_relevant_current_cutoff, len(relevant_items))
-                results_current_cutoff[EvaluatorMetrics.RECALL.value]               += recall(is_relevant_current_cutoff, relevant_items)
-                results_current_cutoff[EvaluatorMetrics.RECALL_TEST_LEN.value]      += recall_min_test_len(is_relevant_current_cutoff, relevant_items)
-                results_current_cutoff[EvaluatorMetrics.MRR.value]                  += rr(is_relevant_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.NDCG.value]                 += ndcg(recommended_items_current_cutoff, relevant_items, relevance=self.get_user_test_ratings(test_user), at=cutoff)
-                results_current_cutoff[EvaluatorMetrics.HIT_RATE.value]             += is_relevant_current_cutoff.sum()
-                results_current_cutoff[EvaluatorMetrics.ARHR.value]                 += arhr(is_relevant_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.RMSE.value]                 += user_rmse
+            # The test items removed from the candidates are not predicted and are ignored by the RMSE
+            relevant_user_index = np.repeat(np.arange(n_batch_users), np.ediff1d(URM_test_batch.indptr))
 
-                results_current_cutoff[EvaluatorMetrics.MAP.value].add_recommendations(is_relevant_current_cutoff, relevant_items)
-                results_current_cutoff[EvaluatorMetrics.NOVELTY.value].add_recommendations(recommended_items_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.DIVERSITY_GINI.value].add_recommendations(recommended_items_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.SHANNON_ENTROPY.value].add_recommendations(recommended_items_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.COVERAGE_ITEM.value].add_recommendations(recommended_items_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.COVERAGE_USER.value].add_recommendations(recommended_items_current_cutoff, test_user)
-                results_current_cutoff[EvaluatorMetrics.DIVERSITY_MEAN_INTER_LIST.value].add_recommendations(recommended_items_current_cutoff)
-                results_current_cutoff[EvaluatorMetrics.DIVERSITY_HERFINDAHL.value].add_recommendations(recommended_items_current_cutoff)
+            candidate_scores_matrix = sps.csr_matrix((candidate_scores, candidate_items, candidate_indptr), shape = (n_batch_users, self.n_items))
+            relevant_items_predicted_mask, relevant_items_predicted_ratings = _get_csr_values(candidate_scores_matrix, relevant_user_index, URM_test_batch.indices)
+            relevant_items_predicted_ratings[~relevant_items_predicted_mask] = -np.inf
 
-                if EvaluatorMetrics.DIVERSITY_SIMILARITY.value in results_current_cutoff:
-                    results_current_cutoff[EvaluatorMetrics.DIVERSITY_SIMILARITY.value].add_recommendations(recommended_items_current_cutoff)
+            rmse_batch = _rmse_batch(relevant_items_predicted_ratings, URM_test_batch.data, relevant_user_index, n_batch_users)
 
+            self._add_batch_metrics(results_dict, slice(n_users_evaluated, n_users_evaluated + n_batch_users),
+                                    test_user_batch_array, URM_test_batch, recommended_items_batch, rmse_batch)
 
+            n_users_evaluated += n_batch_users
 
-            if time.time() - start_time_print > 30 or n_eval==len(self.usersToEvaluate):
-                print("EvaluatorHoldout: Processed {} ( {:.2f}% ) in {:.2f} seconds. Users per second: {:.0f}".format(
-                              n_eval,
-                              100.0* float(n_eval)/len(self.usersToEvaluate),
+            if time.time() - start_time_print > 30 or n_users_evaluated==len(usersToEvaluate):
+                print("EvaluatorNegativeItemSample: Processed {} ( {:.2f}% ) in {:.2f} seconds. Users per second: {:.0f}".format(
+                              n_users_evaluated,
+                              100.0* float(n_users_evaluated)/len(usersToEvaluate),
                               time.time()-start_time,
-                              float(n_eval)/(time.time()-start_time)))
+                              float(n_users_evaluated)/(time.time()-start_time)))
 
                 sys.stdout.flush()
                 sys.stderr.flush()
@@ -923,6 +1144,23 @@ class EvaluatorNegativeItemSample(Evaluator):
                 start_time_print = time.time()
 
 
+        _sum_user_values(results_dict)
+
+        return results_dict, n_users_evaluated
+
+
+
+
+    def evaluateRecommender(self, recommender_object):
+        """
+        :param recommender_object: the trained recommender object, a Recommender subclass
+        :param URM_test_list: list of URMs to test the recommender against, or a single URM object
+        :param cutoff_list: list of cutoffs to be use to report the scores, or a single cutoff
+        """
+
+        results_dict, n_eval = self._run_evaluation_on_selected_users(recommender_object, self.usersToEvaluate)
+
+
         if (n_eval > 0):
 
             for cutoff in self.cutoff_list:
@@ -950,11 +1188,6 @@ class EvaluatorNegativeItemSample(Evaluator):
             print("WARNING: No users had a sufficient number of relevant items")
 
 
-        if self.ignore_items_flag:
-            recommender_object.reset_items_to_ignore()
-
-
-
         results_run_string = get_result_string(results_dict)
 
         return (results_dict, results_run_string)
\ No newline at end of file
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, threading
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Evaluation.Evaluator import EvaluatorHoldout, EvaluatorNegativeItemSample, _compute_accuracy_metrics_batch, _ideal_dcg_batch
+from Base.Evaluation.metrics import Diversity_similarity, roc_auc, precision, recall, rr, ndcg, arhr
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+from MatrixFactorization.PureSVD import PureSVDRecommender
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_parallel_equals_serial(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(700, 300, density=0.05, format="csr", dtype=np.float64)
+        URM_test = sps.random(700, 300, density=0.02, format="csr", dtype=np.float64)
+
+        recommender = ItemKNNCFRecommender(URM_train)
+        recommender.fit(topK=20)
+
+        diversity_object = Diversity_similarity(np.random.rand(300, 300))
+
+        evaluator_serial = EvaluatorHoldout(URM_test, [5, 10], diversity_object = diversity_object, ignore_items = np.arange(10))
+        evaluator_parallel = EvaluatorHoldout(URM_test, [5, 10], diversity_object = diversity_object, ignore_items = np.arange(10), n_processes = 3)
+
+        results_serial, _ = evaluator_serial.evaluateRecommender(recommender)
+        results_parallel, _ = evaluator_parallel.evaluateRecommender(recommender)
+
+        for cutoff in [5, 10]:
+            assert results_serial[cutoff].keys() == results_parallel[cutoff].keys(), "Different metrics computed"
+
+            for metric, value in results_serial[cutoff].items():
+                assert np.array_equal(value, results_parallel[cutoff][metric], equal_nan = True), "Parallel {} different from serial".format(metric)
+
+
+    def test_parallel_after_multithreaded_top_n(self):
+
+        try:
+            from Base.Cython.Recommender_Top_N_Cython import Recommender_Top_N_Cython
+        except ImportError:
+            self.skipTest("Compiled top-N not available")
+
+        np.random.seed(42)
+
+        URM_train = sps.random(700, 300, density=0.05, format="csr", dtype=np.float64)
+        URM_test = sps.random(700, 300, density=0.02, format="csr", dtype=np.float64)
+
+        recommender = ItemKNNCFRecommender(URM_train)
+        recommender.fit(topK=20)
+        recommender.recommend_n_threads = 4
+
+        # The OpenMP threads are started in the parent before the fork
+        recommender.recommend(np.arange(10), cutoff = 5)
+
+        results_serial, _ = EvaluatorHoldout(URM_test, [5]).evaluateRecommender(recommender)
+        results_list = []
+
+        # If the processes hang the evaluation never returns
+        evaluation_thread = threading.Thread(target = lambda: results_list.append(EvaluatorHoldout(URM_test, [5], n_processes = 3).evaluateRecommender(recommender)),
+                                             daemon = True)
+        evaluation_thread.start()
+        evaluation_thread.join(timeout = 60)
+
+        assert len(results_list) == 1, "Parallel evaluation did not terminate"
+        assert results_list[0][0][5]["MAP"] == results_serial[5]["MAP"]
+        assert recommender.recommend_n_threads == 4, "Recommender of the parent process modified"
+
+
+    def test_batch_metrics_equal_per_user(self):
+
+        np.random.seed(42)
+
+        n_users, n_items, max_cutoff = 50, 40, 10
+
+        URM_test = sps.random(n_users, n_items, density=0.1, format="csr", dtype=np.float64)
+        URM_test.data = np.random.randint(1, 6, URM_test.nnz).astype(np.float64)
+        URM_test = URM_test[np.ediff1d(URM_test.indptr) > 0]
+        URM_test.sort_indices()
+
+        recommended_items_batch = np.array([np.random.permutation(n_items)[:max_cutoff] for _ in range(URM_test.shape[0])])
+        relevance_batch = np.array([URM_test[user_index].toarray().ravel()[recommended_items_batch[user_index]] for user_index in range(URM_test.shape[0])])
+
+        accuracy_metrics_dict = _compute_accuracy_metrics_batch(relevance_batch > 0, relevance_batch, np.ediff1d(URM_test.indptr),
+                                                                _ideal_dcg_batch(URM_test), [1, 5, 10])
+
+        for user_index in range(URM_test.shape[0]):
+
+            relevant_items = URM_test.indices[URM_test.indptr[user_index]:URM_test.indptr[user_index+1]]
+            relevant_items_rating = URM_test.data[URM_test.indptr[user_index]:URM_test.indptr[user_index+1]]
+
+            for cutoff in [1, 5, 10]:
+
+                recommended_items = recommended_items_batch[user_index, :cutoff]
+                is_relevant = np.in1d(recommended_items, relevant_items, assume_unique=True)
+
+                expected_dict = {"ROC_AUC": roc_auc(is_relevant),
+                                 "PRECISION": precision(is_relevant),
+                                 "RECALL": recall(is_relevant, relevant_items),
+                                 "MRR": rr(is_relevant),
+                                 "NDCG": ndcg(recommended_items, relevant_items, relevance=relevant_items_rating, at=cutoff),
+                                 "ARHR": arhr(is_relevant)}
+
+                for metric, expected_value in expected_dict.items():
+                    assert np.isclose(accuracy_metrics_dict[cutoff][metric][user_index], expected_value, rtol=1e-5), \
+                        "Batch {} different from the one of the single user".format(metric)
+
+
+    def test_negative_item_sample_all_items_equals_holdout(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(300, 200, density=0.05, format="csr", dtype=np.float64)
+        URM_test = sps.random(300, 200, density=0.02, format="csr", dtype=np.float64)
+        URM_test = URM_test - URM_test.multiply(URM_train.astype(bool))
+        URM_test.eliminate_zeros()
+
+        # If all the items not seen are negative items, the candidates are the same the holdout ranks
+        URM_test_negative = sps.csr_matrix(np.ones(URM_train.shape)) - URM_train.astype(bool) - URM_test.astype(bool)
+        URM_test_negative.eliminate_zeros()
+
+        recommender = PureSVDRecommender(URM_train)
+        recommender.fit(num_factors=10)
+
+        results_holdout, _ = EvaluatorHoldout(URM_test, [1, 5, 10], ignore_items = np.arange(5)).evaluateRecommender(recommender)
+        results_negative, _ = EvaluatorNegativeItemSample(URM_test, URM_test_negative, [1, 5, 10], ignore_items = np.arange(5)).evaluateRecommender(recommender)
+
+        for cutoff in [1, 5, 10]:
+            for metric, value in results_holdout[cutoff].items():
+                assert np.allclose(value, results_negative[cutoff][metric], equal_nan = True), "Sampled {} different from holdout".format(metric)
+
+
+    def test_metric_equals_evaluate_recommender(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(500, 300, density=0.05, format="csr", dtype=np.float64)
+        URM_test = sps.random(500, 300, density=0.02, format="csr", dtype=np.float64)
+
+        recommender = ItemKNNCFRecommender(URM_train)
+        recommender.fit(topK=20)
+
+        evaluator = EvaluatorHoldout(URM_test, [5, 10], ignore_items = np.arange(10))
+        results_dict, _ = evaluator.evaluateRecommender(recommender)
+
+        for metric in EvaluatorHoldout.USER_METRICS_LIST + ["COVERAGE_ITEM"]:
+            metric_value, confidence_interval = evaluator.evaluateRecommenderMetric(recommender, metric, cutoff = 10)
+            assert np.isclose(metric_value, results_dict[10][metric]), "{} different from evaluateRecommender".format(metric)
+
+        # The same sample is used in all the calls
+        metric_value, confidence_interval = evaluator.evaluateRecommenderMetric(recommender, "NDCG", n_users_sample = 100)
+        assert confidence_interval > 0.0
+        assert (metric_value, confidence_interval) == evaluator.evaluateRecommenderMetric(recommender, "NDCG", n_users_sample = 100)
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
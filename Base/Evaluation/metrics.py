@@ -19,6 +19,14 @@ class Metrics_Object(object):
     def add_recommendations(self, recommended_items_ids):
         raise NotImplementedError()
 
+    def add_recommendations_batch(self, recommended_items_batch):
+        """
+        Adds the recommendations of several users at once, one per row of recommended_items_batch.
+        Metrics that can be updated in bulk override it
+        """
+        for recommended_items_ids in recommended_items_batch:
+            self.add_recommendations(recommended_items_ids)
+
     def get_metric_value(self):
         raise NotImplementedError()
 
@@ -41,12 +49,15 @@ class Coverage_Item(Metrics_Object):
     def add_recommendations(self, recommended_items_ids):
         self.recommended_mask[recommended_items_ids] = True
 
+    def add_recommendations_batch(self, recommended_items_batch):
+        self.recommended_mask[recommended_items_batch.ravel()] = True
+
     def get_metric_value(self):
         return self.recommended_mask.sum()/(len(self.recommended_mask)-self.n_ignore_items)
 
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Coverage_Item, "Coverage_Item: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Coverage_Item), "Coverage_Item: attempting to merge with a metric object of different type"
 
         self.recommended_mask = np.logical_or(self.recommended_mask, other_metric_object.recommended_mask)
 
@@ -68,11 +79,14 @@ class Coverage_User(Metrics_Object):
     def add_recommendations(self, recommended_items_ids, user_id):
         self.users_mask[user_id] = len(recommended_items_ids)>0
 
+    def add_recommendations_batch(self, recommended_items_batch, user_id_array):
+        self.users_mask[user_id_array] = recommended_items_batch.shape[1]>0
+
     def get_metric_value(self):
         return self.users_mask.sum()/(len(self.users_mask)-self.n_ignore_users)
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Coverage_User, "Coverage_User: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Coverage_User), "Coverage_User: attempting to merge with a metric object of different type"
 
         self.users_mask = np.logical_or(self.users_mask, other_metric_object.users_mask)
 
@@ -83,25 +97,27 @@ class MAP(Metrics_Object):
     """
     Mean Average Precision, defined as the mean of the AveragePrecision over all users
 
+    The AveragePrecision of each user is kept, in the order the users are added, and summed only when the value is requested.
+    In this way merging the objects of consecutive groups of users gives exactly the same value of a single object.
     """
 
     def __init__(self):
         super(MAP, self).__init__()
-        self.cumulative_AP = 0.0
-        self.n_users = 0
+        self.AP_list = []
 
     def add_recommendations(self, is_relevant, pos_items):
-        self.cumulative_AP += average_precision(is_relevant, pos_items)
-        self.n_users += 1
+        self.AP_list.append(average_precision(is_relevant, pos_items))
+
+    def add_recommendations_batch(self, is_relevant_batch, n_pos_items_array):
+        self.AP_list.extend(average_precision_batch(is_relevant_batch, n_pos_items_array).tolist())
 
     def get_metric_value(self):
-        return self.cumulative_AP/self.n_users
+        return np.sum(self.AP_list)/len(self.AP_list)
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is MAP, "MAP: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, MAP), "MAP: attempting to merge with a metric object of different type"
 
-        self.cumulative_AP += other_metric_object.cumulative_AP
-        self.n_users += other_metric_object.n_users
+        self.AP_list.extend(other_metric_object.AP_list)
 
 
 
@@ -126,6 +142,10 @@ class Gini_Diversity(Metrics_Object):
     def add_recommendations(self, recommended_items_ids):
         self.recommended_counter[recommended_items_ids] += 1
 
+    def add_recommendations_batch(self, recommended_items_batch):
+        # The items in a row are unique, therefore each of them counts once as in add_recommendations
+        self.recommended_counter += np.bincount(recommended_items_batch.ravel(), minlength=len(self.recommended_counter))
+
     def get_metric_value(self):
 
         recommended_counter = self.recommended_counter.copy()
@@ -147,7 +167,7 @@ class Gini_Diversity(Metrics_Object):
         return gini_diversity
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Gini_Diversity, "Gini_Diversity: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Gini_Diversity), "Gini_Diversity: attempting to merge with a metric object of different type"
 
         self.recommended_counter += other_metric_object.recommended_counter
 
@@ -175,6 +195,10 @@ class Diversity_Herfindahl(Metrics_Object):
     def add_recommendations(self, recommended_items_ids):
         self.recommended_counter[recommended_items_ids] += 1
 
+    def add_recommendations_batch(self, recommended_items_batch):
+        # The items in a row are unique, therefore each of them counts once as in add_recommendations
+        self.recommended_counter += np.bincount(recommended_items_batch.ravel(), minlength=len(self.recommended_counter))
+
     def get_metric_value(self):
 
         recommended_counter = self.recommended_counter.copy()
@@ -189,7 +213,7 @@ class Diversity_Herfindahl(Metrics_Object):
         return herfindahl_index
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Diversity_Herfindahl, "Diversity_Herfindahl: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Diversity_Herfindahl), "Diversity_Herfindahl: attempting to merge with a metric object of different type"
 
         self.recommended_counter += other_metric_object.recommended_counter
 
@@ -221,6 +245,10 @@ class Shannon_Entropy(Metrics_Object):
     def add_recommendations(self, recommended_items_ids):
         self.recommended_counter[recommended_items_ids] += 1
 
+    def add_recommendations_batch(self, recommended_items_batch):
+        # The items in a row are unique, therefore each of them counts once as in add_recommendations
+        self.recommended_counter += np.bincount(recommended_items_batch.ravel(), minlength=len(self.recommended_counter))
+
     def get_metric_value(self):
 
         assert np.all(self.recommended_counter >= 0.0), "Shannon_Entropy: self.recommended_counter contains negative counts"
@@ -244,7 +272,7 @@ class Shannon_Entropy(Metrics_Object):
         return shannon_entropy
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Gini_Diversity, "Shannon_Entropy: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Shannon_Entropy), "Shannon_Entropy: attempting to merge with a metric object of different type"
 
         assert np.all(self.recommended_counter >= 0.0), "Shannon_Entropy: self.recommended_counter contains negative counts"
         assert np.all(other_metric_object.recommended_counter >= 0.0), "Shannon_Entropy: other.recommended_counter contains negative counts"
@@ -271,15 +299,22 @@ class Novelty(Metrics_Object):
     Mean self-information  (Zhou 2010)
     """
 
-    def __init__(self, URM_train):
+    def __init__(self, URM_train, item_popularity = None):
+        """
+        :param URM_train:
+        :param item_popularity:     Number of interactions of each item in URM_train, if provided URM_train is not used
+        """
         super(Novelty, self).__init__()
 
-        URM_train = sps.csc_matrix(URM_train)
-        URM_train.eliminate_zeros()
-        self.item_popularity = np.ediff1d(URM_train.indptr)
+        if item_popularity is None:
+            URM_train = sps.csc_matrix(URM_train)
+            URM_train.eliminate_zeros()
+            item_popularity = np.ediff1d(URM_train.indptr)
 
-        self.novelty = 0.0
-        self.n_evaluated_users = 0
+        self.item_popularity = item_popularity
+
+        # Novelty of each user, summed only when the value is requested, see MAP
+        self.novelty_list = []
         self.n_items = len(self.item_popularity)
         self.n_interactions = self.item_popularity.sum()
 
@@ -291,21 +326,29 @@ class Novelty(Metrics_Object):
         probability = recommended_items_popularity/self.n_interactions
         probability = probability[probability!=0]
 
-        self.novelty += np.sum(-np.log2(probability)/self.n_items)
-        self.n_evaluated_users += 1
+        self.novelty_list.append(np.sum(-np.log2(probability)/self.n_items))
+
+    def add_recommendations_batch(self, recommended_items_batch):
+
+        probability = self.item_popularity[recommended_items_batch]/self.n_interactions
+
+        # Cold items have zero probability and do not contribute
+        with np.errstate(divide='ignore'):
+            self_information = np.where(probability != 0, -np.log2(probability)/self.n_items, 0.0)
+
+        self.novelty_list.extend(self_information.sum(axis=1).tolist())
 
     def get_metric_value(self):
 
-        if self.n_evaluated_users == 0:
+        if len(self.novelty_list) == 0:
             return 0.0
 
-        return self.novelty/self.n_evaluated_users
+        return np.sum(self.novelty_list)/len(self.novelty_list)
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Novelty, "Novelty: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Novelty), "Novelty: attempting to merge with a metric object of different type"
 
-        self.novelty = self.novelty + other_metric_object.novelty
-        self.n_evaluated_users = self.n_evaluated_users + other_metric_object.n_evaluated_users
+        self.novelty_list.extend(other_metric_object.novelty_list)
 
 
 
@@ -322,51 +365,65 @@ class Diversity_similarity(Metrics_Object):
     A content-based recommender will have low IntraList diversity if that is computed on the same features the recommender uses.
     A TopPopular recommender may exhibit high IntraList diversity.
 
+    The item_diversity_matrix can be dense or sparse, in which case the missing values are zero.
+    The diversity of a list is the sum of the diversity of each of its items, except the last one, with all the others,
+    divided by the number of couples.
     """
 
     def __init__(self, item_diversity_matrix):
         super(Diversity_similarity, self).__init__()
 
-        assert np.all(item_diversity_matrix >= 0.0) and np.all(item_diversity_matrix <= 1.0), \
+        if sps.issparse(item_diversity_matrix):
+            # Sorted indices allow to look up the values with a binary search
+            item_diversity_matrix = sps.csr_matrix(item_diversity_matrix)
+            item_diversity_matrix.sort_indices()
+            matrix_values = item_diversity_matrix.data
+        else:
+            matrix_values = item_diversity_matrix
+
+        assert np.all(matrix_values >= 0.0) and np.all(matrix_values <= 1.0), \
             "item_diversity_matrix contains value greated than 1.0 or lower than 0.0"
 
         self.item_diversity_matrix = item_diversity_matrix
 
-        self.n_evaluated_users = 0
-        self.diversity = 0.0
+        # Diversity of each user, summed only when the value is requested, see MAP
+        self.diversity_list = []
 
 
     def add_recommendations(self, recommended_items_ids):
+        self.add_recommendations_batch(np.atleast_2d(recommended_items_ids))
 
-        current_recommended_items_diversity = 0.0
 
-        for item_index in range(len(recommended_items_ids)-1):
+    def add_recommendations_batch(self, recommended_items_batch):
 
-            item_id = recommended_items_ids[item_index]
+        n_users, list_length = recommended_items_batch.shape
 
-            item_other_diversity = self.item_diversity_matrix[item_id, recommended_items_ids]
-            item_other_diversity[item_index] = 0.0
+        # Block (n_users, list_length-1, list_length) of the diversity of each item, except the last, with all the items
+        row_items = np.broadcast_to(recommended_items_batch[:, :-1, None], (n_users, list_length-1, list_length))
+        col_items = np.broadcast_to(recommended_items_batch[:, None, :], (n_users, list_length-1, list_length))
 
-            current_recommended_items_diversity += np.sum(item_other_diversity)
+        if sps.issparse(self.item_diversity_matrix):
+            pairwise_diversity = np.asarray(self.item_diversity_matrix[row_items.ravel(), col_items.ravel()]).reshape(row_items.shape)
+        else:
+            pairwise_diversity = self.item_diversity_matrix[row_items, col_items]
 
+        # An item is not compared with itself
+        pairwise_diversity = np.where(np.eye(list_length-1, list_length, dtype=bool), 0.0, pairwise_diversity)
 
-        self.diversity += current_recommended_items_diversity/(len(recommended_items_ids)*(len(recommended_items_ids)-1))
-
-        self.n_evaluated_users += 1
+        self.diversity_list.extend((pairwise_diversity.sum(axis=(1, 2))/(list_length*(list_length-1))).tolist())
 
 
     def get_metric_value(self):
 
-        if self.n_evaluated_users == 0:
+        if len(self.diversity_list) == 0:
             return 0.0
 
-        return self.diversity/self.n_evaluated_users
+        return np.sum(self.diversity_list)/len(self.diversity_list)
 
     def merge_with_other(self, other_metric_object):
-        assert other_metric_object is Diversity_similarity, "Diversity: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Diversity_similarity), "Diversity: attempting to merge with a metric object of different type"
 
-        self.diversity = self.diversity + other_metric_object.diversity
-        self.n_evaluated_users = self.n_evaluated_users + other_metric_object.n_evaluated_users
+        self.diversity_list.extend(other_metric_object.diversity_list)
 
 
 
@@ -439,6 +496,14 @@ class Diversity_MeanInterList(Metrics_Object):
         self.recommended_counter[recommended_items_ids] += 1
         self.n_evaluated_users += 1
 
+    def add_recommendations_batch(self, recommended_items_batch):
+
+        assert recommended_items_batch.shape[1] <= self.cutoff, "Diversity_MeanInterList: recommended list is contains more elements than cutoff"
+
+        # The items in a row are unique, therefore each of them counts once as in add_recommendations
+        self.recommended_counter += np.bincount(recommended_items_batch.ravel(), minlength=len(self.recommended_counter))
+        self.n_evaluated_users += recommended_items_batch.shape[0]
+
 
 
     def get_metric_value(self):
@@ -469,7 +534,7 @@ class Diversity_MeanInterList(Metrics_Object):
 
     def merge_with_other(self, other_metric_object):
 
-        assert other_metric_object is Diversity_MeanInterList, "Diversity_MeanInterList: attempting to merge with a metric object of different type"
+        assert isinstance(other_metric_object, Diversity_MeanInterList), "Diversity_MeanInterList: attempting to merge with a metric object of different type"
 
         assert np.all(self.recommended_counter >= 0.0), "Diversity_MeanInterList: self.recommended_counter contains negative counts"
         assert np.all(other_metric_object.recommended_counter >= 0.0), "Diversity_MeanInterList: other.recommended_counter contains negative counts"
@@ -592,6 +657,18 @@ def average_precision(is_relevant, pos_items):
     return a_p
 
 
+def average_precision_batch(is_relevant_batch, n_pos_items_array):
+    """
+    AveragePrecision of each row of the boolean matrix is_relevant_batch
+    :param n_pos_items_array:   number of relevant items of each row
+    """
+
+    p_at_k = is_relevant_batch * np.cumsum(is_relevant_batch, axis=1, dtype=np.float64) / (1 + np.arange(is_relevant_batch.shape[1]))
+    a_p = np.sum(p_at_k, axis=1) / np.minimum(n_pos_items_array, is_relevant_batch.shape[1])
+
+    return a_p
+
+
 def ndcg(ranked_list, pos_items, relevance=None, at=None):
 
     if relevance is None:
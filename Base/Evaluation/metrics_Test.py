@@ -154,6 +154,41 @@ class MyTestCase(unittest.TestCase):
         assert  np.isclose(diversity_cooccurrence, object_diversity, atol=1e-4), "metric incorrect"
 
 
+    def test_Diversity_similarity_batch(self):
+
+        from Base.Evaluation.metrics import Diversity_similarity
+        import scipy.sparse as sps
+
+        n_items = 100
+        n_users = 50
+        cutoff = 5
+
+        item_diversity_matrix = np.random.rand(n_items, n_items)
+        item_diversity_matrix[item_diversity_matrix < 0.7] = 0.0
+
+        recommended_items_batch = np.array([np.random.permutation(n_items)[:cutoff] for _ in range(n_users)])
+
+        diversity_dense = Diversity_similarity(item_diversity_matrix)
+        diversity_sparse = Diversity_similarity(sps.csr_matrix(item_diversity_matrix))
+
+        diversity_dense.add_recommendations_batch(recommended_items_batch)
+
+        for recommended in recommended_items_batch:
+            diversity_sparse.add_recommendations(recommended)
+
+        diversity_expected = 0.0
+
+        for recommended in recommended_items_batch:
+            for item_index in range(cutoff-1):
+                for other_item_index in range(cutoff):
+                    if item_index != other_item_index:
+                        diversity_expected += item_diversity_matrix[recommended[item_index], recommended[other_item_index]]/(cutoff*(cutoff-1))
+
+        assert np.isclose(diversity_expected/n_users, diversity_dense.get_metric_value()), "metric incorrect"
+        assert np.isclose(diversity_expected/n_users, diversity_sparse.get_metric_value()), "metric incorrect"
+
+
+
     def test_AUC(self):
 
         from Base.Evaluation.metrics import roc_auc
@@ -124,6 +124,7 @@ class Incremental_Training_Early_Stopping(object):
     def _train_with_early_stopping(self, epochs_max, epochs_min = 0,
                                    validation_every_n = None, stop_on_validation = False,
                                    validation_metric = None, lower_validations_allowed = None, evaluator_object = None,
+                                   validation_n_users_sample = None,
                                    algorithm_name = "Incremental_Training_Early_Stopping"):
         """
 
@@ -134,7 +135,9 @@ class Incremental_Training_Early_Stopping(object):
         :param validation_metric:           which metric to use when selecting the best model, higher values are better
         :param lower_validations_allowed:    number of contiguous validation steps required for the tranining to early-stop
         :param evaluator_object:            evaluator instance used to compute the validation metrics.
-                                                If multiple cutoffs are available, the first one is used
+                                                If multiple cutoffs are available, the first one is used.
+                                                Only validation_metric is computed, see Evaluator.evaluateRecommenderMetric
+        :param validation_n_users_sample:   if not None, the validation uses a fixed random sample of users of this size
         :param algorithm_name:              name of the algorithm to be displayed in the output updates
         :return: -
 
@@ -221,14 +224,19 @@ class Incremental_Training_Early_Stopping(object):
 
                 self._prepare_model_for_validation()
 
+                # The recommendations cached for the previous epochs are not valid anymore
+                self.clear_recommendation_cache()
+
                 # If the evaluator validation has multiple cutoffs, choose the first one
-                results_run, results_run_string = evaluator_object.evaluateRecommender(self)
-                results_run = results_run[list(results_run.keys())[0]]
+                current_metric_value, confidence_interval = evaluator_object.evaluateRecommenderMetric(self, validation_metric,
+                                                                                                       n_users_sample = validation_n_users_sample)
 
-                print("{}: {}".format(algorithm_name, results_run_string))
+                if confidence_interval is None:
+                    print("{}: {}: {:.7f}".format(algorithm_name, validation_metric, current_metric_value))
+                else:
+                    print("{}: {}: {:.7f} +- {:.7f}".format(algorithm_name, validation_metric, current_metric_value, confidence_interval))
 
                 # Update optimal model
-                current_metric_value = results_run[validation_metric]
 
                 if self.best_validation_metric is None or self.best_validation_metric < current_metric_value:
 
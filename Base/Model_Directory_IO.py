@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import scipy.sparse as sps
+import json, os
+
+
+# A model is saved in a directory containing a JSON header and one raw .npy file for each array:
+#     - model_header.json     recommender name, hyperparameters and the description of each attribute
+#     - <name>.npy            dense arrays
+#     - <name>.data.npy, <name>.indices.npy, <name>.indptr.npy     sparse matrices, in CSR or CSC format
+# The arrays can be loaded as read-only memory maps, so the processes loading the same model share its pages
+
+MODEL_HEADER_FILE_NAME = "model_header.json"
+MODEL_FORMAT_VERSION = 1
+
+
+
+def save_model_directory(folder_path, data_dict, recommender_name, hyperparameters = None):
+    """
+    :param folder_path:         Directory of the model, created if it does not exist
+    :param data_dict:           Attributes of the model: sparse matrices, numpy arrays and JSON serializable values
+    :param recommender_name:
+    :param hyperparameters:     Dictionary stored in the header, values that are not JSON serializable are stored as their repr
+    """
+
+    os.makedirs(folder_path, exist_ok=True)
+
+    attribute_header_dict = {}
+
+    for attribute_name, attribute_value in data_dict.items():
+
+        attribute_path = os.path.join(folder_path, attribute_name)
+
+        if sps.issparse(attribute_value):
+
+            if attribute_value.getformat() not in ["csr", "csc"]:
+                attribute_value = attribute_value.tocsr()
+
+            np.save(attribute_path + ".data.npy", attribute_value.data, allow_pickle=False)
+            np.save(attribute_path + ".indices.npy", attribute_value.indices, allow_pickle=False)
+            np.save(attribute_path + ".indptr.npy", attribute_value.indptr, allow_pickle=False)
+
+            attribute_header_dict[attribute_name] = {"type": "sparse",
+                                                     "format": attribute_value.getformat(),
+                                                     "shape": list(attribute_value.shape),
+                                                     "dtype": str(attribute_value.dtype)}
+
+        elif isinstance(attribute_value, np.ndarray):
+
+            np.save(attribute_path + ".npy", np.asarray(attribute_value), allow_pickle=False)
+
+            attribute_header_dict[attribute_name] = {"type": "dense",
+                                                     "shape": list(attribute_value.shape),
+                                                     "dtype": str(attribute_value.dtype)}
+
+        elif attribute_value is None or isinstance(attribute_value, (bool, int, float, str, np.generic)):
+
+            if isinstance(attribute_value, np.generic):
+                attribute_value = attribute_value.item()
+
+            attribute_header_dict[attribute_name] = {"type": "value",
+                                                     "value": attribute_value}
+
+        else:
+            raise ValueError("save_model_directory: attribute '{}' of type '{}' cannot be saved".format(attribute_name, type(attribute_value)))
+
+
+    header_dict = {"recommender_name": recommender_name,
+                   "format_version": MODEL_FORMAT_VERSION,
+                   "hyperparameters": hyperparameters,
+                   "attributes": attribute_header_dict}
+
+    # The header is written last, a directory without it is an incomplete model
+    with open(os.path.join(folder_path, MODEL_HEADER_FILE_NAME), "w") as header_file:
+        json.dump(header_dict, header_file, indent=4, default=repr)
+
+
+
+
+def load_model_header(folder_path):
+
+    with open(os.path.join(folder_path, MODEL_HEADER_FILE_NAME), "r") as header_file:
+        header_dict = json.load(header_file)
+
+    if header_dict["format_version"] != MODEL_FORMAT_VERSION:
+        raise ValueError("load_model_directory: model format version {} not supported, expected {}".format(
+            header_dict["format_version"], MODEL_FORMAT_VERSION))
+
+    return header_dict
+
+
+
+
+def load_model_directory(folder_path, mmap = True):
+    """
+    :param folder_path:
+    :param mmap:        If True the arrays are read-only memory maps of the files, otherwise they are read in memory
+    :return: dictionary with the attributes of the model and the header
+    """
+
+    header_dict = load_model_header(folder_path)
+    mmap_mode = "r" if mmap else None
+
+    data_dict = {}
+
+    for attribute_name, attribute_header in header_dict["attributes"].items():
+
+        attribute_path = os.path.join(folder_path, attribute_name)
+
+        if attribute_header["type"] == "sparse":
+
+            data = np.load(attribute_path + ".data.npy", mmap_mode=mmap_mode, allow_pickle=False)
+            indices = np.load(attribute_path + ".indices.npy", mmap_mode=mmap_mode, allow_pickle=False)
+            indptr = np.load(attribute_path + ".indptr.npy", mmap_mode=mmap_mode, allow_pickle=False)
+
+            sparse_constructor = sps.csr_matrix if attribute_header["format"] == "csr" else sps.csc_matrix
+
+            data_dict[attribute_name] = sparse_constructor((data, indices, indptr), shape=tuple(attribute_header["shape"]), copy=False)
+
+        elif attribute_header["type"] == "dense":
+            data_dict[attribute_name] = np.load(attribute_path + ".npy", mmap_mode=mmap_mode, allow_pickle=False)
+
+        else:
+            data_dict[attribute_name] = attribute_header["value"]
+
+    return data_dict, header_dict
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, tempfile, shutil
+
+import numpy as np
+import scipy.sparse as sps
+
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+from KNN.UserKNNCFRecommender import UserKNNCFRecommender
+from MatrixFactorization.PureSVD import PureSVDRecommender
+from Base.NonPersonalizedRecommender import TopPop
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        self.URM_train = sps.random(200, 300, density=0.05, format="csr", dtype=np.float64)
+        self.folder_path = tempfile.mkdtemp() + "/"
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_path)
+
+
+    def test_load_equals_saved(self):
+
+        for recommender_class, fit_args in [(ItemKNNCFRecommender, {"topK": 20, "shrink": 5}),
+                                            (UserKNNCFRecommender, {"topK": 20, "similarity": "jaccard"}),
+                                            (PureSVDRecommender, {"num_factors": 10}),
+                                            (TopPop, {})]:
+
+            recommender = recommender_class(self.URM_train)
+            recommender.fit(**fit_args)
+            recommender.saveModelDirectory(self.folder_path, hyperparameters = fit_args)
+
+            for mmap in [True, False]:
+
+                recommender_loaded = recommender_class(self.URM_train)
+                recommender_loaded.loadModelDirectory(self.folder_path, mmap = mmap)
+
+                user_id_array = np.arange(200)
+
+                assert np.allclose(recommender._compute_item_score(user_id_array), recommender_loaded._compute_item_score(user_id_array)), \
+                    "Loaded model not matching saved model for {}".format(recommender_class.RECOMMENDER_NAME)
+
+                for parameter_name, parameter_value in fit_args.items():
+                    assert recommender_loaded._fit_hyperparameters[parameter_name] == parameter_value, "Hyperparameters not saved"
+
+
+    def test_load_wrong_recommender(self):
+
+        recommender = TopPop(self.URM_train)
+        recommender.fit()
+        recommender.saveModelDirectory(self.folder_path, folder_name = "model")
+
+        with self.assertRaises(ValueError):
+            ItemKNNCFRecommender(self.URM_train).loadModelDirectory(self.folder_path, folder_name = "model")
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -33,6 +33,8 @@ class TopPop(Recommender):
         self.item_pop = np.ediff1d(self.URM_train.tocsc().indptr)
         self.n_items = self.URM_train.shape[1]
 
+        self.clear_recommendation_cache()
+
 
     def _compute_score_top_pop(self, user_id_array, items_to_compute = None):
 
@@ -50,6 +52,14 @@ class TopPop(Recommender):
         return scores_batch
 
 
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
+        return self.item_pop[item_pair_array].astype(np.float32)
+
+
+    def _get_model_dict(self):
+        return {"item_pop": self.item_pop}
+
+
     def saveModel(self, folder_path, file_name = None):
 
         if file_name is None:
@@ -57,7 +67,7 @@ class TopPop(Recommender):
 
         print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
 
-        dictionary_to_save = {"item_pop": self.item_pop}
+        dictionary_to_save = self._get_model_dict()
 
         pickle.dump(dictionary_to_save,
                     open(folder_path + file_name, "wb"),
@@ -128,6 +138,8 @@ class GlobalEffects(Recommender):
 
         self.URM_train = check_matrix(self.URM_train, 'csr', dtype=np.float32)
 
+        self.clear_recommendation_cache()
+
 
     def _compute_score_global_effects(self, user_id_array, items_to_compute=None):
 
@@ -145,6 +157,14 @@ class GlobalEffects(Recommender):
         return scores_batch
 
 
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
+        return self.item_bias[item_pair_array]
+
+
+    def _get_model_dict(self):
+        return {"item_bias": self.item_bias}
+
+
     def saveModel(self, folder_path, file_name = None):
 
         if file_name is None:
@@ -152,7 +172,7 @@ class GlobalEffects(Recommender):
 
         print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
 
-        dictionary_to_save = {"item_bias": self.item_bias}
+        dictionary_to_save = self._get_model_dict()
 
         pickle.dump(dictionary_to_save,
                     open(folder_path + file_name, "wb"),
@@ -180,6 +200,8 @@ class Random(Recommender):
         np.random.seed(random_seed)
         self.n_items = self.URM_train.shape[1]
 
+        self.clear_recommendation_cache()
+
 
     def _compute_score_random(self, user_id_array, items_to_compute = None):
 
@@ -195,6 +217,14 @@ class Random(Recommender):
         return scores_batch
 
 
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
+        return np.random.rand(len(user_pair_array))
+
+
+
+    def _get_model_dict(self):
+        return {}
+
 
     def saveModel(self, folder_path, file_name = None):
 
@@ -203,7 +233,7 @@ class Random(Recommender):
 
         print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
 
-        dictionary_to_save = {}
+        dictionary_to_save = self._get_model_dict()
 
         pickle.dump(dictionary_to_save,
                     open(folder_path + file_name, "wb"),
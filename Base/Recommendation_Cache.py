@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import threading
+from collections import OrderedDict
+
+
+
+class Recommendation_Cache(object):
+    """
+    Size-bounded cache of the top-max_cutoff ranking and scores of the users.
+    The rankings are stored in preallocated int32 and float32 arrays, one slot per cached key, and the least recently
+    used key is evicted when all the slots are taken.
+    The methods are guarded by a lock, so the cache can be shared by recommend calls in different threads as long as
+    the recommender itself supports concurrent calls.
+    """
+
+    def __init__(self, max_cutoff, max_size):
+        """
+        :param max_cutoff:      Length of the cached rankings
+        :param max_size:        Maximum number of cached keys
+        """
+
+        super(Recommendation_Cache, self).__init__()
+
+        if max_cutoff is None or max_cutoff < 1:
+            raise ValueError("Recommendation_Cache: value for paramether 'max_cutoff' must be a positive integer. Passed value was '{}'".format(max_cutoff))
+
+        if max_size is None or max_size < 1:
+            raise ValueError("Recommendation_Cache: value for paramether 'max_size' must be a positive integer. Passed value was '{}'".format(max_size))
+
+        self.max_cutoff = max_cutoff
+        self.max_size = max_size
+
+        self.ranking = np.zeros((self.max_size, self.max_cutoff), dtype=np.int32)
+        self.ranking_scores = np.zeros((self.max_size, self.max_cutoff), dtype=np.float32)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+        self.clear()
+
+
+
+    def __getstate__(self):
+
+        # The lock cannot be pickled
+        state = self.__dict__.copy()
+        del state["_lock"]
+
+        return state
+
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+
+    def clear(self):
+        """
+        Removes all the cached keys, the hit and miss counters are kept
+        """
+
+        with self._lock:
+            # Key to slot, from the least to the most recently used
+            self.key_to_slot = OrderedDict()
+            self.free_slots = list(range(self.max_size - 1, -1, -1))
+
+
+    def __len__(self):
+        return len(self.key_to_slot)
+
+
+
+    def get_slots(self, key_list):
+        """
+        Looks up the keys, marking the found ones as the most recently used.
+        The slots may be reused by a later put, use get_rankings to read the rankings while other threads add keys
+        :param key_list:
+        :return: int array with the slot of each key or -1 if the key is not cached
+        """
+
+        with self._lock:
+            return self._get_slots(key_list)
+
+
+
+    def get_rankings(self, key_list, cutoff):
+        """
+        Looks up the keys and copies their rankings in a single step
+        :param key_list:
+        :param cutoff:
+        :return: bool array with the cached keys and int32 array (n cached keys, cutoff) with their rankings
+        """
+
+        with self._lock:
+            slot_array = self._get_slots(key_list)
+            hit_mask = slot_array != -1
+
+            return hit_mask, self.ranking[slot_array[hit_mask], :cutoff]
+
+
+
+    def _get_slots(self, key_list):
+
+        slot_array = np.full(len(key_list), -1, dtype=np.int64)
+
+        for key_index, key in enumerate(key_list):
+
+            slot = self.key_to_slot.get(key, None)
+
+            if slot is not None:
+                self.key_to_slot.move_to_end(key)
+                slot_array[key_index] = slot
+
+        n_hits = int((slot_array != -1).sum())
+
+        self.hits += n_hits
+        self.misses += len(key_list) - n_hits
+
+        return slot_array
+
+
+
+    def put(self, key_list, ranking, ranking_scores):
+        """
+        Stores the rankings of the keys, evicting the least recently used ones if needed
+        :param key_list:
+        :param ranking:             array (len(key_list), max_cutoff)
+        :param ranking_scores:      array (len(key_list), max_cutoff)
+        """
+
+        assert ranking.shape == ranking_scores.shape == (len(key_list), self.max_cutoff), \
+            "Recommendation_Cache: ranking shape is not (len(key_list), max_cutoff)"
+
+        with self._lock:
+            for key_index, key in enumerate(key_list):
+
+                slot = self.key_to_slot.get(key, None)
+
+                if slot is not None:
+                    self.key_to_slot.move_to_end(key)
+
+                elif len(self.free_slots) > 0:
+                    slot = self.free_slots.pop()
+                    self.key_to_slot[key] = slot
+
+                else:
+                    _, slot = self.key_to_slot.popitem(last=False)
+                    self.key_to_slot[key] = slot
+
+                self.ranking[slot] = ranking[key_index]
+                self.ranking_scores[slot] = ranking_scores[key_index]
+
+
+
+    def get_stats(self):
+
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "size": len(self),
+                    "max_size": self.max_size,
+                    "max_cutoff": self.max_cutoff}
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sps
+
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+from Base.NonPersonalizedRecommender import TopPop
+from MatrixFactorization.PureSVD import PureSVDRecommender
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        self.URM_train = sps.random(200, 300, density=0.05, format="csr", dtype=np.float64)
+
+
+    def test_cached_ranking_equals_recommend(self):
+
+        for recommender_class in [ItemKNNCFRecommender, TopPop]:
+
+            recommender = recommender_class(self.URM_train)
+            recommender.fit()
+
+            user_id_array = np.arange(200)
+            ranking_list, scores_batch = recommender.recommend(user_id_array, cutoff=10, return_scores=True)
+
+            recommender.enable_recommendation_cache(max_cutoff=20)
+
+            for _ in range(2):
+                cached_ranking_list = recommender.recommend(user_id_array, cutoff=10)
+
+                # Items with equal scores may be ranked differently
+                assert np.allclose(np.take_along_axis(scores_batch, np.array(cached_ranking_list), axis=1),
+                                   np.take_along_axis(scores_batch, np.array(ranking_list), axis=1)), "Cached ranking not matching recommend"
+
+            assert recommender.recommend(5, cutoff=10) == cached_ranking_list[5], "Cached ranking of a single user not matching"
+
+            cache_stats = recommender.get_recommendation_cache_stats()
+            assert cache_stats["misses"] == 200 and cache_stats["hits"] == 201, "Wrong hit and miss counters"
+
+
+    def test_invalidation_and_eviction(self):
+
+        recommender = ItemKNNCFRecommender(self.URM_train)
+        recommender.fit(topK=10)
+
+        recommender.enable_recommendation_cache(max_cutoff=20, max_users=50)
+        recommender.precompute_recommendation_cache(batch_size=64)
+
+        cache_stats = recommender.get_recommendation_cache_stats()
+        assert cache_stats["size"] == 50, "Cache exceeds its size"
+
+        # The last users are kept
+        recommender.recommend(np.arange(150, 200), cutoff=5)
+        assert recommender.get_recommendation_cache_stats()["hits"] == 50, "Least recently used users not evicted"
+
+        items_to_ignore = np.arange(0, 300, 3)
+        recommender.set_items_to_ignore(items_to_ignore)
+        assert recommender.get_recommendation_cache_stats()["size"] == 0, "Cache not cleared by set_items_to_ignore"
+
+        ranking_list = recommender.recommend(np.arange(150, 200), cutoff=5, remove_CustomItems_flag=True)
+        assert not np.isin(ranking_list, items_to_ignore).any(), "Cached ranking contains ignored items"
+
+        recommender.fit(topK=5)
+        assert recommender.get_recommendation_cache_stats()["size"] == 0, "Cache not cleared by fit"
+
+
+    def test_cleared_by_fit_and_load(self):
+
+        for recommender_class, fit_args in [(ItemKNNCFRecommender, {"topK": 10}), (PureSVDRecommender, {"num_factors": 10}), (TopPop, {})]:
+
+            recommender = recommender_class(self.URM_train)
+            recommender.fit(**fit_args)
+
+            recommender.enable_recommendation_cache(max_cutoff=20)
+            recommender.precompute_recommendation_cache()
+
+            recommender.fit(**fit_args)
+            assert recommender.get_recommendation_cache_stats()["size"] == 0, "Cache not cleared by fit of {}".format(recommender_class.RECOMMENDER_NAME)
+
+            recommender.precompute_recommendation_cache()
+            recommender._set_model_dict(recommender._get_model_dict())
+            assert recommender.get_recommendation_cache_stats()["size"] == 0, "Cache not cleared when loading {}".format(recommender_class.RECOMMENDER_NAME)
+
+
+    def test_threaded_precompute_and_recommend(self):
+
+        # Large enough for the batches computed by different threads to overlap
+        URM_train = sps.random(5000, 1000, density=0.02, format="csr", dtype=np.float64)
+
+        for recommender_class in [PureSVDRecommender, TopPop, ItemKNNCFRecommender]:
+
+            recommender = recommender_class(URM_train)
+            recommender.fit()
+            recommender.recommend_n_threads = 2
+
+            # The reference ranking is computed without the cache
+            ranking, _ = recommender.recommend_top_n(np.arange(5000), 20)
+
+            recommender.enable_recommendation_cache(max_cutoff=20)
+            recommender.precompute_recommendation_cache(batch_size=100)
+            serial_ranking = recommender._recommendation_cache.ranking.copy()
+
+            recommender.clear_recommendation_cache()
+            recommender.precompute_recommendation_cache(batch_size=100, n_threads=4)
+
+            assert np.array_equal(serial_ranking, ranking), "Precompute not matching recommend_top_n"
+            assert np.array_equal(recommender._recommendation_cache.ranking, serial_ranking), "Threaded precompute not matching the serial one"
+
+            # Concurrent recommend calls evicting each other's users
+            recommender.enable_recommendation_cache(max_cutoff=20, max_users=30)
+            ranking_list = recommender.recommend(np.arange(5000), cutoff=10)
+
+            user_id_array = np.random.permutation(5000)
+
+            with ThreadPoolExecutor(max_workers = 4) as executor:
+                threaded_ranking_list = list(executor.map(lambda user_id: recommender.recommend(user_id, cutoff=10), user_id_array))
+
+            for user_index, user_id in enumerate(user_id_array):
+                assert threaded_ranking_list[user_index] == ranking_list[user_id], "Ranking of concurrent calls not matching"
+
+            assert len(recommender._recommendation_cache) == 30, "Cache exceeds its size"
+
+            # The cache can be sent to other processes
+            recommender_cache = pickle.loads(pickle.dumps(recommender._recommendation_cache))
+            assert recommender_cache.get_stats() == recommender.get_recommendation_cache_stats()
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -6,7 +6,34 @@
 """
 
 import numpy as np
-import pickle, os
+import pickle, os, functools
+from concurrent.futures import ThreadPoolExecutor
+
+from Base.Recommendation_Cache import Recommendation_Cache
+from Base.Model_Directory_IO import save_model_directory, load_model_directory
+from Base.Similarity.Compute_Similarity_Bias_Parametric import similarity_data_top_k
+
+
+
+def _get_pair_bitmap(pair_keys, n_pairs):
+    """
+    :return: uint8 array with one bit for each of the n_pairs keys, the bits of pair_keys are set
+    """
+
+    pair_keys = np.sort(pair_keys)
+
+    bitmap = np.zeros((n_pairs + 7)//8, dtype=np.uint8)
+    byte_index, byte_start = np.unique(pair_keys >> 3, return_index=True)
+
+    if len(pair_keys) > 0:
+        bitmap[byte_index] = np.bitwise_or.reduceat(np.left_shift(1, pair_keys & 7).astype(np.uint8), byte_start)
+
+    return bitmap
+
+
+def _is_in_pair_bitmap(bitmap, pair_keys):
+    return (bitmap[pair_keys >> 3] >> (pair_keys & 7).astype(np.uint8)) & 1 == 1
+
 
 
 class Recommender(object):
@@ -14,6 +41,9 @@ class Recommender(object):
 
     RECOMMENDER_NAME = "Recommender_Base_Class"
 
+    # Number of candidates of each row used to bound the cutoff-th score when ranking sparse scores
+    SPARSE_RANKING_SAMPLE_SIZE = 256
+
     def __init__(self):
 
         super(Recommender, self).__init__()
@@ -28,6 +58,9 @@ class Recommender(object):
         self.items_to_ignore_flag = False
         self.items_to_ignore_ID = np.array([], dtype=np.int)
 
+        # Per-user cache of the recommendations, disabled by default, see enable_recommendation_cache
+        self._recommendation_cache = None
+
 
     def fit(self):
         pass
@@ -40,11 +73,42 @@ class Recommender(object):
 
         self.items_to_ignore_flag = True
         self.items_to_ignore_ID = np.array(items_to_ignore, dtype=np.int)
+        self._removed_items_mask_cache = {}
+        self.clear_recommendation_cache()
 
     def reset_items_to_ignore(self):
 
         self.items_to_ignore_flag = False
         self.items_to_ignore_ID = np.array([], dtype=np.int)
+        self._removed_items_mask_cache = {}
+        self.clear_recommendation_cache()
+
+
+    def _get_removed_items_mask(self, remove_top_pop_flag, remove_CustomItems_flag):
+        """
+        Boolean mask of the items removed for all the users, it is built once for each list of items to ignore
+        :return: the mask or None if no item is removed
+        """
+
+        if not hasattr(self, "_removed_items_mask_cache"):
+            self._removed_items_mask_cache = {}
+
+        cache_key = (remove_top_pop_flag, remove_CustomItems_flag)
+
+        if cache_key not in self._removed_items_mask_cache:
+
+            removed_items_mask = np.zeros(self.URM_train.shape[1], dtype=bool)
+
+            if remove_top_pop_flag:
+                removed_items_mask[self.filterTopPop_ItemsID] = True
+
+            if remove_CustomItems_flag:
+                removed_items_mask[self.items_to_ignore_ID] = True
+
+            self._removed_items_mask_cache[cache_key] = removed_items_mask if removed_items_mask.any() else None
+
+        return self._removed_items_mask_cache[cache_key]
+
 
 
     def _remove_TopPop_on_scores(self, scores_batch):
@@ -88,8 +152,50 @@ class Recommender(object):
 
 
 
+    def _compute_item_score_sparse(self, user_id_array):
+        """
+        Sparse version of _compute_item_score, for the recommenders whose scores are mostly zero
+        :param user_id_array:       array containing the user indices whose recommendations need to be computed
+        :return:                    csr_matrix (len(user_id_array), n_items) with the score,
+                                        or None if the current recommender does not support it
+        """
+        return None
+
+
+
+
+
+
+    def _compute_top_n_compiled(self, user_id_array, cutoff, remove_seen_flag, remove_top_pop_flag, remove_CustomItems_flag,
+                                return_sparse_scores):
+        """
+        Compiled computation of the scores and ranking at once, for the recommenders having one
+        :return:                    ranking array (len(user_id_array), cutoff) and, if return_sparse_scores, the scores as in
+                                        _compute_item_score_sparse, or None if the current recommender does not support it
+        """
+        return None
+
+
+
+
+
+
     def recommend(self, user_id_array, cutoff = None, remove_seen_flag=True, items_to_compute = None,
-                  remove_top_pop_flag = False, remove_CustomItems_flag = False, return_scores = False):
+                  remove_top_pop_flag = False, remove_CustomItems_flag = False, return_scores = False, sparse_scores = False):
+        """
+
+        :param user_id_array:
+        :param cutoff:
+        :param remove_seen_flag:
+        :param items_to_compute:
+        :param remove_top_pop_flag:
+        :param remove_CustomItems_flag:
+        :param return_scores:
+        :param sparse_scores:       If True and the recommender supports it, the scores are returned as a csr_matrix
+                                        without removing the seen and ignored items, see _compute_item_score_sparse.
+                                        Otherwise the scores are a dense array where the removed items have score -np.inf
+        :return:
+        """
 
         # If is a scalar transform it in a 1-cell array
         if np.isscalar(user_id_array):
@@ -102,11 +208,69 @@ class Recommender(object):
         if cutoff is None:
             cutoff = self.URM_train.shape[1] - 1
 
-        # Compute the scores using the model-specific function
-        # Vectorize over all users in user_id_array
-        scores_batch = self._compute_item_score(user_id_array, items_to_compute=items_to_compute)
+
+        recommendation_cache = getattr(self, "_recommendation_cache", None)
+
+        if recommendation_cache is not None and items_to_compute is None and not return_scores and \
+                cutoff <= recommendation_cache.max_cutoff:
+
+            ranking_list = self._recommend_from_cache(user_id_array, cutoff, remove_seen_flag, remove_top_pop_flag,
+                                                      remove_CustomItems_flag)
+
+            if single_user:
+                ranking_list = ranking_list[0]
+
+            return ranking_list
+
+
+        # The top-N is taken from the sparse scores unless all the item scores are required
+        scores_batch = None
+        compiled_result = None
+
+        if items_to_compute is None and (not return_scores or sparse_scores):
+            compiled_result = self._compute_top_n_compiled(user_id_array, cutoff, remove_seen_flag, remove_top_pop_flag,
+                                                           remove_CustomItems_flag, return_scores)
+
+            if compiled_result is None:
+                scores_batch = self._compute_item_score_sparse(user_id_array)
+
+        if compiled_result is not None:
+            ranking, scores_batch = compiled_result
+            ranking_list = ranking.tolist()
+
+        elif scores_batch is not None:
+            ranking_list = self._get_ranking_from_sparse_scores(user_id_array, scores_batch, cutoff, remove_seen_flag,
+                                                                remove_top_pop_flag, remove_CustomItems_flag)
+
+        else:
+            # Compute the scores using the model-specific function
+            # Vectorize over all users in user_id_array
+            scores_batch = self._compute_item_score(user_id_array, items_to_compute=items_to_compute)
+
+            ranking_list = self._get_ranking_from_dense_scores(user_id_array, scores_batch, cutoff, remove_seen_flag,
+                                                               remove_top_pop_flag, remove_CustomItems_flag)
 
 
+        # Return single list for one user, instead of list of lists
+        if single_user:
+            ranking_list = ranking_list[0]
+
+
+        if return_scores:
+            return ranking_list, scores_batch
+
+        else:
+            return ranking_list
+
+
+
+
+    def _get_ranking_from_dense_scores(self, user_id_array, scores_batch, cutoff, remove_seen_flag,
+                                       remove_top_pop_flag, remove_CustomItems_flag):
+        """
+        Removes the seen and ignored items from scores_batch, in place, and returns the ranking list
+        """
+
         # if self.normalize:
         #     # normalization will keep the scores in the same range
         #     # of value of the ratings in dataset
@@ -122,29 +286,24 @@ class Recommender(object):
         #     scores /= den
 
 
-        for user_index in range(len(user_id_array)):
-
-            user_id = user_id_array[user_index]
+        # The seen items of all the users are removed at once, the rows of their interactions are taken from the CSR structure
+        if remove_seen_flag:
+            assert self.URM_train.getformat() == "csr", "Recommender_Base_Class: URM_train is not CSR, this will cause errors in filtering seen items"
 
-            if remove_seen_flag:
-                scores_batch[user_index,:] = self._remove_seen_on_scores(user_id, scores_batch[user_index, :])
+            URM_train_batch = self.URM_train[user_id_array]
+            seen_user_index = np.repeat(np.arange(len(user_id_array)), np.diff(URM_train_batch.indptr))
 
-            # Sorting is done in three steps. Faster then plain np.argsort for higher number of items
-            # - Partition the data to extract the set of relevant items
-            # - Sort only the relevant items
-            # - Get the original item index
-            # relevant_items_partition = (-scores_user).argpartition(cutoff)[0:cutoff]
-            # relevant_items_partition_sorting = np.argsort(-scores_user[relevant_items_partition])
-            # ranking = relevant_items_partition[relevant_items_partition_sorting]
-            #
-            # ranking_list.append(ranking)
+            scores_batch[seen_user_index, URM_train_batch.indices] = -np.inf
 
+        removed_items_mask = self._get_removed_items_mask(remove_top_pop_flag, remove_CustomItems_flag)
 
-        if remove_top_pop_flag:
-            scores_batch = self._remove_TopPop_on_scores(scores_batch)
+        if removed_items_mask is not None:
+            scores_batch[:, removed_items_mask] = -np.inf
 
-        if remove_CustomItems_flag:
-            scores_batch = self._remove_CustomItems_on_scores(scores_batch)
+        # Sorting is done in three steps. Faster then plain np.argsort for higher number of items
+        # - Partition the data to extract the set of relevant items
+        # - Sort only the relevant items
+        # - Get the original item index
 
         # scores_batch = np.arange(0,3260).reshape((1, -1))
         # scores_batch = np.repeat(scores_batch, 1000, axis = 0)
@@ -159,22 +318,335 @@ class Recommender(object):
         relevant_items_partition_sorting = np.argsort(-relevant_items_partition_original_value, axis=1)
         ranking = relevant_items_partition[np.arange(relevant_items_partition.shape[0])[:, None], relevant_items_partition_sorting]
 
-        ranking_list = ranking.tolist()
+        return ranking.tolist()
 
 
-        # Return single list for one user, instead of list of lists
-        if single_user:
-            ranking_list = ranking_list[0]
 
 
-        if return_scores:
-            return ranking_list, scores_batch
+    def _get_sparse_candidate_mask(self, user_index, items, scores, removed_items_mask, seen_pair_bitmap):
+        """
+        :return: boolean mask of the (user_index, item) pairs of the batch which have a positive score and are not removed
+        """
+
+        candidate_mask = scores > 0
+
+        if removed_items_mask is not None:
+            candidate_mask &= ~removed_items_mask[items]
+
+        if seen_pair_bitmap is not None:
+            candidate_mask &= ~_is_in_pair_bitmap(seen_pair_bitmap, user_index.astype(np.int64)*self.URM_train.shape[1] + items)
+
+        return candidate_mask
+
+
+
+    def _get_ranking_from_sparse_scores(self, user_id_array, scores_batch, cutoff, remove_seen_flag,
+                                        remove_top_pop_flag, remove_CustomItems_flag):
+        """
+        Returns the ranking list taking the top-N from the rows of the csr scores_batch, skipping the seen and ignored items.
+        The items not in the row have score zero, therefore the row is only used if it has at least cutoff positive
+        scores, otherwise it is converted to dense and ranked as in _get_ranking_from_dense_scores
+
+        All the rows are processed at once:
+        - The cutoff-th highest score among a sample of the candidates of a row is a lower bound of the one of the
+            whole row, only the elements above it can be in the top-N. The sample is evenly spaced in the row,
+            rows shorter than the sample are used entirely
+        - The seen and ignored items are removed from the remaining elements
+        - The top-N of all the rows are selected at once as in similarity_data_top_k, then sorted by decreasing score
+        """
+
+        n_users, n_items = scores_batch.shape
+        row_length = np.diff(scores_batch.indptr)
+
+        removed_items_mask = self._get_removed_items_mask(remove_top_pop_flag, remove_CustomItems_flag)
+        seen_pair_bitmap = None
+
+        if remove_seen_flag:
+            assert self.URM_train.getformat() == "csr", "Recommender_Base_Class: URM_train is not CSR, this will cause errors in filtering seen items"
+
+            # A (row, item) pair is identified by a single key, the seen ones are marked in a bitmap of the batch
+            # which requires 1/32 of the memory of its dense scores
+            URM_train_batch = self.URM_train[user_id_array]
+            seen_user_index = np.repeat(np.arange(n_users, dtype=np.int64), np.diff(URM_train_batch.indptr))
+            seen_pair_bitmap = _get_pair_bitmap(seen_user_index*n_items + URM_train_batch.indices, n_users*n_items)
+
+        # The bound is only computed for the rows longer than the sample, the others are used entirely
+        sample_size = max(self.SPARSE_RANKING_SAMPLE_SIZE, 8*cutoff)
+        sample_user_index = np.flatnonzero(row_length > sample_size)
+
+        sample_offset = np.arange(sample_size)[None,:] * (row_length[sample_user_index] // sample_size)[:,None]
+        sample_position = scores_batch.indptr[sample_user_index][:,None] + sample_offset
+
+        sample_scores = scores_batch.data[sample_position]
+        sample_candidate_mask = self._get_sparse_candidate_mask(sample_user_index[:,None], scores_batch.indices[sample_position],
+                                                                sample_scores, removed_items_mask, seen_pair_bitmap)
+
+        sample_scores = np.where(sample_candidate_mask, sample_scores, -np.inf)
+
+        # The bound is -inf if the sample has fewer than cutoff candidates, then the whole row is used
+        score_lower_bound = np.full(n_users, -np.inf)
+        score_lower_bound[sample_user_index] = -np.partition(-sample_scores, cutoff-1, axis=1)[:, cutoff-1]
+
+        row_user_index = np.repeat(np.arange(n_users, dtype=np.int32), row_length)
+        above_bound_mask = scores_batch.data >= score_lower_bound[row_user_index]
+
+        candidate_user_index = row_user_index[above_bound_mask]
+        candidate_items = scores_batch.indices[above_bound_mask]
+        candidate_scores = scores_batch.data[above_bound_mask]
+
+        candidate_mask = self._get_sparse_candidate_mask(candidate_user_index, candidate_items, candidate_scores,
+                                                         removed_items_mask, seen_pair_bitmap)
+
+        # Only the users with fewer than cutoff candidates need the items having score zero
+        n_candidates = np.bincount(candidate_user_index[candidate_mask], minlength=n_users)
+        sparse_user_mask = n_candidates >= cutoff
+
+        candidate_mask &= sparse_user_mask[candidate_user_index]
+
+        candidate_indptr = np.zeros(n_users + 1, dtype=np.int64)
+        candidate_indptr[1:] = np.cumsum(np.where(sparse_user_mask, n_candidates, 0))
+
+        # Each user in sparse_user_mask has exactly cutoff items selected, which are then sorted by decreasing score
+        top_n_scores, top_n_items, _ = similarity_data_top_k(candidate_scores[candidate_mask], candidate_items[candidate_mask],
+                                                             candidate_indptr, n_users, cutoff)
+
+        top_n_scores = top_n_scores.reshape((-1, cutoff))
+        top_n_items = top_n_items.reshape((-1, cutoff))
+
+        sparse_ranking = np.take_along_axis(top_n_items, np.argsort(-top_n_scores, axis=1, kind="stable"), axis=1)
+
+        ranking_list = [None]*n_users
+
+        for user_index, ranking in zip(np.flatnonzero(sparse_user_mask), sparse_ranking.tolist()):
+            ranking_list[user_index] = ranking
+
+        dense_user_index_array = np.flatnonzero(~sparse_user_mask)
+
+        if len(dense_user_index_array) > 0:
+
+            dense_ranking_list = self._get_ranking_from_dense_scores(user_id_array[dense_user_index_array],
+                                                                     scores_batch[dense_user_index_array].toarray(),
+                                                                     cutoff, remove_seen_flag,
+                                                                     remove_top_pop_flag, remove_CustomItems_flag)
+
+            for user_index, ranking in zip(dense_user_index_array, dense_ranking_list):
+                ranking_list[user_index] = ranking
+
+        return ranking_list
+
+
 
+
+
+
+    def recommend_top_n(self, user_id_array, cutoff, remove_seen_flag = True, remove_top_pop_flag = False, remove_CustomItems_flag = False):
+        """
+        Computes the top-N of the users in user_id_array as compact arrays, the ranking is the same recommend returns
+        :return: ranking int32 array (len(user_id_array), cutoff) and the float32 scores of the ranked items
+        """
+
+        user_id_array = np.atleast_1d(user_id_array)
+
+        ranking_list, scores_batch = self.recommend(user_id_array, cutoff = cutoff, remove_seen_flag = remove_seen_flag,
+                                                    remove_top_pop_flag = remove_top_pop_flag,
+                                                    remove_CustomItems_flag = remove_CustomItems_flag,
+                                                    return_scores = True)
+
+        ranking = np.array(ranking_list, dtype=np.int32).reshape((len(user_id_array), -1))
+        ranking_scores = scores_batch[np.arange(len(user_id_array))[:, None], ranking].astype(np.float32)
+
+        return ranking, ranking_scores
+
+
+
+
+
+    def score_candidates(self, user_id_array, candidate_item_lists):
+        """
+        Computes the scores of a list of candidate items for each user, without computing the rest of the catalogue
+        :param user_id_array:
+        :param candidate_item_lists:    list with the array of candidate items of each user, of any length
+        :return:                        list with the float32 array of the scores of the candidates of each user
+        """
+
+        user_id_array = np.atleast_1d(user_id_array)
+
+        if len(user_id_array) != len(candidate_item_lists):
+            raise ValueError("{}: user_id_array and candidate_item_lists must have the same length, found {} and {}".format(
+                self.RECOMMENDER_NAME, len(user_id_array), len(candidate_item_lists)))
+
+        n_candidates = np.array([len(candidate_items) for candidate_items in candidate_item_lists], dtype=np.int64)
+
+        user_pair_array = np.repeat(user_id_array, n_candidates)
+
+        if n_candidates.sum() > 0:
+            item_pair_array = np.concatenate([np.asarray(candidate_items, dtype=np.int64).ravel() for candidate_items in candidate_item_lists])
         else:
-            return ranking_list
+            item_pair_array = np.zeros(0, dtype=np.int64)
+
+        pair_scores = np.asarray(self._compute_pair_score(user_pair_array, item_pair_array), dtype=np.float32).ravel()
+
+        return np.split(pair_scores, np.cumsum(n_candidates)[:-1])
+
+
+
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
+        """
+        Computes the score of each (user, item) pair, the recommenders override it to avoid computing all the items.
+        By default the dense scores of the users are computed on the requested items only
+        :param user_pair_array:
+        :param item_pair_array:
+        :return:                array with the score of each pair
+        """
+
+        if len(user_pair_array) == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        user_id_array, user_index = np.unique(user_pair_array, return_inverse=True)
+        items_to_compute = np.unique(item_pair_array)
+
+        scores_batch = self._compute_item_score(user_id_array, items_to_compute = items_to_compute)
+
+        return scores_batch[user_index, item_pair_array]
+
+
+
+
+
+    def enable_recommendation_cache(self, max_cutoff, max_users = None):
+        """
+        Enables a cache of the top-max_cutoff ranking and scores of each user. recommend uses it when the scores are not
+        required, items_to_compute is None and cutoff <= max_cutoff.
+        The cache is cleared at the end of fit, by set_items_to_ignore, reset_items_to_ignore and when loading a model
+        :param max_cutoff:
+        :param max_users:       Maximum number of cached users, the least recently used are evicted. If None, all the users
+        """
+
+        n_users, n_items = self.URM_train.shape
+
+        if max_users is None:
+            max_users = n_users
+
+        # As in recommend, at most all items but one are ranked
+        self._recommendation_cache = Recommendation_Cache(min(max_cutoff, n_items - 1), max_users)
+
+
+    def disable_recommendation_cache(self):
+        self._recommendation_cache = None
+
+
+    def clear_recommendation_cache(self):
+
+        if getattr(self, "_recommendation_cache", None) is not None:
+            self._recommendation_cache.clear()
+
+
+    def get_recommendation_cache_stats(self):
+        """
+        :return: dictionary with the hits, misses and size of the recommendation cache or None if it is not enabled
+        """
+
+        if getattr(self, "_recommendation_cache", None) is None:
+            return None
+
+        return self._recommendation_cache.get_stats()
+
+
+
+    def precompute_recommendation_cache(self, user_id_array = None, batch_size = 1000, remove_seen_flag = True,
+                                        remove_top_pop_flag = False, remove_CustomItems_flag = False, n_threads = 1):
+        """
+        Fills the recommendation cache computing the users in batches with recommend_top_n
+        :param user_id_array:       If None, all the users. If more than the cache size, only the last ones are kept
+        :param batch_size:
+        :param n_threads:           Number of batches computed at the same time. The score products and the ranking
+                                    release the GIL, so this speeds up e.g. the matrix factorization and non personalized
+                                    recommenders. The compiled top-N of the similarity recommenders runs one call at a
+                                    time, it already uses recommend_n_threads threads, use that instead
+        """
+
+        if getattr(self, "_recommendation_cache", None) is None:
+            raise ValueError("{}: recommendation cache is not enabled, call enable_recommendation_cache first".format(self.RECOMMENDER_NAME))
+
+        if user_id_array is None:
+            user_id_array = np.arange(self.URM_train.shape[0])
 
+        if n_threads is None or n_threads < 1:
+            raise ValueError("{}: value for paramether 'n_threads' must be a positive integer. Passed value was '{}'".format(self.RECOMMENDER_NAME, n_threads))
 
+        user_id_array = np.atleast_1d(user_id_array)
+        user_batch_list = [user_id_array[batch_start:batch_start + batch_size] for batch_start in range(0, len(user_id_array), batch_size)]
 
+        compute_top_n = functools.partial(self.recommend_top_n, cutoff = self._recommendation_cache.max_cutoff,
+                                          remove_seen_flag = remove_seen_flag,
+                                          remove_top_pop_flag = remove_top_pop_flag,
+                                          remove_CustomItems_flag = remove_CustomItems_flag)
+
+        with ThreadPoolExecutor(max_workers = n_threads) as executor:
+
+            # The batches are added in order, so that the last users are kept
+            for user_batch, (ranking, ranking_scores) in zip(user_batch_list, executor.map(compute_top_n, user_batch_list)):
+
+                cache_key_list = [(user_id, remove_seen_flag, remove_top_pop_flag, remove_CustomItems_flag) for user_id in user_batch.tolist()]
+
+                self._recommendation_cache.put(cache_key_list, ranking, ranking_scores)
+
+
+
+    def _recommend_from_cache(self, user_id_array, cutoff, remove_seen_flag, remove_top_pop_flag, remove_CustomItems_flag):
+        """
+        Returns the ranking list taking the cached users from the recommendation cache and computing the others,
+        which are then added to the cache
+        """
+
+        user_id_array = np.asarray(user_id_array)
+        recommendation_cache = self._recommendation_cache
+
+        cache_key_list = [(user_id, remove_seen_flag, remove_top_pop_flag, remove_CustomItems_flag) for user_id in user_id_array.tolist()]
+
+        ranking = np.zeros((len(user_id_array), cutoff), dtype=np.int32)
+
+        # The cached rankings are copied before adding the new ones, which may evict them
+        hit_mask, hit_ranking = recommendation_cache.get_rankings(cache_key_list, cutoff)
+        ranking[hit_mask] = hit_ranking
+
+        miss_index = np.flatnonzero(~hit_mask)
+
+        if len(miss_index) > 0:
+
+            miss_ranking, miss_ranking_scores = self.recommend_top_n(user_id_array[miss_index], recommendation_cache.max_cutoff,
+                                                                     remove_seen_flag = remove_seen_flag,
+                                                                     remove_top_pop_flag = remove_top_pop_flag,
+                                                                     remove_CustomItems_flag = remove_CustomItems_flag)
+
+            ranking[miss_index] = miss_ranking[:, :cutoff]
+
+            recommendation_cache.put([cache_key_list[user_index] for user_index in miss_index], miss_ranking, miss_ranking_scores)
+
+        return ranking.tolist()
+
+
+
+
+
+
+    def _get_model_dict(self):
+        """
+        :return: dictionary with the attributes of the fitted model, the ones saveModel and saveModelDirectory store
+        """
+        raise NotImplementedError("Recommender: _get_model_dict not implemented")
+
+
+
+    def _set_model_dict(self, data_dict):
+        """
+        Sets the attributes of a loaded model, see _get_model_dict
+        """
+
+        for attrib_name in data_dict.keys():
+             self.__setattr__(attrib_name, data_dict[attrib_name])
+
+        self.clear_recommendation_cache()
 
 
 
@@ -183,6 +655,54 @@ class Recommender(object):
 
 
 
+    def saveModelDirectory(self, folder_path, folder_name = None, hyperparameters = None):
+        """
+        Saves the model as a directory of raw .npy files with a JSON header, see Model_Directory_IO
+        :param hyperparameters:     Dictionary of the fit arguments of the model, stored in the header.
+                                    If None, the ones of the model this was loaded from, if any
+        """
+
+        if folder_name is None:
+            folder_name = self.RECOMMENDER_NAME
+
+        if hyperparameters is None:
+            hyperparameters = getattr(self, "_fit_hyperparameters", None)
+
+        print("{}: Saving model in folder '{}'".format(self.RECOMMENDER_NAME, folder_path + folder_name))
+
+        save_model_directory(folder_path + folder_name, self._get_model_dict(), self.RECOMMENDER_NAME,
+                             hyperparameters = hyperparameters)
+
+        print("{}: Saving complete".format(self.RECOMMENDER_NAME))
+
+
+
+    def loadModelDirectory(self, folder_path, folder_name = None, mmap = True):
+        """
+        Loads a model saved with saveModelDirectory
+        :param mmap:        If True the arrays are read-only memory maps of the files, the processes loading the same
+                                model share its memory. The model must not be trained further
+        """
+
+        if folder_name is None:
+            folder_name = self.RECOMMENDER_NAME
+
+        print("{}: Loading model from folder '{}'".format(self.RECOMMENDER_NAME, folder_path + folder_name))
+
+        data_dict, header_dict = load_model_directory(folder_path + folder_name, mmap = mmap)
+
+        if header_dict["recommender_name"] != self.RECOMMENDER_NAME:
+            raise ValueError("{}: the model in folder '{}' was saved by '{}'".format(self.RECOMMENDER_NAME, folder_path + folder_name,
+                                                                                     header_dict["recommender_name"]))
+
+        self._set_model_dict(data_dict)
+
+        self._fit_hyperparameters = header_dict["hyperparameters"]
+
+        print("{}: Loading complete".format(self.RECOMMENDER_NAME))
+
+
+
 
     def loadModel(self, folder_path, file_name = None):
 
@@ -194,8 +714,7 @@ class Recommender(object):
 
         data_dict = pickle.load(open(folder_path + file_name, "rb"))
 
-        for attrib_name in data_dict.keys():
-             self.__setattr__(attrib_name, data_dict[attrib_name])
+        self._set_model_dict(data_dict)
 
 
         print("{}: Loading complete".format(self.RECOMMENDER_NAME))
@@ -120,6 +120,24 @@ def similarityMatrixTopK(item_weights, forceSparseOutput = True, k=100, verbose
 
 
 
+def get_available_memory_MB():
+    """
+    :return: the memory available for new processes in MB, or None if it cannot be read
+    """
+
+    try:
+        with open("/proc/meminfo", "r") as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith("MemAvailable:"):
+                    return float(line.split()[1]) / 1024
+
+    except (IOError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+
 def areURMequals(URM1, URM2):
 
     if(URM1.shape != URM2.shape):
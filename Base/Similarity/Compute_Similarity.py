@@ -11,6 +11,11 @@ import scipy.sparse as sps
 
 from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
 from Base.Similarity.Compute_Similarity_Euclidean import Compute_Similarity_Euclidean
+from Base.Similarity.Compute_Similarity_Parallel import Compute_Similarity_Parallel
+from Base.Similarity.Compute_Similarity_ANN import Compute_Similarity_ANN
+from Base.Similarity.Compute_Similarity_Auto import select_similarity_implementation
+from Base.Similarity.Compute_Similarity_Out_Of_Core import Compute_Similarity_Out_Of_Core
+from Base.Similarity.Compute_Similarity_Incremental import Compute_Similarity_Incremental
 
 
 from enum import Enum
@@ -36,8 +41,17 @@ class Compute_Similarity:
         :param use_implementation:      "density" will choose the most efficient implementation automatically
                                         "cython" will use the cython implementation, if available. Most efficient for sparse matrix
                                         "python" will use the python implementation. Most efficent for dense matrix
+                                        "parallel" will split the columns among multiple processes, see Compute_Similarity_Parallel
+                                        "ann" will compute an approximate TopK with LSH or MinHash, see Compute_Similarity_ANN
+                                        "auto" will measure the exact implementations on a sample of columns and use the fastest,
+                                        see select_similarity_implementation. The selection is cached for the same data, use
+                                        auto_cache_file_path to store it across runs
+                                        "out_of_core" will keep the data and the partial results on disk, dataMatrix can also be
+                                        the folder created by save_data_matrix_npy, see Compute_Similarity_Out_Of_Core
+                                        "incremental" will keep the state required by update_similarity, see Compute_Similarity_Incremental
         :param similarity:              the type of similarity to use, see SimilarityFunction enum
-        :param args:                    other args required by the specific similarity implementation
+        :param args:                    other args required by the specific similarity implementation,
+                                        n_threads and prune are only used by the cython implementation
         """
 
         self.dense = False
@@ -52,6 +66,21 @@ class Compute_Similarity:
                 args["similarity"] = similarity
 
 
+            if use_implementation == "auto":
+
+                # The arguments of the selection are not passed to the selected implementation
+                selection_args = {arg: args.pop(arg) for arg in ["n_sample_columns", "n_sample_ranges"] if arg in args}
+                auto_cache_file_path = args.pop("auto_cache_file_path", None)
+
+                use_implementation, selected_args = select_similarity_implementation(dataMatrix, cache_file_path = auto_cache_file_path,
+                                                                                     **selection_args, **args)
+                args.update(selected_args)
+
+                if use_implementation != "parallel":
+                    args.pop("n_workers", None)
+                    args.pop("n_blocks_per_worker", None)
+
+
             if use_implementation == "density":
 
                 if isinstance(dataMatrix, np.ndarray):
@@ -88,12 +117,34 @@ class Compute_Similarity:
 
                 except ImportError:
                     print("Unable to load Cython Compute_Similarity, reverting to Python")
+                    args.pop("n_threads", None)
+                    args.pop("prune", None)
                     self.compute_similarity_object = Compute_Similarity_Python(dataMatrix, **args)
 
 
             elif use_implementation == "python":
+                args.pop("n_threads", None)
+                args.pop("prune", None)
                 self.compute_similarity_object = Compute_Similarity_Python(dataMatrix, **args)
 
+            elif use_implementation == "parallel":
+                self.compute_similarity_object = Compute_Similarity_Parallel(dataMatrix, **args)
+
+            elif use_implementation == "out_of_core":
+                args.pop("n_threads", None)
+                args.pop("prune", None)
+                self.compute_similarity_object = Compute_Similarity_Out_Of_Core(dataMatrix, **args)
+
+            elif use_implementation == "ann":
+                args.pop("n_threads", None)
+                args.pop("prune", None)
+                self.compute_similarity_object = Compute_Similarity_ANN(dataMatrix, **args)
+
+            elif use_implementation == "incremental":
+                args.pop("n_threads", None)
+                args.pop("prune", None)
+                self.compute_similarity_object = Compute_Similarity_Incremental(dataMatrix, **args)
+
             else:
 
                 raise  ValueError("Compute_Similarity: value for argument 'use_implementation' not recognized")
@@ -107,6 +158,19 @@ class Compute_Similarity:
         return self.compute_similarity_object.compute_similarity(**args)
 
 
+
+    def update_similarity(self, delta_matrix, changed_rows = None):
+        """
+        Updates the similarity after the rows changed_rows of dataMatrix are replaced by the ones of delta_matrix,
+        only available with use_implementation = "incremental", see Compute_Similarity_Incremental
+        """
+
+        if not isinstance(self.compute_similarity_object, Compute_Similarity_Incremental):
+            raise ValueError("Compute_Similarity: update_similarity requires use_implementation = 'incremental'")
+
+        return self.compute_similarity_object.update_similarity(delta_matrix, changed_rows = changed_rows)
+
+
 #
 #
 #
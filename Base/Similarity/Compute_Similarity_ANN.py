@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import time, sys
+import scipy.sparse as sps
+from Base.Recommender_utils import check_matrix
+from Base.Similarity.Compute_Similarity_Bias_Parametric import similarity_data_top_k
+
+
+
+class Compute_Similarity_ANN:
+
+
+    LSH_SIMILARITIES = ["cosine", "asymmetric"]
+    MINHASH_SIMILARITIES = ["jaccard", "tanimoto", "dice", "tversky"]
+
+
+    def __init__(self, dataMatrix, topK=100, shrink = 0, normalize = True,
+                 asymmetric_alpha = 0.5, tversky_alpha = 1.0, tversky_beta = 1.0,
+                 similarity = "cosine", row_weights = None,
+                 recall_target = 0.9, target_similarity = 0.5, bucket_size = 100,
+                 n_hashes_per_table = None, n_tables = None, random_seed = None):
+        """
+        Computes an approximate TopK similarity on the columns of dataMatrix
+        If it is computed on URM=|users|x|items|, pass the URM as is.
+        If it is computed on ICM=|items|x|features|, pass the ICM transposed.
+
+        The columns are hashed in n_tables tables, each one using n_hashes_per_table hash functions:
+        random hyperplanes (LSH) for "cosine" and "asymmetric", MinHash for "jaccard", "dice" and "tversky".
+        Only the columns falling in the same bucket of at least one table are candidates, their similarity is
+        computed exactly and the TopK of each column is selected among its candidates.
+        The cost of each table grows with the co-occurrences within the buckets rather than among all columns.
+        The output has the same format of the exact implementations.
+
+        :param dataMatrix:
+        :param topK:
+        :param shrink:
+        :param normalize:           If True divide the dot product by the product of the norms
+        :param row_weights:         Multiply the values in each row by a specified value. Array
+        :param asymmetric_alpha     Coefficient alpha for the asymmetric cosine
+        :param similarity:          "cosine", "asymmetric", "jaccard", "tanimoto", "dice" or "tversky"
+        :param recall_target:       Probability that a pair of columns having target_similarity becomes a candidate,
+                                    used to select n_tables
+        :param target_similarity:   Similarity of the hash family, cosine for LSH and Jaccard for MinHash,
+                                    for which recall_target is ensured. Pairs more similar are found with higher probability
+        :param bucket_size:         Desired average number of columns in a bucket, used to select n_hashes_per_table.
+                                    Larger buckets require fewer tables but more exact similarities for each of them
+        :param n_hashes_per_table:  If not None, overrides the value selected with bucket_size
+        :param n_tables:            If not None, overrides the value selected with recall_target
+        :param random_seed:
+        """
+
+        super(Compute_Similarity_ANN, self).__init__()
+
+        if similarity not in self.LSH_SIMILARITIES + self.MINHASH_SIMILARITIES:
+            raise ValueError("Compute_Similarity_ANN: value for paramether 'similarity' not recognized."
+                             " Allowed values are: {}."
+                             " Passed value was '{}'".format(self.LSH_SIMILARITIES + self.MINHASH_SIMILARITIES, similarity))
+
+        if not 0.0 < recall_target < 1.0 or not 0.0 < target_similarity < 1.0:
+            raise ValueError("Compute_Similarity_ANN: recall_target and target_similarity must be in (0, 1)."
+                             " Passed values were {} and {}".format(recall_target, target_similarity))
+
+        self.n_rows, self.n_columns = dataMatrix.shape
+        self.TopK = min(topK, self.n_columns)
+
+        if self.TopK == 0:
+            raise ValueError("Compute_Similarity_ANN: topK must be a positive integer, the dense similarity cannot be approximated")
+
+        self.shrink = shrink
+        self.normalize = normalize
+        self.asymmetric_alpha = asymmetric_alpha
+        self.tversky_alpha = tversky_alpha
+        self.tversky_beta = tversky_beta
+        self.similarity = similarity
+
+        self.recall_target = recall_target
+        self.target_similarity = target_similarity
+        self.bucket_size = bucket_size
+        self.n_hashes_per_table = n_hashes_per_table
+        self.n_tables = n_tables
+        self.random_seed = random_seed
+
+        self.use_minhash = similarity in self.MINHASH_SIMILARITIES
+
+        self.dataMatrix = check_matrix(dataMatrix, 'csc', dtype=np.float64).copy()
+        self.dataMatrix.sort_indices()
+
+        # Jaccard, dice and tversky are defined on binary interactions and have a specific kind of normalization
+        if self.use_minhash:
+            self.dataMatrix.data = np.ones_like(self.dataMatrix.data)
+            self.normalize = False
+
+        if row_weights is not None:
+
+            if dataMatrix.shape[0] != len(row_weights):
+                raise ValueError("Compute_Similarity_ANN: provided row_weights and dataMatrix have different number of rows."
+                                 "Row_weights has {} rows, dataMatrix has {}.".format(len(row_weights), dataMatrix.shape[0]))
+
+            self.dataMatrix_weighted = check_matrix(sps.diags(np.array(row_weights, dtype=np.float64)).dot(self.dataMatrix), 'csc')
+
+        else:
+            self.dataMatrix_weighted = self.dataMatrix
+
+
+        # Compute sum of squared values to be used in normalization, Tanimoto does not require the square root
+        self.sumOfSquared = np.array(self.dataMatrix.power(2).sum(axis=0), dtype=np.float64).ravel()
+
+        if not self.use_minhash:
+            self.sumOfSquared = np.sqrt(self.sumOfSquared)
+
+        if similarity == "asymmetric":
+            self.sumOfSquared_to_1_minus_alpha = np.power(self.sumOfSquared, 2 * (1 - asymmetric_alpha))
+            self.sumOfSquared_to_alpha = np.power(self.sumOfSquared, 2 * asymmetric_alpha)
+
+
+
+
+    def _get_signature(self, dataMatrix, n_hashes, random_state):
+        """
+        Computes n_hashes hash values for each column of dataMatrix, which must not contain empty columns
+        :return: array of shape (n_columns, n_hashes)
+        """
+
+        if self.use_minhash:
+            # The MinHash of a column is the minimum of a random permutation of the rows among its nonzeros,
+            # the probability two columns share it is their Jaccard similarity
+            signature = np.zeros((dataMatrix.shape[1], n_hashes), dtype=np.float64)
+
+            for hash_index in range(n_hashes):
+                row_hash = random_state.random_sample(self.n_rows)
+                signature[:, hash_index] = np.minimum.reduceat(row_hash[dataMatrix.indices], dataMatrix.indptr[:-1])
+
+        else:
+            # The sign of a random projection, the probability two columns share it is 1 - angle/pi
+            projection = dataMatrix.T.dot(random_state.standard_normal((self.n_rows, n_hashes)))
+            signature = projection > 0
+
+        return signature
+
+
+
+    def _get_bucket_ids(self, signature):
+
+        _, bucket_ids = np.unique(signature, axis=0, return_inverse=True)
+
+        return bucket_ids.ravel()
+
+
+
+    def _get_collision_probability(self, similarity):
+        """
+        Probability that a pair of columns with the given similarity of the hash family has the same hash value
+        """
+
+        if self.use_minhash:
+            return similarity
+
+        return 1 - np.arccos(similarity)/np.pi
+
+
+
+    def _select_parameters(self, dataMatrix, random_state):
+        """
+        Selects the number of hashes per table so that the buckets contain on average bucket_size columns and the number
+        of tables so that a pair having target_similarity is a candidate with probability recall_target.
+        The probability that two random columns collide is estimated on the data, since it depends on its sparsity
+        """
+
+        n_columns = dataMatrix.shape[1]
+
+        n_hashes_per_table = self.n_hashes_per_table
+
+        if n_hashes_per_table is None:
+
+            n_samples = 8
+            collision_probability = 0.0
+
+            signature = self._get_signature(dataMatrix, n_samples, random_state)
+
+            for hash_index in range(n_samples):
+                bucket_sizes = np.bincount(self._get_bucket_ids(signature[:, hash_index:hash_index+1])).astype(np.float64)
+                collision_probability += np.sum(bucket_sizes*(bucket_sizes-1)) / max(n_columns*(n_columns-1), 1) / n_samples
+
+            if 0.0 < collision_probability < 1.0 and self.bucket_size < n_columns:
+                n_hashes_per_table = int(np.ceil(np.log(self.bucket_size/n_columns) / np.log(collision_probability)))
+            else:
+                n_hashes_per_table = 1
+
+            n_hashes_per_table = min(max(n_hashes_per_table, 1), 64)
+
+
+        n_tables = self.n_tables
+
+        if n_tables is None:
+            collision_probability_table = self._get_collision_probability(self.target_similarity)**n_hashes_per_table
+            n_tables = int(np.ceil(np.log(1 - self.recall_target) / np.log1p(-collision_probability_table)))
+            n_tables = max(n_tables, 1)
+
+        return n_hashes_per_table, n_tables
+
+
+
+
+    def _apply_denominator(self, data, neighbour_ids, target_ids):
+        """
+        Apply normalization and shrinkage as in Compute_Similarity_Python, ensure denominator != 0
+        data contains the dot products of the pairs (neighbour_ids, target_ids)
+        """
+
+        if self.normalize:
+
+            if self.similarity == "asymmetric":
+                denominator = self.sumOfSquared_to_1_minus_alpha[neighbour_ids] * self.sumOfSquared_to_alpha[target_ids] + self.shrink + 1e-6
+            else:
+                denominator = self.sumOfSquared[neighbour_ids] * self.sumOfSquared[target_ids] + self.shrink + 1e-6
+
+            return data / denominator
+
+        elif self.similarity in ["jaccard", "tanimoto"]:
+            denominator = self.sumOfSquared[target_ids] + self.sumOfSquared[neighbour_ids] - data + self.shrink + 1e-6
+            return data / denominator
+
+        elif self.similarity == "dice":
+            denominator = self.sumOfSquared[target_ids] + self.sumOfSquared[neighbour_ids] + self.shrink + 1e-6
+            return data / denominator
+
+        elif self.similarity == "tversky":
+            denominator = data + \
+                          (self.sumOfSquared[target_ids] - data)*self.tversky_alpha + \
+                          (self.sumOfSquared[neighbour_ids] - data)*self.tversky_beta + self.shrink + 1e-6
+            return data / denominator
+
+        elif self.shrink != 0:
+            return data/self.shrink
+
+        return data
+
+
+
+
+    def _get_bucket_dot_products(self, bucket_ids, nonempty_ids, target_mask):
+        """
+        Computes the dot products of all the pairs of columns sharing a bucket with a single sparse product.
+        Every row is split in one row for each bucket its nonzeros belong to, therefore two columns have a common row
+        only if they are in the same bucket.
+        :return: values, neighbour ids and target ids of the pairs having a nonzero dot product, diagonal excluded
+        """
+
+        dataMatrix = self.dataMatrix[:, nonempty_ids]
+        dataMatrix_weighted = self.dataMatrix_weighted[:, nonempty_ids]
+
+        col_ids = np.repeat(np.arange(len(nonempty_ids), dtype=np.int64), np.diff(dataMatrix.indptr))
+
+        _, bucket_row_ids = np.unique(bucket_ids[col_ids]*self.n_rows + dataMatrix.indices, return_inverse=True)
+        bucket_row_ids = bucket_row_ids.ravel()
+
+        n_bucket_rows = bucket_row_ids.max() + 1 if len(bucket_row_ids) > 0 else 0
+
+        dataMatrix_bucket = sps.csc_matrix((dataMatrix.data, (bucket_row_ids, col_ids)), shape=(n_bucket_rows, len(nonempty_ids)))
+        dataMatrix_weighted_bucket = sps.csc_matrix((dataMatrix_weighted.data, (bucket_row_ids, col_ids)), shape=(n_bucket_rows, len(nonempty_ids)))
+
+        target_positions = np.flatnonzero(target_mask)
+
+        dot_products = dataMatrix_weighted_bucket.T.dot(dataMatrix_bucket[:, target_positions]).tocoo()
+
+        neighbour_ids = nonempty_ids[dot_products.row]
+        target_ids = nonempty_ids[target_positions[dot_products.col]]
+
+        not_diagonal_mask = neighbour_ids != target_ids
+
+        return dot_products.data[not_diagonal_mask], neighbour_ids[not_diagonal_mask], target_ids[not_diagonal_mask]
+
+
+
+
+    def _select_top_k(self, values, rows, cols):
+        """
+        Selects the TopK of each column among the given elements, keeping only one copy of the pairs found more than once
+        """
+
+        pair_keys = cols.astype(np.int64)*self.n_columns + rows
+
+        sorted_idx = np.argsort(pair_keys)
+        values, rows, cols, pair_keys = values[sorted_idx], rows[sorted_idx], cols[sorted_idx], pair_keys[sorted_idx]
+
+        unique_mask = np.ones(len(values), dtype=bool)
+        unique_mask[1:] = pair_keys[1:] != pair_keys[:-1]
+        values, rows, cols = values[unique_mask], rows[unique_mask], cols[unique_mask]
+
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=self.n_columns))))
+
+        return similarity_data_top_k(values, rows, indptr, self.n_columns, self.TopK)
+
+
+
+
+    def compute_similarity(self, start_col=None, end_col=None):
+        """
+        Compute the similarity for the given dataset
+        :param self:
+        :param start_col: column to begin with
+        :param end_col: column to stop before, end_col is excluded
+        :return:
+        """
+
+        start_time = time.time()
+        start_time_print_batch = start_time
+
+        start_col_local = 0
+        end_col_local = self.n_columns
+
+        if start_col is not None and start_col>0 and start_col<self.n_columns:
+            start_col_local = start_col
+
+        if end_col is not None and end_col>start_col_local and end_col<self.n_columns:
+            end_col_local = end_col
+
+
+        random_state = np.random.RandomState(self.random_seed)
+
+        # Empty columns have no similarity and would all fall in the same bucket
+        nonempty_ids = np.flatnonzero(np.diff(self.dataMatrix.indptr) > 0).astype(np.int32)
+        dataMatrix_nonempty = self.dataMatrix[:, nonempty_ids]
+
+        target_mask = np.logical_and(nonempty_ids >= start_col_local, nonempty_ids < end_col_local)
+
+        n_hashes_per_table, n_tables = self._select_parameters(dataMatrix_nonempty, random_state)
+
+        collision_probability_table = self._get_collision_probability(self.target_similarity)**n_hashes_per_table
+
+        print("Compute_Similarity_ANN: using {} with {} hashes per table and {} tables, "
+              "expected recall {:.2f} for {} similarity {:.2f}".format(
+            "MinHash" if self.use_minhash else "LSH", n_hashes_per_table, n_tables,
+            1 - (1 - collision_probability_table)**n_tables,
+            "Jaccard" if self.use_minhash else "cosine", self.target_similarity))
+
+        sys.stdout.flush()
+
+
+        values = np.zeros(0, dtype=np.float64)
+        rows = np.zeros(0, dtype=np.int32)
+        cols = np.zeros(0, dtype=np.int32)
+
+        values_list, rows_list, cols_list = [], [], []
+        n_buffered_pairs = 0
+        n_candidate_pairs = 0
+
+        for table_index in range(n_tables):
+
+            bucket_ids = self._get_bucket_ids(self._get_signature(dataMatrix_nonempty, n_hashes_per_table, random_state))
+
+            table_values, table_rows, table_cols = self._get_bucket_dot_products(bucket_ids, nonempty_ids, target_mask)
+            table_values = self._apply_denominator(table_values, table_rows, table_cols)
+
+            n_candidate_pairs += len(table_values)
+
+            values_list.append(table_values)
+            rows_list.append(table_rows)
+            cols_list.append(table_cols)
+            n_buffered_pairs += len(table_values)
+
+            # Merge with the TopK of the previous tables once the candidates are as many as the current TopK,
+            # so that the cost of the selection is amortized over multiple tables
+            if n_buffered_pairs >= max(len(values), self.TopK*len(nonempty_ids)) or table_index == n_tables-1:
+                values, rows, cols = self._select_top_k(np.concatenate([values] + values_list),
+                                                        np.concatenate([rows] + rows_list),
+                                                        np.concatenate([cols] + cols_list))
+                values_list, rows_list, cols_list = [], [], []
+                n_buffered_pairs = 0
+
+            if time.time() - start_time_print_batch >= 30 or table_index == n_tables-1:
+
+                print("Similarity table {} ( {:2.0f} % ), {:.2f} candidate pairs per column, elapsed time {:.2f} min".format(
+                    table_index+1, (table_index+1) / n_tables * 100, n_candidate_pairs / max(np.sum(target_mask), 1),
+                    (time.time() - start_time)/ 60))
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+
+                start_time_print_batch = time.time()
+
+
+        W_sparse = sps.csr_matrix((values, (rows, cols)),
+                                  shape=(self.n_columns, self.n_columns),
+                                  dtype=np.float32)
+
+        return W_sparse
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import time, sys, os
+import json, hashlib
+import contextlib
+import multiprocessing
+import scipy.sparse as sps
+
+from Base.Recommender_utils import check_matrix
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+from Base.Similarity.Compute_Similarity_Parallel import Compute_Similarity_Parallel
+
+
+
+# Selected implementation for each dataset fingerprint and similarity setting, shared by all the objects of the process
+_selected_implementation_cache = {}
+
+
+
+def get_data_fingerprint(dataMatrix):
+    """
+    Returns a digest of the shape, structure and values of dataMatrix, equal matrices in the same format have the same fingerprint
+    :param dataMatrix:
+    :return: string
+    """
+
+    hash_object = hashlib.sha1()
+    hash_object.update(str((type(dataMatrix).__name__, dataMatrix.shape)).encode("utf-8"))
+
+    if isinstance(dataMatrix, np.ndarray):
+        array_list = [dataMatrix]
+
+    elif isinstance(dataMatrix, (sps.csr_matrix, sps.csc_matrix)):
+        array_list = [dataMatrix.indptr, dataMatrix.indices, dataMatrix.data]
+
+    else:
+        dataMatrix = sps.coo_matrix(dataMatrix)
+        array_list = [dataMatrix.row, dataMatrix.col, dataMatrix.data]
+
+    for array in array_list:
+        hash_object.update(np.ascontiguousarray(array).view(np.uint8))
+
+    return hash_object.hexdigest()
+
+
+
+def _get_cache_key(data_fingerprint, args):
+
+    # Only the arguments affecting the computational cost are part of the key
+    cost_args = ["similarity", "topK", "normalize", "n_threads", "n_workers"]
+
+    return data_fingerprint + "_" + "_".join("{}={}".format(arg, args.get(arg, None)) for arg in cost_args)
+
+
+
+def _load_cache_file(cache_file_path):
+
+    if cache_file_path is None or not os.path.isfile(cache_file_path):
+        return {}
+
+    with open(cache_file_path, "r") as cache_file:
+        return json.load(cache_file)
+
+
+
+def _save_cache_file(cache_file_path, cache_key, selected_implementation):
+
+    if cache_file_path is None:
+        return
+
+    file_cache = _load_cache_file(cache_file_path)
+    file_cache[cache_key] = selected_implementation
+
+    with open(cache_file_path, "w") as cache_file:
+        json.dump(file_cache, cache_file, indent=4)
+
+
+
+
+def _get_sample_column_ranges(n_columns, n_sample_columns, n_sample_ranges):
+    """
+    Returns n_sample_ranges contiguous ranges evenly spread across the columns, n_sample_columns in total
+    """
+
+    range_size = max(n_sample_columns // n_sample_ranges, 1)
+    range_starts = np.linspace(0, n_columns - range_size, n_sample_ranges).astype(np.int64)
+
+    return [(start, start + range_size) for start in np.unique(range_starts)]
+
+
+
+def _get_work_per_column(dataMatrix_csc):
+    """
+    Number of multiply-adds required by the sparse implementations for each column, see get_balanced_column_ranges
+    """
+
+    nnz_per_row = np.bincount(dataMatrix_csc.indices, minlength=dataMatrix_csc.shape[0])
+    col_ids = np.repeat(np.arange(dataMatrix_csc.shape[1]), np.diff(dataMatrix_csc.indptr))
+
+    return np.bincount(col_ids, weights=nnz_per_row[dataMatrix_csc.indices], minlength=dataMatrix_csc.shape[1]) + 1
+
+
+
+def _build_similarity_object(implementation, dataMatrix, args):
+
+    args = {key: value for key, value in args.items() if key not in ["prune", "n_workers", "n_blocks_per_worker"]}
+
+    if implementation == "python":
+        args.pop("n_threads", None)
+        return Compute_Similarity_Python(dataMatrix, **args)
+
+    from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+
+    if implementation == "cython_pruned":
+        return Compute_Similarity_Cython(dataMatrix, prune = True, **args)
+
+    return Compute_Similarity_Cython(dataMatrix, **args)
+
+
+
+def _time_sample(implementation, dataMatrix, sample_ranges, args):
+    """
+    Measures the time required to build the similarity object and to compute the sample ranges
+    :return: build time and compute time in seconds
+    """
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+
+        start_time = time.time()
+        similarity_object = _build_similarity_object(implementation, dataMatrix, args)
+        build_time = time.time() - start_time
+
+        start_time = time.time()
+
+        for start_col, end_col in sample_ranges:
+            similarity_object.compute_similarity(start_col=start_col, end_col=end_col)
+
+        compute_time = time.time() - start_time
+
+    return build_time, compute_time
+
+
+
+def _get_candidate_implementations(dataMatrix, args):
+
+    candidate_list = ["python"]
+
+    try:
+        from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+    except ImportError:
+        return candidate_list
+
+    candidate_list.append("cython")
+
+    similarity = args.get("similarity", "cosine")
+    row_weights = args.get("row_weights", None)
+
+    nonnegative_data = dataMatrix.min() >= 0 if isinstance(dataMatrix, np.ndarray) else dataMatrix.data.min(initial=0.0) >= 0
+    nonnegative_row_weights = row_weights is None or np.min(row_weights) >= 0
+
+    if similarity in ["cosine", "asymmetric"] and args.get("normalize", True) and nonnegative_data and nonnegative_row_weights:
+        candidate_list.append("cython_pruned")
+
+    if multiprocessing.cpu_count() > 1:
+        candidate_list.append("parallel")
+
+    return candidate_list
+
+
+
+
+def select_similarity_implementation(dataMatrix, n_sample_columns = 200, n_sample_ranges = 4, cache_file_path = None, **args):
+    """
+    Selects the fastest implementation for the given data and similarity arguments.
+    Each candidate (Python block-dense, Cython sparse, Cython pruned and the multiprocess one) computes the same
+    few ranges of columns, the time is extrapolated to all the columns and the fastest is selected.
+    The Python cost grows with the number of columns, the sparse ones with the multiply-adds the columns require.
+    The parallel one is estimated from the Cython cost divided among the workers plus its measured startup overhead.
+
+    The selection is cached for the fingerprint of dataMatrix and the arguments affecting the cost, in memory and,
+    if cache_file_path is provided, in a json file shared across runs.
+
+    :param dataMatrix:
+    :param n_sample_columns:    Number of columns computed by each candidate
+    :param n_sample_ranges:     Number of ranges the sampled columns are split in
+    :param cache_file_path:     If not None, json file used to store the selections
+    :param args:                other args of the similarity, see Compute_Similarity
+    :return: the value of use_implementation and the additional args it requires
+    """
+
+    data_fingerprint = get_data_fingerprint(dataMatrix)
+    cache_key = _get_cache_key(data_fingerprint, args)
+
+    if cache_key not in _selected_implementation_cache:
+        file_cache = _load_cache_file(cache_file_path)
+
+        if cache_key in file_cache:
+            _selected_implementation_cache[cache_key] = file_cache[cache_key]
+
+
+    if cache_key in _selected_implementation_cache:
+        selected_implementation = _selected_implementation_cache[cache_key]
+        print("Compute_Similarity: using cached selection '{}' for data fingerprint {}".format(selected_implementation, data_fingerprint[:10]))
+
+    else:
+        selected_implementation = _measure_implementations(dataMatrix, n_sample_columns, n_sample_ranges, args)
+
+        _selected_implementation_cache[cache_key] = selected_implementation
+        _save_cache_file(cache_file_path, cache_key, selected_implementation)
+
+    sys.stdout.flush()
+
+    if selected_implementation == "cython_pruned":
+        return "cython", {"prune": True}
+
+    return selected_implementation, {}
+
+
+
+
+def _measure_implementations(dataMatrix, n_sample_columns, n_sample_ranges, args):
+
+    n_columns = dataMatrix.shape[1]
+    TopK = min(args.get("topK", 100), n_columns)
+
+    candidate_list = _get_candidate_implementations(dataMatrix, args)
+
+    # With few columns or the dense output, sampling would cost as much as the computation itself
+    if n_columns <= 2*n_sample_columns or TopK == 0 or len(candidate_list) == 1:
+
+        dense = isinstance(dataMatrix, np.ndarray) or dataMatrix.nnz/(dataMatrix.shape[0]*dataMatrix.shape[1]) > 0.5
+        selected_implementation = "python" if dense or len(candidate_list) == 1 else "cython"
+
+        print("Compute_Similarity: matrix too small to sample, selected '{}'".format(selected_implementation))
+        return selected_implementation
+
+
+    dataMatrix_csc = check_matrix(sps.csc_matrix(dataMatrix) if isinstance(dataMatrix, np.ndarray) else dataMatrix, 'csc')
+    work_per_column = _get_work_per_column(dataMatrix_csc)
+
+    sample_ranges = _get_sample_column_ranges(n_columns, n_sample_columns, n_sample_ranges)
+    sample_columns = np.concatenate([np.arange(start_col, end_col) for start_col, end_col in sample_ranges])
+
+    column_fraction = len(sample_columns) / n_columns
+    work_fraction = work_per_column[sample_columns].sum() / work_per_column.sum()
+
+    estimated_time = {}
+    measured_time = {}
+
+    for implementation in candidate_list:
+
+        if implementation == "parallel":
+            continue
+
+        build_time, compute_time = _time_sample(implementation, dataMatrix, sample_ranges, args)
+        measured_time[implementation] = compute_time
+
+        sample_fraction = column_fraction if implementation == "python" else work_fraction
+        estimated_time[implementation] = build_time + compute_time / sample_fraction
+
+
+    if "parallel" in candidate_list:
+
+        n_workers = args.get("n_workers", None) or multiprocessing.cpu_count()
+        parallel_args = {key: value for key, value in args.items() if key != "prune"}
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start_time = time.time()
+            Compute_Similarity_Parallel(dataMatrix, **parallel_args).compute_similarity(start_col=sample_ranges[0][0], end_col=sample_ranges[0][1])
+            parallel_time = time.time() - start_time
+
+        # The startup overhead is what is left after removing the share of the computation of each worker
+        first_range_work_fraction = work_per_column[sample_ranges[0][0]:sample_ranges[0][1]].sum() / work_per_column[sample_columns].sum()
+        cython_first_range_time = measured_time["cython"] * first_range_work_fraction
+
+        startup_time = max(parallel_time - cython_first_range_time / n_workers, 0.0)
+        estimated_time["parallel"] = startup_time + estimated_time["cython"] / n_workers
+
+
+    selected_implementation = min(estimated_time, key=estimated_time.get)
+
+    print("Compute_Similarity: estimated time {}, selected '{}'".format(
+        ", ".join("{} {:.2f} sec".format(implementation, implementation_time) for implementation, implementation_time in estimated_time.items()),
+        selected_implementation))
+
+    return selected_implementation
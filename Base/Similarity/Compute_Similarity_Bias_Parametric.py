@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import time, sys
+import scipy.sparse as sps
+from Base.Recommender_utils import check_matrix
+
+
+
+def _align_to_pattern(pattern_csc, sparse_matrix):
+    """
+    Returns the data of sparse_matrix aligned to the structure of pattern_csc.
+    The off-diagonal nonzero structure of sparse_matrix must be a subset of the one of pattern_csc, in canonical CSC format
+    :param pattern_csc:
+    :param sparse_matrix:
+    :return:
+    """
+
+    # The diagonal is not part of the pattern, as in the other similarity implementations
+    sparse_matrix = sps.csc_matrix(sparse_matrix, dtype=np.float64)
+    sparse_matrix = sps.csc_matrix(sparse_matrix - sps.diags(sparse_matrix.diagonal()))
+    sparse_matrix.eliminate_zeros()
+    sparse_matrix.sum_duplicates()
+
+    n_rows = pattern_csc.shape[0]
+
+    pattern_cols = np.repeat(np.arange(pattern_csc.shape[1], dtype=np.int64), np.diff(pattern_csc.indptr))
+    pattern_keys = pattern_cols*n_rows + pattern_csc.indices
+
+    matrix_cols = np.repeat(np.arange(sparse_matrix.shape[1], dtype=np.int64), np.diff(sparse_matrix.indptr))
+    matrix_keys = matrix_cols*n_rows + sparse_matrix.indices
+
+    aligned_data = np.zeros(len(pattern_keys), dtype=np.float64)
+    aligned_data[np.searchsorted(pattern_keys, matrix_keys)] = sparse_matrix.data
+
+    return aligned_data
+
+
+
+def similarity_data_top_k(data, indices, indptr, n_columns, TopK):
+    """
+    Selects, for every column of a CSC structure, the TopK highest values, discarding zeros.
+    The candidates of each column are only the elements stored in that column
+    Columns having more than TopK elements are grouped by their length rounded to a power of two, each group is padded
+    to a dense block and its TopK are selected with a single partition, which requires linear time.
+    The indices must be sorted within each column, as in canonical CSC format. Among elements with the same value
+    the one with the lower index is selected, as in Compute_Similarity_Cython.
+    :param data:
+    :param indices:
+    :param indptr:
+    :param n_columns:
+    :param TopK:
+    :return: values, rows, cols of the selected elements, sorted by column
+    """
+
+    indptr = np.asarray(indptr, dtype=np.int64)
+    col_ids = np.repeat(np.arange(n_columns, dtype=np.int32), np.diff(indptr))
+    column_length = np.diff(indptr)
+
+    # Columns with at most TopK elements are kept entirely
+    selected_mask = column_length[col_ids] <= TopK
+    selected_position_list = [np.flatnonzero(selected_mask)]
+
+    long_columns = np.flatnonzero(column_length > TopK)
+    length_group = np.ceil(np.log2(column_length[long_columns])).astype(np.int64)
+
+    for group in np.unique(length_group):
+
+        group_columns = long_columns[length_group == group]
+        group_length = column_length[group_columns]
+
+        padded_position = indptr[group_columns][:,None] + np.arange(group_length.max())[None,:]
+        padding_mask = np.arange(group_length.max())[None,:] >= group_length[:,None]
+        padded_position[padding_mask] = 0
+
+        padded_data = data[padded_position]
+        padded_data[padding_mask] = -np.inf
+
+        # The partition only gives the TopK-th value, the elements equal to it are then selected in order of index
+        top_k_value = -np.partition(-padded_data, TopK-1, axis=1)[:, TopK-1:TopK]
+
+        above_mask = padded_data > top_k_value
+        tie_mask = padded_data == top_k_value
+        n_ties_selected = TopK - above_mask.sum(axis=1, keepdims=True)
+
+        selected_padded_mask = above_mask | (tie_mask & (np.cumsum(tie_mask, axis=1) <= n_ties_selected))
+        selected_position_list.append(padded_position[selected_padded_mask])
+
+    selected_position = np.concatenate(selected_position_list)
+    selected_position = selected_position[np.argsort(col_ids[selected_position], kind="stable")]
+    selected_position = selected_position[data[selected_position] != 0.0]
+
+    return data[selected_position], indices[selected_position], col_ids[selected_position]
+
+
+
+
+class Compute_Similarity_Bias_Parametric:
+
+
+    SUPPORTED_SIMILARITIES = ["cosine", "asymmetric"]
+
+
+    def __init__(self, dataMatrix, row_weights = None):
+        """
+        Precomputes the terms needed to compute the similarity on the columns of dataMatrix after a bias has been added
+        to all its nonzero values, for any value of the bias.
+        If it is computed on URM=|users|x|items|, pass the URM as is.
+        If it is computed on ICM=|items|x|features|, pass the ICM transposed.
+
+        Being P the binary pattern of X and W the diagonal of the row weights, the biased dot product is a polynomial in the bias:
+            (X + b*P)^T W (X + b*P) = X^T W X + b*(X^T W P + P^T W X) + b^2 * P^T W P
+        and the same holds for the sum of squared values of each column:
+            sum((x + b)^2) = sum(x^2) + 2*b*sum(x) + b^2 * nnz(x)
+
+        The three products are computed once and share the same sparse structure, the similarity for a given bias
+        then only requires a linear pass on their data and the TopK selection.
+
+        :param dataMatrix:
+        :param row_weights:         Multiply the values in each row by a specified value. Array
+        """
+
+        super(Compute_Similarity_Bias_Parametric, self).__init__()
+
+        start_time = time.time()
+
+        self.n_rows, self.n_columns = dataMatrix.shape
+
+        dataMatrix = check_matrix(dataMatrix, 'csc', dtype=np.float64)
+
+        # The bias is added to every stored value, including explicit zeros
+        patternMatrix = dataMatrix.copy()
+        patternMatrix.data = np.ones_like(patternMatrix.data)
+
+        if row_weights is not None:
+
+            if dataMatrix.shape[0] != len(row_weights):
+                raise ValueError("Compute_Similarity_Bias_Parametric: provided row_weights and dataMatrix have different number of rows."
+                                 "Row_weights has {} rows, dataMatrix has {}.".format(len(row_weights), dataMatrix.shape[0]))
+
+            row_weights_diag = sps.diags(np.array(row_weights, dtype=np.float64))
+
+        else:
+            row_weights_diag = sps.identity(self.n_rows, dtype=np.float64)
+
+        # Norms are not affected by the row weights, as in the other similarity implementations
+        self.sum_of_squared = np.array(dataMatrix.power(2).sum(axis=0), dtype=np.float64).ravel()
+        self.sum_of_values = np.array(dataMatrix.sum(axis=0), dtype=np.float64).ravel()
+        self.n_nonzero = np.diff(dataMatrix.indptr).astype(np.float64)
+
+        dataMatrix_weighted = check_matrix(row_weights_diag.dot(dataMatrix), 'csc', dtype=np.float64)
+        patternMatrix_weighted = check_matrix(row_weights_diag.dot(patternMatrix), 'csc', dtype=np.float64)
+
+        X_W_X = dataMatrix.T.dot(dataMatrix_weighted)
+        X_W_P = dataMatrix.T.dot(patternMatrix_weighted)
+        X_W_P_symmetric = X_W_P + X_W_P.T
+        P_W_P = patternMatrix.T.dot(patternMatrix_weighted)
+
+        # The union of the three structures is used as the common one, abs ensures no cancellation occurs
+        pattern = abs(X_W_X) + abs(X_W_P_symmetric) + abs(P_W_P)
+        pattern = sps.csc_matrix(pattern - sps.diags(pattern.diagonal()))
+        pattern.eliminate_zeros()
+        pattern.sort_indices()
+
+        self.indptr = pattern.indptr.copy()
+        self.indices = pattern.indices.copy()
+
+        self.dot_constant = _align_to_pattern(pattern, X_W_X)
+        self.dot_linear = _align_to_pattern(pattern, X_W_P_symmetric)
+        self.dot_quadratic = _align_to_pattern(pattern, P_W_P)
+
+        print("Compute_Similarity_Bias_Parametric: precomputed {} co-occurring pairs in {:.2f} sec".format(
+            len(self.indices), time.time() - start_time))
+
+        sys.stdout.flush()
+
+
+
+
+    def _get_biased_sum_of_squared(self, ICM_bias):
+        return self.sum_of_squared + 2*ICM_bias*self.sum_of_values + ICM_bias**2*self.n_nonzero
+
+
+    def compute_similarity(self, ICM_bias = 0.0, topK = 100, shrink = 0, normalize = True,
+                           similarity = "cosine", asymmetric_alpha = 0.5):
+        """
+        Compute the similarity for the given bias value
+        :param ICM_bias:            value added to all nonzero values of dataMatrix
+        :param topK:
+        :param shrink:
+        :param normalize:           If True divide the dot product by the product of the norms
+        :param similarity:  "cosine"        computes Cosine similarity
+                            "asymmetric"    computes Asymmetric Cosine
+        :param asymmetric_alpha     Coefficient alpha for the asymmetric cosine
+        :return:
+        """
+
+        if similarity not in self.SUPPORTED_SIMILARITIES:
+            raise ValueError("Compute_Similarity_Bias_Parametric: value for paramether 'similarity' not recognized."
+                             " Allowed values are: {}."
+                             " Passed value was '{}'".format(self.SUPPORTED_SIMILARITIES, similarity))
+
+        if ICM_bias is None:
+            ICM_bias = 0.0
+
+        TopK = min(topK, self.n_columns)
+
+        data = self.dot_constant + ICM_bias*self.dot_linear + ICM_bias**2*self.dot_quadratic
+
+        col_ids = np.repeat(np.arange(self.n_columns, dtype=np.int32), np.diff(self.indptr))
+
+        # Apply normalization and shrinkage, ensure denominator != 0
+        if normalize:
+
+            sumOfSquared = np.sqrt(self._get_biased_sum_of_squared(ICM_bias))
+
+            if similarity == "asymmetric":
+                sumOfSquared_to_1_minus_alpha = np.power(sumOfSquared, 2 * (1 - asymmetric_alpha))
+                sumOfSquared_to_alpha = np.power(sumOfSquared, 2 * asymmetric_alpha)
+
+                denominator = sumOfSquared_to_alpha[col_ids] * sumOfSquared_to_1_minus_alpha[self.indices] + shrink + 1e-6
+            else:
+                denominator = sumOfSquared[col_ids] * sumOfSquared[self.indices] + shrink + 1e-6
+
+            data = data / denominator
+
+        elif shrink != 0:
+            data = data / shrink
+
+
+        if TopK == 0:
+            W_sparse = sps.csc_matrix((data, self.indices, self.indptr), shape=(self.n_columns, self.n_columns))
+            return W_sparse.toarray()
+
+
+        values, rows, cols = similarity_data_top_k(data, self.indices, self.indptr, self.n_columns, TopK)
+
+        W_sparse = sps.csr_matrix((values, (rows, cols)),
+                                  shape=(self.n_columns, self.n_columns),
+                                  dtype=np.float32)
+
+        return W_sparse
+
+
+
+
+    def compute_similarity_bias_list(self, ICM_bias_list, **args):
+        """
+        Compute the similarity for each of the bias values in ICM_bias_list
+        :param ICM_bias_list:
+        :param args:                other args accepted by compute_similarity
+        :return: list of W_sparse, one for each bias value
+        """
+
+        W_sparse_list = []
+
+        start_time = time.time()
+
+        for ICM_bias in ICM_bias_list:
+            W_sparse_list.append(self.compute_similarity(ICM_bias = ICM_bias, **args))
+
+        print("Compute_Similarity_Bias_Parametric: computed {} bias values in {:.2f} sec".format(
+            len(ICM_bias_list), time.time() - start_time))
+
+        return W_sparse_list
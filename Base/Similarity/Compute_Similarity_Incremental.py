@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import time, sys
+import scipy.sparse as sps
+from Base.Recommender_utils import check_matrix
+
+
+
+class Compute_Similarity_Incremental:
+
+
+    SUPPORTED_SIMILARITIES = ["cosine", "jaccard", "tanimoto", "dice", "tversky"]
+
+
+    def __init__(self, dataMatrix, topK=100, shrink = 0, normalize = True,
+                 tversky_alpha = 1.0, tversky_beta = 1.0, similarity = "cosine", top_k_margin = None, block_size = 200):
+        """
+        Computes the similarity on the columns of dataMatrix and keeps the state required to update it when
+        rows of dataMatrix are added or changed, see update_similarity.
+        If it is computed on URM=|users|x|items|, pass the URM as is.
+        If it is computed on ICM=|items|x|features|, pass the ICM transposed.
+
+        Only symmetric similarities are supported, since the similarity of an untouched column with the touched ones
+        is obtained from the columns of the touched ones. Ties are broken in favour of the lower index as in
+        Compute_Similarity_Cython, therefore the result does not depend on the order the updates are applied.
+
+        :param dataMatrix:
+        :param topK:
+        :param shrink:
+        :param normalize:           If True divide the dot product by the product of the norms
+        :param similarity:  "cosine"        computes Cosine similarity
+                            "jaccard"       computes Jaccard similarity for binary interactions using Tanimoto
+                            "dice"          computes Dice similarity for binary interactions
+                            "tversky"       computes Tversky similarity for binary interactions, tversky_alpha must be equal to tversky_beta
+        :param top_k_margin:        Number of elements stored beyond the TopK of each column, the more are stored the fewer
+                                    columns are computed again by update_similarity. If None it is equal to topK
+        :param block_size:          Number of columns computed at once
+        """
+
+        super(Compute_Similarity_Incremental, self).__init__()
+
+        if similarity not in self.SUPPORTED_SIMILARITIES:
+            raise ValueError("Compute_Similarity_Incremental: value for paramether 'similarity' not recognized."
+                             " Allowed values are: {}, the similarity must be symmetric."
+                             " Passed value was '{}'".format(self.SUPPORTED_SIMILARITIES, similarity))
+
+        if similarity == "tversky" and tversky_alpha != tversky_beta:
+            raise ValueError("Compute_Similarity_Incremental: tversky similarity is symmetric only if tversky_alpha is equal to tversky_beta."
+                             " Passed values were {} and {}".format(tversky_alpha, tversky_beta))
+
+        self.n_rows, self.n_columns = dataMatrix.shape
+        self.TopK = min(topK, self.n_columns)
+
+        if self.TopK == 0:
+            raise ValueError("Compute_Similarity_Incremental: topK must be a positive integer")
+
+        self.shrink = shrink
+        self.normalize = normalize
+        self.tversky_alpha = tversky_alpha
+        self.tversky_beta = tversky_beta
+        self.similarity = similarity
+        self.top_k_margin = self.TopK if top_k_margin is None else top_k_margin
+        self.block_size = block_size
+
+        # Jaccard, dice and tversky are defined on binary interactions and have a specific kind of normalization
+        self.use_boolean_interactions = similarity in ["jaccard", "tanimoto", "dice", "tversky"]
+
+        if self.use_boolean_interactions:
+            self.normalize = False
+
+        self._set_data_matrix(check_matrix(dataMatrix, 'csr', dtype=np.float64))
+
+        # TopK plus the margin of each column, empty positions have id -1, and the upper bound of the elements not stored
+        self.top_k_values = None
+        self.top_k_ids = None
+        self.threshold = None
+
+
+
+
+    def _set_data_matrix(self, dataMatrix_csr):
+
+        self.dataMatrix_csr = dataMatrix_csr
+        self.dataMatrix_csr.sort_indices()
+
+        if self.use_boolean_interactions:
+            self.dataMatrix_csr.data = np.ones_like(self.dataMatrix_csr.data)
+
+        self.dataMatrix = check_matrix(self.dataMatrix_csr, 'csc', dtype=np.float64)
+        self.n_rows = self.dataMatrix.shape[0]
+
+        # Compute sum of squared values to be used in normalization
+        self.sumOfSquared = np.array(self.dataMatrix.power(2).sum(axis=0), dtype=np.float64).ravel()
+
+        # Tanimoto does not require the square root to be applied
+        if not self.use_boolean_interactions:
+            self.sumOfSquared = np.sqrt(self.sumOfSquared)
+
+
+
+
+    def _apply_denominator(self, data, neighbour_ids, target_ids):
+        """
+        Apply normalization and shrinkage as in Compute_Similarity_Cython, ensure denominator != 0
+        data contains the dot products of the pairs (neighbour_ids, target_ids)
+        """
+
+        if self.normalize:
+            return data / (self.sumOfSquared[neighbour_ids] * self.sumOfSquared[target_ids] + self.shrink + 1e-6)
+
+        elif self.similarity in ["jaccard", "tanimoto"]:
+            return data / (self.sumOfSquared[target_ids] + self.sumOfSquared[neighbour_ids] - data + self.shrink + 1e-6)
+
+        elif self.similarity == "dice":
+            return data / (self.sumOfSquared[target_ids] + self.sumOfSquared[neighbour_ids] + self.shrink + 1e-6)
+
+        elif self.similarity == "tversky":
+            return data / (data + (self.sumOfSquared[target_ids] - data)*self.tversky_alpha +
+                           (self.sumOfSquared[neighbour_ids] - data)*self.tversky_beta + self.shrink + 1e-6)
+
+        elif self.shrink != 0:
+            return data/self.shrink
+
+        return data
+
+
+
+
+    def _compute_columns(self, col_ids):
+        """
+        Computes the similarity of the columns in col_ids with all the others, only for the pairs having a nonzero dot product
+        :return: generator of the block column ids, values, neighbour ids, target ids, one for each block of columns
+        """
+
+        dataMatrix_T = self.dataMatrix.T.tocsr()
+
+        for block_start in range(0, len(col_ids), self.block_size):
+
+            block_col_ids = col_ids[block_start:block_start + self.block_size]
+
+            dot_products = dataMatrix_T.dot(self.dataMatrix[:, block_col_ids]).tocoo()
+
+            neighbour_ids = dot_products.row.astype(np.int32)
+            target_ids = block_col_ids[dot_products.col].astype(np.int32)
+
+            not_diagonal_mask = np.logical_and(neighbour_ids != target_ids, dot_products.data != 0.0)
+
+            values = self._apply_denominator(dot_products.data[not_diagonal_mask], neighbour_ids[not_diagonal_mask], target_ids[not_diagonal_mask])
+
+            yield block_col_ids, values, neighbour_ids[not_diagonal_mask], target_ids[not_diagonal_mask]
+
+
+
+
+    def _select_top_k(self, values, rows, cols, col_ids, previous_threshold = None):
+        """
+        Selects the TopK plus the margin of the columns in col_ids among the given elements and stores it in the state.
+        Each (row, col) pair must be present only once. Ties are broken in favour of the lower row.
+
+        The threshold of a column is an upper bound of the values of the elements not stored, if previous_threshold
+        is provided the elements not given are still bounded by it.
+        """
+
+        sorted_idx = np.lexsort((rows, -values, cols))
+        values, rows, cols = values[sorted_idx], rows[sorted_idx], cols[sorted_idx]
+
+        column_start = np.searchsorted(cols, cols, side="left")
+        rank_in_column = np.arange(len(cols)) - column_start
+
+        n_stored = self.top_k_values.shape[0]
+        stored_mask = rank_in_column < n_stored
+
+        self.top_k_values[:, col_ids] = 0.0
+        self.top_k_ids[:, col_ids] = -1
+
+        self.top_k_values[rank_in_column[stored_mask], cols[stored_mask]] = values[stored_mask]
+        self.top_k_ids[rank_in_column[stored_mask], cols[stored_mask]] = rows[stored_mask]
+
+        first_dropped_mask = rank_in_column == n_stored
+        threshold = np.full(self.n_columns, -np.inf)
+        threshold[cols[first_dropped_mask]] = values[first_dropped_mask]
+
+        if previous_threshold is not None:
+            threshold[col_ids] = np.maximum(threshold[col_ids], previous_threshold[col_ids])
+
+        self.threshold[col_ids] = threshold[col_ids]
+
+
+
+
+    def _merge_top_k(self, values, rows, cols, col_ids):
+        """
+        Selects the TopK plus the margin of the columns in col_ids among the stored elements and the given ones
+        """
+
+        stored_ids = self.top_k_ids[:, col_ids]
+        stored_mask = stored_ids != -1
+        stored_cols = np.repeat(col_ids[None,:], stored_ids.shape[0], axis=0)
+
+        self._select_top_k(np.concatenate((self.top_k_values[:, col_ids][stored_mask], values)),
+                           np.concatenate((stored_ids[stored_mask], rows)),
+                           np.concatenate((stored_cols[stored_mask], cols)),
+                           col_ids, previous_threshold = self.threshold)
+
+
+
+
+    def _recompute_columns(self, col_ids):
+
+        for block_col_ids, values, rows, cols in self._compute_columns(col_ids):
+            self._select_top_k(values, rows, cols, block_col_ids)
+
+
+
+
+    def _get_W_sparse(self):
+
+        top_k_ids = self.top_k_ids[:self.TopK,:]
+
+        cols = np.repeat(np.arange(self.n_columns, dtype=np.int32)[None,:], self.TopK, axis=0)
+        notZerosMask = top_k_ids != -1
+
+        W_sparse = sps.csr_matrix((self.top_k_values[:self.TopK,:][notZerosMask], (top_k_ids[notZerosMask], cols[notZerosMask])),
+                                  shape=(self.n_columns, self.n_columns),
+                                  dtype=np.float32)
+
+        return W_sparse
+
+
+
+
+    def compute_similarity(self):
+        """
+        Compute the similarity for all the columns and store the TopK plus the margin as the state to be updated
+        :return:
+        """
+
+        start_time = time.time()
+
+        n_stored = self.TopK + self.top_k_margin
+
+        self.top_k_values = np.zeros((n_stored, self.n_columns), dtype=np.float64)
+        self.top_k_ids = np.full((n_stored, self.n_columns), -1, dtype=np.int32)
+        self.threshold = np.full(self.n_columns, -np.inf)
+
+        self._recompute_columns(np.arange(self.n_columns, dtype=np.int32))
+
+        print("Compute_Similarity_Incremental: computed {} columns in {:.2f} sec".format(self.n_columns, time.time() - start_time))
+        sys.stdout.flush()
+
+        return self._get_W_sparse()
+
+
+
+
+    def update_similarity(self, delta_matrix, changed_rows = None):
+        """
+        Replaces the rows changed_rows of dataMatrix with the ones of delta_matrix and updates the similarity.
+        The result is equal to the one of compute_similarity on the new dataMatrix.
+
+        The columns contained in a changed row, before or after the change, are touched: their norm and their dot
+        products change and they are computed again.
+        For the other columns only the similarity with the touched ones changes, and it is known from the touched
+        columns themselves. Their new TopK is selected among the stored elements and the touched ones, if its last
+        value is not above the bound of the elements not stored, the column is computed again.
+
+        :param delta_matrix:    Matrix with the new number of rows and the same number of columns,
+                                rows beyond the current ones are new rows
+        :param changed_rows:    Rows of delta_matrix replacing the current ones, if None the nonempty rows of delta_matrix
+        :return:
+        """
+
+        if self.top_k_values is None:
+            raise ValueError("Compute_Similarity_Incremental: compute_similarity must be called before update_similarity")
+
+        if delta_matrix.shape[1] != self.n_columns or delta_matrix.shape[0] < self.n_rows:
+            raise ValueError("Compute_Similarity_Incremental: delta_matrix must have {} columns and at least {} rows, its shape is {}".format(
+                self.n_columns, self.n_rows, delta_matrix.shape))
+
+        start_time = time.time()
+
+        delta_matrix = check_matrix(delta_matrix, 'csr', dtype=np.float64)
+
+        if changed_rows is None:
+            changed_rows = np.flatnonzero(np.diff(delta_matrix.indptr) > 0)
+
+        changed_rows = np.unique(np.array(changed_rows, dtype=np.int64))
+
+        # Columns in the changed rows before and after the change
+        old_changed_rows = changed_rows[changed_rows < self.n_rows]
+        touched_mask = np.zeros(self.n_columns, dtype=bool)
+        touched_mask[self.dataMatrix_csr[old_changed_rows].indices] = True
+        touched_mask[delta_matrix[changed_rows].indices] = True
+
+        touched_cols = np.flatnonzero(touched_mask).astype(np.int32)
+        untouched_cols = np.flatnonzero(~touched_mask).astype(np.int32)
+
+
+        # Build the new matrix keeping the unchanged rows
+        new_n_rows = delta_matrix.shape[0]
+        kept_rows_mask = np.ones(new_n_rows, dtype=bool)
+        kept_rows_mask[changed_rows] = False
+        kept_rows_mask[self.n_rows:] = False
+
+        kept_matrix = sps.diags(kept_rows_mask[:self.n_rows].astype(np.float64)).dot(self.dataMatrix_csr)
+        kept_matrix = sps.vstack([kept_matrix, sps.csr_matrix((new_n_rows - self.n_rows, self.n_columns))], format="csr")
+
+        changed_matrix = sps.diags((~kept_rows_mask).astype(np.float64)).dot(delta_matrix)
+
+        new_dataMatrix = check_matrix(kept_matrix + changed_matrix, 'csr', dtype=np.float64)
+        new_dataMatrix.eliminate_zeros()
+
+        self._set_data_matrix(new_dataMatrix)
+
+
+        # Remove from the untouched columns the stored touched elements, whose value changed
+        previous_threshold = self.threshold.copy()
+
+        stored_cols = np.repeat(np.arange(self.n_columns, dtype=np.int32)[None,:], self.top_k_ids.shape[0], axis=0)
+        removed_mask = np.logical_and(self.top_k_ids != -1, ~touched_mask[stored_cols])
+        removed_mask[removed_mask] = touched_mask[self.top_k_ids[removed_mask]]
+
+        self.top_k_ids[removed_mask] = -1
+        merge_cols_mask = np.zeros(self.n_columns, dtype=bool)
+        merge_cols_mask[stored_cols[removed_mask]] = True
+
+        # Compute the touched columns and merge their similarity with the untouched ones into the TopK of the latter.
+        # The elements to merge are buffered and merged only once, unless they exceed the size of the stored ones
+        self.threshold[touched_cols] = -np.inf
+        values_list, rows_list, cols_list = [np.zeros(0)], [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.int32)]
+        n_buffered = 0
+
+        for block_col_ids, values, rows, cols in self._compute_columns(touched_cols):
+
+            self._select_top_k(values, rows, cols, block_col_ids)
+
+            # The similarity is symmetric, the element (row, col) of a touched col is the element (col, row) of the untouched row
+            untouched_mask = ~touched_mask[rows]
+            values_list.append(values[untouched_mask])
+            rows_list.append(cols[untouched_mask])
+            cols_list.append(rows[untouched_mask])
+            merge_cols_mask[rows[untouched_mask]] = True
+            n_buffered += untouched_mask.sum()
+
+            if n_buffered > self.top_k_ids.size:
+                self._merge_top_k(np.concatenate(values_list), np.concatenate(rows_list), np.concatenate(cols_list), np.flatnonzero(merge_cols_mask).astype(np.int32))
+                values_list, rows_list, cols_list = [np.zeros(0)], [np.zeros(0, dtype=np.int32)], [np.zeros(0, dtype=np.int32)]
+                merge_cols_mask[:] = False
+                n_buffered = 0
+
+        self._merge_top_k(np.concatenate(values_list), np.concatenate(rows_list), np.concatenate(cols_list), np.flatnonzero(merge_cols_mask).astype(np.int32))
+
+
+        # The elements not stored are bounded by the previous threshold, if the last of the TopK is not above it they may enter the TopK
+        last_top_k_value = np.where(self.top_k_ids[self.TopK-1, untouched_cols] != -1, self.top_k_values[self.TopK-1, untouched_cols], -np.inf)
+
+        exact_mask = np.logical_or(last_top_k_value > previous_threshold[untouched_cols], previous_threshold[untouched_cols] == -np.inf)
+        recompute_cols = untouched_cols[~exact_mask]
+
+        self._recompute_columns(recompute_cols)
+
+        print("Compute_Similarity_Incremental: {} changed rows, {} touched columns, {} columns computed again, updated in {:.2f} sec".format(
+            len(changed_rows), len(touched_cols), len(recompute_cols), time.time() - start_time))
+
+        sys.stdout.flush()
+
+        return self._get_W_sparse()
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import time, sys, os, shutil, tempfile
+import scipy.sparse as sps
+from Base.Recommender_utils import check_matrix
+from Base.Similarity.Compute_Similarity_Bias_Parametric import similarity_data_top_k
+
+
+
+def save_data_matrix_npy(dataMatrix, folder_path):
+    """
+    Saves dataMatrix in CSC format as the three files csc_indptr.npy, csc_indices.npy, csc_data.npy and its shape in shape.npy,
+    which can be used by Compute_Similarity_Out_Of_Core without loading them in memory
+    :param dataMatrix:
+    :param folder_path:
+    :return:
+    """
+
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    dataMatrix = check_matrix(dataMatrix, 'csc')
+    dataMatrix.sort_indices()
+
+    np.save(os.path.join(folder_path, "shape.npy"), np.array(dataMatrix.shape, dtype=np.int64))
+    np.save(os.path.join(folder_path, "csc_indptr.npy"), dataMatrix.indptr.astype(np.int64))
+    np.save(os.path.join(folder_path, "csc_indices.npy"), dataMatrix.indices.astype(np.int32))
+    np.save(os.path.join(folder_path, "csc_data.npy"), dataMatrix.data.astype(np.float64))
+
+
+
+
+class Compute_Similarity_Out_Of_Core:
+
+
+    SUPPORTED_SIMILARITIES = ["cosine", "asymmetric", "jaccard", "tanimoto", "dice", "tversky"]
+
+
+    def __init__(self, dataMatrix, topK=100, shrink = 0, normalize = True,
+                 asymmetric_alpha = 0.5, tversky_alpha = 1.0, tversky_beta = 1.0,
+                 similarity = "cosine", row_weights = None,
+                 folder_path = None, max_chunk_work = 2e7, max_block_nnz = 1e7, delete_shards = True):
+        """
+        Computes the similarity on the columns of dataMatrix keeping it on disk.
+        If it is computed on URM=|users|x|items|, pass the URM as is.
+        If it is computed on ICM=|items|x|features|, pass the ICM transposed.
+
+        The data is read from memory-mapped .npy files, see save_data_matrix_npy, and only the memory required by a chunk
+        of columns is allocated. The CSR version required to compute the dot products is built on disk in folder_path.
+        The columns are processed in chunks requiring at most max_chunk_work multiply-adds, the TopK of each chunk is
+        written to memory-mapped shards in folder_path and the shards are assembled in the final sparse matrix.
+
+        :param dataMatrix:          Path of the folder containing the .npy files or a sparse matrix, which is saved in folder_path
+        :param topK:
+        :param shrink:
+        :param normalize:           If True divide the dot product by the product of the norms
+        :param row_weights:         Multiply the values in each row by a specified value. Array
+        :param asymmetric_alpha     Coefficient alpha for the asymmetric cosine
+        :param similarity:          "cosine", "asymmetric", "jaccard", "tanimoto", "dice" or "tversky"
+        :param folder_path:         Folder for the CSR files and the shards, if None the data folder or a temporary one is used.
+                                    The temporary folder is removed at the end of compute_similarity, the files are kept
+                                    memory-mapped therefore compute_similarity can be called again
+        :param max_chunk_work:      Maximum number of multiply-adds of a chunk, bounds the memory required by its dot products
+        :param max_block_nnz:       Number of nonzeros read at once when scanning the whole matrix
+        :param delete_shards:       If True the shards are removed once assembled
+        """
+
+        super(Compute_Similarity_Out_Of_Core, self).__init__()
+
+        if similarity not in self.SUPPORTED_SIMILARITIES:
+            raise ValueError("Compute_Similarity_Out_Of_Core: value for paramether 'similarity' not recognized."
+                             " Allowed values are: {}, the others require to center the data, which would make it dense."
+                             " Passed value was '{}'".format(self.SUPPORTED_SIMILARITIES, similarity))
+
+        # A temporary folder created here is removed by compute_similarity
+        self._owns_folder_path = False
+
+        if isinstance(dataMatrix, str):
+            data_folder_path = dataMatrix
+
+            if folder_path is None:
+                folder_path = data_folder_path
+
+        else:
+            if folder_path is None:
+                folder_path = tempfile.mkdtemp()
+                self._owns_folder_path = True
+
+            data_folder_path = folder_path
+            save_data_matrix_npy(dataMatrix, data_folder_path)
+
+        self.folder_path = folder_path
+        self.max_chunk_work = max_chunk_work
+        self.max_block_nnz = int(max_block_nnz)
+        self.delete_shards = delete_shards
+
+        if not os.path.exists(self.folder_path):
+            os.makedirs(self.folder_path)
+
+        self.n_rows, self.n_columns = np.load(os.path.join(data_folder_path, "shape.npy"))
+        self.TopK = min(topK, self.n_columns)
+
+        if self.TopK == 0:
+            raise ValueError("Compute_Similarity_Out_Of_Core: topK must be a positive integer, the dense similarity would not fit in memory")
+
+        self.shrink = shrink
+        self.normalize = normalize
+        self.asymmetric_alpha = asymmetric_alpha
+        self.tversky_alpha = tversky_alpha
+        self.tversky_beta = tversky_beta
+        self.similarity = similarity
+
+        # Jaccard, dice and tversky are defined on binary interactions and have a specific kind of normalization
+        self.use_boolean_interactions = similarity in ["jaccard", "tanimoto", "dice", "tversky"]
+
+        if self.use_boolean_interactions:
+            self.normalize = False
+
+        self.csc_indptr = np.load(os.path.join(data_folder_path, "csc_indptr.npy"), mmap_mode="r")
+        self.csc_indices = np.load(os.path.join(data_folder_path, "csc_indices.npy"), mmap_mode="r")
+        self.csc_data = np.load(os.path.join(data_folder_path, "csc_data.npy"), mmap_mode="r")
+
+        self.use_row_weights = False
+
+        if row_weights is not None:
+
+            if self.n_rows != len(row_weights):
+                raise ValueError("Compute_Similarity_Out_Of_Core: provided row_weights and dataMatrix have different number of rows."
+                                 "Row_weights has {} rows, dataMatrix has {}.".format(len(row_weights), self.n_rows))
+
+            self.use_row_weights = True
+            self.row_weights = np.array(row_weights, dtype=np.float64)
+
+
+        start_time = time.time()
+
+        self._build_csr_files()
+        self._compute_column_statistics()
+
+        print("Compute_Similarity_Out_Of_Core: prepared {} nonzeros on disk in {:.2f} sec".format(
+            len(self.csc_indices), time.time() - start_time))
+
+        sys.stdout.flush()
+
+
+
+
+    def _get_data(self, data):
+
+        data = np.array(data, dtype=np.float64)
+
+        if self.use_boolean_interactions:
+            data[:] = 1.0
+
+        return data
+
+
+
+    def _iterate_nnz_blocks(self):
+        """
+        Yields the column index, row index and value of the nonzeros in blocks of at most max_block_nnz elements
+        """
+
+        nnz = len(self.csc_indices)
+        csc_indptr = np.array(self.csc_indptr)
+
+        for block_start in range(0, nnz, self.max_block_nnz):
+
+            block_end = min(block_start + self.max_block_nnz, nnz)
+
+            col_ids = np.searchsorted(csc_indptr, np.arange(block_start, block_end), side="right") - 1
+
+            yield col_ids, np.array(self.csc_indices[block_start:block_end]), self._get_data(self.csc_data[block_start:block_end])
+
+
+
+    def _build_csr_files(self):
+        """
+        Transposes the CSC files in CSR ones with a counting sort, reading and writing them by blocks
+        """
+
+        nnz = len(self.csc_indices)
+
+        nnz_per_row = np.zeros(self.n_rows, dtype=np.int64)
+
+        for _, row_ids, _ in self._iterate_nnz_blocks():
+            nnz_per_row += np.bincount(row_ids, minlength=self.n_rows)
+
+        csr_indptr = np.zeros(self.n_rows + 1, dtype=np.int64)
+        csr_indptr[1:] = np.cumsum(nnz_per_row)
+
+        self.csr_indices = np.lib.format.open_memmap(os.path.join(self.folder_path, "csr_indices.npy"), mode="w+", dtype=np.int32, shape=(nnz,))
+        self.csr_data = np.lib.format.open_memmap(os.path.join(self.folder_path, "csr_data.npy"), mode="w+", dtype=np.float64, shape=(nnz,))
+
+        # Next free position of each row, the columns are visited in order therefore each row is sorted
+        row_position = csr_indptr[:-1].copy()
+
+        for col_ids, row_ids, data in self._iterate_nnz_blocks():
+
+            sorted_idx = np.argsort(row_ids, kind="stable")
+            row_ids, col_ids, data = row_ids[sorted_idx], col_ids[sorted_idx], data[sorted_idx]
+
+            # Position of each element within the elements of the same row in this block
+            block_row_start = np.searchsorted(row_ids, row_ids, side="left")
+            positions = row_position[row_ids] + np.arange(len(row_ids)) - block_row_start
+
+            self.csr_indices[positions] = col_ids
+            self.csr_data[positions] = data
+
+            row_position += np.bincount(row_ids, minlength=self.n_rows)
+
+        self.csr_indices.flush()
+        self.csr_data.flush()
+
+        self.csr_indptr = csr_indptr
+        self.nnz_per_row = nnz_per_row
+
+
+
+    def _compute_column_statistics(self):
+        """
+        Computes the sum of squared values used in normalization and the multiply-adds required by each column
+        """
+
+        self.sumOfSquared = np.zeros(self.n_columns, dtype=np.float64)
+        self.work_per_column = np.zeros(self.n_columns, dtype=np.float64)
+
+        for col_ids, row_ids, data in self._iterate_nnz_blocks():
+            self.sumOfSquared += np.bincount(col_ids, weights=data**2, minlength=self.n_columns)
+            self.work_per_column += np.bincount(col_ids, weights=self.nnz_per_row[row_ids], minlength=self.n_columns)
+
+        # Tanimoto does not require the square root to be applied
+        if not self.use_boolean_interactions:
+            self.sumOfSquared = np.sqrt(self.sumOfSquared)
+
+        if self.similarity == "asymmetric":
+            self.sumOfSquared_to_1_minus_alpha = np.power(self.sumOfSquared, 2 * (1 - self.asymmetric_alpha))
+            self.sumOfSquared_to_alpha = np.power(self.sumOfSquared, 2 * self.asymmetric_alpha)
+
+
+
+
+    def _get_chunk_ranges(self, start_col, end_col):
+        """
+        Splits the columns in contiguous chunks requiring at most max_chunk_work multiply-adds, a column requiring
+        more is a chunk on its own
+        """
+
+        work_cumulative = np.cumsum(self.work_per_column[start_col:end_col] + 1)
+
+        chunk_ranges = []
+        chunk_start = 0
+
+        while chunk_start < end_col - start_col:
+
+            previous_work = work_cumulative[chunk_start-1] if chunk_start > 0 else 0
+            chunk_end = np.searchsorted(work_cumulative, previous_work + self.max_chunk_work, side="right")
+            chunk_end = max(chunk_end, chunk_start + 1)
+
+            chunk_ranges.append((start_col + chunk_start, start_col + chunk_end))
+            chunk_start = chunk_end
+
+        return chunk_ranges
+
+
+
+
+    def _apply_denominator(self, data, neighbour_ids, target_ids):
+        """
+        Apply normalization and shrinkage as in Compute_Similarity_Python, ensure denominator != 0
+        data contains the dot products of the pairs (neighbour_ids, target_ids)
+        """
+
+        if self.normalize:
+
+            if self.similarity == "asymmetric":
+                denominator = self.sumOfSquared_to_1_minus_alpha[neighbour_ids] * self.sumOfSquared_to_alpha[target_ids] + self.shrink + 1e-6
+            else:
+                denominator = self.sumOfSquared[neighbour_ids] * self.sumOfSquared[target_ids] + self.shrink + 1e-6
+
+            return data / denominator
+
+        elif self.similarity in ["jaccard", "tanimoto"]:
+            denominator = self.sumOfSquared[target_ids] + self.sumOfSquared[neighbour_ids] - data + self.shrink + 1e-6
+            return data / denominator
+
+        elif self.similarity == "dice":
+            denominator = self.sumOfSquared[target_ids] + self.sumOfSquared[neighbour_ids] + self.shrink + 1e-6
+            return data / denominator
+
+        elif self.similarity == "tversky":
+            denominator = data + \
+                          (self.sumOfSquared[target_ids] - data)*self.tversky_alpha + \
+                          (self.sumOfSquared[neighbour_ids] - data)*self.tversky_beta + self.shrink + 1e-6
+            return data / denominator
+
+        elif self.shrink != 0:
+            return data/self.shrink
+
+        return data
+
+
+
+
+    def _compute_chunk_top_k(self, start_col, end_col):
+        """
+        Computes the TopK of the columns in [start_col, end_col) loading only the rows they contain
+        :return: values, rows, cols sorted by column
+        """
+
+        nnz_start, nnz_end = self.csc_indptr[start_col], self.csc_indptr[end_col]
+
+        chunk_row_ids = np.array(self.csc_indices[nnz_start:nnz_end])
+        chunk_indptr = np.array(self.csc_indptr[start_col:end_col+1]) - nnz_start
+
+        touched_rows = np.unique(chunk_row_ids)
+
+        # Gather the rows containing the chunk columns from the CSR files
+        row_start = self.csr_indptr[touched_rows]
+        row_length = self.csr_indptr[touched_rows + 1] - row_start
+
+        rows_indptr = np.zeros(len(touched_rows) + 1, dtype=np.int64)
+        rows_indptr[1:] = np.cumsum(row_length)
+
+        positions = np.repeat(row_start - rows_indptr[:-1], row_length) + np.arange(rows_indptr[-1])
+
+        rows_data = self._get_data(self.csr_data[positions])
+
+        if self.use_row_weights:
+            rows_data *= np.repeat(self.row_weights[touched_rows], row_length)
+
+        dataMatrix_rows = sps.csr_matrix((rows_data, np.array(self.csr_indices[positions]), rows_indptr),
+                                         shape=(len(touched_rows), self.n_columns))
+
+        dataMatrix_chunk = sps.csc_matrix((self._get_data(self.csc_data[nnz_start:nnz_end]),
+                                           np.searchsorted(touched_rows, chunk_row_ids), chunk_indptr),
+                                          shape=(len(touched_rows), end_col - start_col))
+
+        # Each column of the chunk is a column of the similarity, rows are all the items
+        dot_products = sps.csc_matrix(dataMatrix_rows.T.dot(dataMatrix_chunk))
+        dot_products.sort_indices()
+
+        target_ids = np.repeat(np.arange(start_col, end_col), np.diff(dot_products.indptr))
+
+        data = self._apply_denominator(dot_products.data, dot_products.indices, target_ids)
+        data[dot_products.indices == target_ids] = 0.0
+
+        values, rows, cols = similarity_data_top_k(data, dot_products.indices, dot_products.indptr, end_col - start_col, self.TopK)
+
+        return values, rows, cols + start_col
+
+
+
+
+    def _write_shard(self, shard_index, array_name, array):
+
+        shard = np.lib.format.open_memmap(os.path.join(self.shard_folder_path, "{}_{}.npy".format(array_name, shard_index)),
+                                          mode="w+", dtype=array.dtype, shape=array.shape)
+        shard[:] = array
+        shard.flush()
+
+        del shard
+
+
+
+    def _read_shard(self, shard_index, array_name):
+
+        return np.load(os.path.join(self.shard_folder_path, "{}_{}.npy".format(array_name, shard_index)), mmap_mode="r")
+
+
+
+
+    def compute_similarity(self, start_col=None, end_col=None):
+        """
+        Compute the similarity for the given dataset
+        :param self:
+        :param start_col: column to begin with
+        :param end_col: column to stop before, end_col is excluded
+        :return:
+        """
+
+        start_col_local = 0
+        end_col_local = self.n_columns
+
+        if start_col is not None and start_col>0 and start_col<self.n_columns:
+            start_col_local = start_col
+
+        if end_col is not None and end_col>start_col_local and end_col<self.n_columns:
+            end_col_local = end_col
+
+
+        if self._owns_folder_path:
+            # The folder of a previous call has been removed, the CSC and CSR files are still memory-mapped
+            os.makedirs(self.folder_path, exist_ok=True)
+
+        try:
+            W_sparse = self._compute_similarity_shards(start_col_local, end_col_local)
+
+        finally:
+            if self._owns_folder_path:
+                shutil.rmtree(self.folder_path, ignore_errors=True)
+
+        return W_sparse
+
+
+
+
+    def _compute_similarity_shards(self, start_col_local, end_col_local):
+        """
+        Computes the TopK of the columns in the range writing them in shards, then assembles the shards
+        :param start_col_local: column to begin with
+        :param end_col_local: column to stop before, end_col_local is excluded
+        :return:
+        """
+
+        start_time = time.time()
+        start_time_print_batch = start_time
+        processedItems = 0
+
+        self.shard_folder_path = tempfile.mkdtemp(prefix="similarity_shards_", dir=self.folder_path)
+
+        chunk_ranges = self._get_chunk_ranges(start_col_local, end_col_local)
+        shard_nnz = []
+
+        for shard_index, (start_col_chunk, end_col_chunk) in enumerate(chunk_ranges):
+
+            values, rows, cols = self._compute_chunk_top_k(start_col_chunk, end_col_chunk)
+
+            self._write_shard(shard_index, "values", values.astype(np.float32))
+            self._write_shard(shard_index, "rows", rows.astype(np.int32))
+            self._write_shard(shard_index, "cols", cols.astype(np.int32))
+
+            shard_nnz.append(len(values))
+
+            processedItems += end_col_chunk - start_col_chunk
+
+            if time.time() - start_time_print_batch >= 30 or end_col_chunk == end_col_local:
+                columnPerSec = processedItems / (time.time() - start_time + 1e-9)
+
+                print("Similarity column {} ( {:2.0f} % ), {:.2f} column/sec, elapsed time {:.2f} min".format(
+                    processedItems, processedItems / (end_col_local - start_col_local) * 100, columnPerSec, (time.time() - start_time)/ 60))
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+
+                start_time_print_batch = time.time()
+
+
+        # Shards are sorted by column, therefore they can be assembled directly as CSC without intermediate copies
+        nnz = int(np.sum(shard_nnz))
+
+        values = np.zeros(nnz, dtype=np.float32)
+        rows = np.zeros(nnz, dtype=np.int32)
+        nnz_per_column = np.zeros(self.n_columns, dtype=np.int64)
+
+        shard_start = 0
+
+        for shard_index in range(len(chunk_ranges)):
+
+            shard_end = shard_start + shard_nnz[shard_index]
+
+            values[shard_start:shard_end] = self._read_shard(shard_index, "values")
+            rows[shard_start:shard_end] = self._read_shard(shard_index, "rows")
+            nnz_per_column += np.bincount(self._read_shard(shard_index, "cols"), minlength=self.n_columns)
+
+            shard_start = shard_end
+
+        if self.delete_shards:
+            shutil.rmtree(self.shard_folder_path, ignore_errors=True)
+
+        indptr = np.zeros(self.n_columns + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(nnz_per_column)
+
+        W_sparse = sps.csc_matrix((values, rows, indptr), shape=(self.n_columns, self.n_columns))
+
+        return check_matrix(W_sparse, 'csr', dtype=np.float32)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 23/10/17
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import numpy as np
+import time, sys, os
+import contextlib
+import scipy.sparse as sps
+import multiprocessing
+from multiprocessing import shared_memory
+
+from Base.Recommender_utils import check_matrix
+
+
+
+def get_balanced_column_ranges(dataMatrix, n_ranges):
+    """
+    Splits the columns of dataMatrix in at most n_ranges contiguous ranges requiring a similar amount of work.
+    The work of a column is the number of multiply-adds required to compute its dot products, which is the
+    sum of the nnz of the rows it contains, rather than the number of columns.
+    :param dataMatrix:
+    :param n_ranges:
+    :return: list of (start_col, end_col) tuples, end_col is excluded
+    """
+
+    dataMatrix_csc = check_matrix(dataMatrix, 'csc', dtype=dataMatrix.dtype)
+    n_columns = dataMatrix_csc.shape[1]
+
+    nnz_per_row = np.bincount(dataMatrix_csc.indices, minlength=dataMatrix_csc.shape[0])
+
+    col_ids = np.repeat(np.arange(n_columns), np.diff(dataMatrix_csc.indptr))
+    work_per_col = np.bincount(col_ids, weights=nnz_per_row[dataMatrix_csc.indices], minlength=n_columns)
+
+    # Ensure empty columns still count, otherwise long runs of them would end up in a single range
+    work_cumulative = np.cumsum(work_per_col + 1)
+
+    split_points = np.searchsorted(work_cumulative, np.linspace(0, work_cumulative[-1], n_ranges+1)[1:-1])
+    split_points = np.unique(np.concatenate(([0], split_points, [n_columns])))
+
+    return list(zip(split_points[:-1], split_points[1:]))
+
+
+
+def _share_array(array):
+    """
+    Copies array in a new shared memory block
+    :return: the shared memory block and the descriptor needed to attach to it
+    """
+
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared_array[:] = array[:]
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+
+def _attach_array(descriptor, shm_list):
+
+    name, shape, dtype = descriptor
+
+    shm = shared_memory.SharedMemory(name=name)
+    shm_list.append(shm)
+
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+
+
+# Worker state, one instance per process, initialized by _worker_init
+_worker_status = {}
+
+
+def _worker_init(data_descriptor, indices_descriptor, indptr_descriptor, shape, use_implementation, similarity_args):
+
+    shm_list = []
+
+    data = _attach_array(data_descriptor, shm_list)
+    indices = _attach_array(indices_descriptor, shm_list)
+    indptr = _attach_array(indptr_descriptor, shm_list)
+
+    # The matrix is a view on the shared buffers, no copy is done here
+    _worker_status["dataMatrix"] = sps.csc_matrix((data, indices, indptr), shape=shape, copy=False)
+    _worker_status["shm_list"] = shm_list
+    _worker_status["use_implementation"] = use_implementation
+    _worker_status["similarity_args"] = similarity_args
+    _worker_status["similarity_object"] = None
+
+
+
+def _get_worker_similarity_object():
+
+    from Base.Similarity.Compute_Similarity import Compute_Similarity
+
+    if _worker_status["similarity_object"] is not None:
+        return _worker_status["similarity_object"]
+
+    # The Cython implementation can compute any column range on the same object and uses the shared buffers
+    # without copying them, only its CSR structure is allocated by the worker
+    if _worker_status["use_implementation"] == "cython":
+
+        try:
+            from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+
+            _worker_status["similarity_object"] = Compute_Similarity_Cython(_worker_status["dataMatrix"], copy = False,
+                                                                            **_worker_status["similarity_args"])
+            return _worker_status["similarity_object"]
+
+        except ImportError:
+            pass
+
+    # The Python implementation applies the similarity-specific preprocessing in compute_similarity and must be
+    # built again for every range
+    return Compute_Similarity(_worker_status["dataMatrix"],
+                              use_implementation = "python",
+                              **_worker_status["similarity_args"])
+
+
+
+def _worker_compute_column_range(start_end_col_tuple):
+
+    start_col, end_col = start_end_col_tuple
+
+    # The progress is printed by the main process
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        W_block = _get_worker_similarity_object().compute_similarity(start_col=start_col, end_col=end_col)
+
+    if isinstance(W_block, np.ndarray):
+        W_block = sps.coo_matrix(W_block[:, start_col:end_col])
+    else:
+        W_block = check_matrix(W_block, 'csc', dtype=np.float32)[:, start_col:end_col].tocoo()
+
+    # Only the COO triplets are sent back
+    return end_col - start_col, W_block.data.astype(np.float32), W_block.row.astype(np.int32), \
+           (W_block.col + start_col).astype(np.int32)
+
+
+
+
+class Compute_Similarity_Parallel:
+
+
+    def __init__(self, dataMatrix, n_workers = None, n_blocks_per_worker = 4, use_implementation = "cython", **args):
+        """
+        Computes the similarity on the columns of dataMatrix using multiple processes
+        If it is computed on URM=|users|x|items|, pass the URM as is.
+        If it is computed on ICM=|items|x|features|, pass the ICM transposed.
+
+        The matrix is copied once in shared memory and every worker attaches to it without copying or pickling it.
+        The columns are split in ranges having a similar number of multiply-adds, processed by the workers with
+        a Compute_Similarity object, and the COO triplets of the ranges are concatenated once at the end.
+
+        :param dataMatrix:
+        :param n_workers:               Number of processes, if None all the available cores are used
+        :param n_blocks_per_worker:     Number of column ranges assigned on average to each worker,
+                                        more ranges give a better load balance and a more frequent progress
+        :param use_implementation:      Implementation used by the workers, see Compute_Similarity
+        :param args:                    other args of the similarity, see Compute_Similarity
+        """
+
+        super(Compute_Similarity_Parallel, self).__init__()
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+
+        if n_workers < 1 or n_blocks_per_worker < 1:
+            raise ValueError("Compute_Similarity_Parallel: n_workers and n_blocks_per_worker must be positive integers."
+                             " Passed values were {} and {}".format(n_workers, n_blocks_per_worker))
+
+        if use_implementation not in ["cython", "python", "density"]:
+            raise ValueError("Compute_Similarity_Parallel: value for argument 'use_implementation' not recognized")
+
+        if use_implementation == "density":
+            sparsity = dataMatrix.nnz/max(dataMatrix.shape[0]*dataMatrix.shape[1], 1) if sps.issparse(dataMatrix) else 1.0
+            use_implementation = "python" if sparsity > 0.5 else "cython"
+
+        self.n_columns = dataMatrix.shape[1]
+        self.n_workers = min(n_workers, max(self.n_columns, 1))
+        self.n_blocks_per_worker = n_blocks_per_worker
+        self.use_implementation = use_implementation
+
+        self.similarity_args = args
+        self.TopK = min(args.get("topK", 100), self.n_columns)
+
+        if isinstance(dataMatrix, np.ndarray):
+            dataMatrix = sps.csc_matrix(dataMatrix)
+
+        # The implementations work in float32, sharing it halves the shared memory
+        self.dataMatrix = check_matrix(dataMatrix, 'csc', dtype=np.float32)
+        self.dataMatrix.sort_indices()
+
+
+
+
+    def compute_similarity(self, start_col=None, end_col=None):
+        """
+        Compute the similarity for the given dataset
+        :param self:
+        :param start_col: column to begin with
+        :param end_col: column to stop before, end_col is excluded
+        :return:
+        """
+
+        start_time = time.time()
+
+        start_col_local = 0
+        end_col_local = self.n_columns
+
+        if start_col is not None and start_col>0 and start_col<self.n_columns:
+            start_col_local = start_col
+
+        if end_col is not None and end_col>start_col_local and end_col<self.n_columns:
+            end_col_local = end_col
+
+
+        n_ranges = self.n_workers * self.n_blocks_per_worker
+
+        start_end_col_tuple_list = get_balanced_column_ranges(self.dataMatrix[:, start_col_local:end_col_local], n_ranges)
+        start_end_col_tuple_list = [(start_col_local + start, start_col_local + end) for start, end in start_end_col_tuple_list]
+
+        print("Compute_Similarity_Parallel: computing {} columns with {} workers in {} ranges".format(
+            end_col_local - start_col_local, self.n_workers, len(start_end_col_tuple_list)))
+
+        sys.stdout.flush()
+
+
+        shm_list = []
+        descriptor_list = []
+
+        try:
+
+            for array in [self.dataMatrix.data, self.dataMatrix.indices, self.dataMatrix.indptr]:
+                shm, descriptor = _share_array(array)
+                shm_list.append(shm)
+                descriptor_list.append(descriptor)
+
+            initargs = (*descriptor_list, self.dataMatrix.shape, self.use_implementation, self.similarity_args)
+
+            values_list = []
+            rows_list = []
+            cols_list = []
+
+            processedItems = 0
+            last_print_time = start_time
+
+            with multiprocessing.Pool(processes=self.n_workers, initializer=_worker_init, initargs=initargs) as pool:
+
+                for n_block_columns, values, rows, cols in pool.imap_unordered(_worker_compute_column_range, start_end_col_tuple_list):
+
+                    values_list.append(values)
+                    rows_list.append(rows)
+                    cols_list.append(cols)
+
+                    processedItems += n_block_columns
+
+                    current_time = time.time()
+
+                    if current_time - last_print_time > 30 or processedItems == end_col_local - start_col_local:
+
+                        columnPerSec = processedItems / (current_time - start_time + 1e-9)
+
+                        print("Similarity column {} ( {:2.0f} % ), {:.2f} column/sec, elapsed time {:.2f} min".format(
+                            processedItems, processedItems / (end_col_local - start_col_local) * 100, columnPerSec,
+                            (current_time - start_time) / 60))
+
+                        last_print_time = current_time
+
+                        sys.stdout.flush()
+                        sys.stderr.flush()
+
+        finally:
+
+            for shm in shm_list:
+                shm.close()
+                shm.unlink()
+
+
+        W_sparse = sps.csr_matrix((np.concatenate(values_list), (np.concatenate(rows_list), np.concatenate(cols_list))),
+                                  shape=(self.n_columns, self.n_columns),
+                                  dtype=np.float32)
+
+        if self.TopK == 0:
+            return W_sparse.toarray()
+
+        return W_sparse
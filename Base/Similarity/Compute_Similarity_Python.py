@@ -58,7 +58,12 @@ class Compute_Similarity_Python:
         self.tversky_alpha = tversky_alpha
         self.tversky_beta = tversky_beta
 
-        self.dataMatrix = dataMatrix.copy()
+        # Data is processed in float32 as the output, the norms are accumulated in float64.
+        # Pearson and adjusted cosine center the data in float64 and cast it in compute_similarity
+        if similarity in ["pearson", "adjusted"]:
+            self.dataMatrix = dataMatrix.astype(np.float64)
+        else:
+            self.dataMatrix = dataMatrix.astype(np.float32)
 
         self.adjusted_cosine = False
         self.asymmetric_cosine = False
@@ -104,10 +109,10 @@ class Compute_Similarity_Python:
                                  "Col_weights has {} columns, dataMatrix has {}.".format(len(row_weights), dataMatrix.shape[0]))
 
             self.use_row_weights = True
-            self.row_weights = row_weights.copy()
-            self.row_weights_diag = sps.diags(self.row_weights)
+            self.row_weights = np.array(row_weights)
+            self.row_weights_diag = sps.diags(self.row_weights.astype(np.float32))
 
-            self.dataMatrix_weighted = self.dataMatrix.T.dot(self.row_weights_diag).T
+            self.dataMatrix_weighted = self.dataMatrix.astype(np.float32).T.dot(self.row_weights_diag).T
 
 
 
@@ -120,7 +125,7 @@ class Compute_Similarity_Python:
         :return:
         """
 
-        self.dataMatrix = check_matrix(self.dataMatrix, 'csr')
+        self.dataMatrix = check_matrix(self.dataMatrix, 'csr', dtype=np.float64)
 
 
         interactionsPerRow = np.diff(self.dataMatrix.indptr)
@@ -157,7 +162,7 @@ class Compute_Similarity_Python:
         :return:
         """
 
-        self.dataMatrix = check_matrix(self.dataMatrix, 'csc')
+        self.dataMatrix = check_matrix(self.dataMatrix, 'csc', dtype=np.float64)
 
 
         interactionsPerCol = np.diff(self.dataMatrix.indptr)
@@ -215,10 +220,6 @@ class Compute_Similarity_Python:
         :return:
         """
 
-        values = []
-        rows = []
-        cols = []
-
         start_time = time.time()
         start_time_print_batch = start_time
         processedItems = 0
@@ -234,20 +235,24 @@ class Compute_Similarity_Python:
             self.useOnlyBooleanInteractions()
 
 
-        # We explore the matrix column-wise
-        self.dataMatrix = check_matrix(self.dataMatrix, 'csc')
+        # We explore the matrix column-wise, from now on the data is float32
+        self.dataMatrix = check_matrix(self.dataMatrix, 'csc', dtype=np.float32)
 
 
         # Compute sum of squared values to be used in normalization
-        sumOfSquared = np.array(self.dataMatrix.power(2).sum(axis=0)).ravel()
+        col_ids = np.repeat(np.arange(self.n_columns), np.diff(self.dataMatrix.indptr))
+        sumOfSquared = np.bincount(col_ids, weights=np.square(self.dataMatrix.data, dtype=np.float64), minlength=self.n_columns)
 
         # Tanimoto does not require the square root to be applied
         if not (self.tanimoto_coefficient or self.dice_coefficient or self.tversky_coefficient):
             sumOfSquared = np.sqrt(sumOfSquared)
 
         if self.asymmetric_cosine:
-            sumOfSquared_to_1_minus_alpha = np.power(sumOfSquared, 2 * (1 - self.asymmetric_alpha))
-            sumOfSquared_to_alpha = np.power(sumOfSquared, 2 * self.asymmetric_alpha)
+            sumOfSquared_to_1_minus_alpha = np.power(sumOfSquared, 2 * (1 - self.asymmetric_alpha)).astype(np.float32)
+            sumOfSquared_to_alpha = np.power(sumOfSquared, 2 * self.asymmetric_alpha).astype(np.float32)
+
+        # Denominators are computed in float32 to keep the blocks in float32
+        sumOfSquared = sumOfSquared.astype(np.float32)
 
 
         self.dataMatrix = check_matrix(self.dataMatrix, 'csc')
@@ -264,6 +269,18 @@ class Compute_Similarity_Python:
 
 
 
+        # Data structure to incrementally build sparse matrix
+        # Preinitialize max possible length, TopK elements for each column
+        output_size = (end_col_local - start_col_local)*self.TopK
+        values = np.zeros(output_size, dtype=np.float32)
+        rows = np.zeros(output_size, dtype=np.int32)
+        cols = np.zeros(output_size, dtype=np.int32)
+        sparse_data_pointer = 0
+
+        if self.TopK == 0:
+            W_dense = np.zeros((self.n_columns, self.n_columns), dtype=np.float32)
+
+
         start_col_block = start_col_local
 
         this_block_size = 0
@@ -292,11 +309,7 @@ class Compute_Similarity_Python:
 
             # All data points for a given item
             item_data = self.dataMatrix[:, start_col_block:end_col_block]
-            item_data = item_data.toarray().squeeze()
-
-            # If only 1 feature avoid last dimension to disappear
-            if item_data.ndim == 1:
-                item_data = np.atleast_2d(item_data)
+            item_data = item_data.toarray()
 
             if self.use_row_weights:
                 this_block_weights = self.dataMatrix_weighted.T.dot(item_data)
@@ -306,79 +319,72 @@ class Compute_Similarity_Python:
                 this_block_weights = self.dataMatrix.T.dot(item_data)
 
 
+            # Each column of the block is a column of the similarity, rows are all the items
+            block_col_index = np.arange(start_col_block, end_col_block)
+            this_block_weights[block_col_index, np.arange(this_block_size)] = 0.0
 
-            for col_index_in_block in range(this_block_size):
+            # Apply normalization and shrinkage, ensure denominator != 0
+            if self.normalize:
 
-                if this_block_size == 1:
-                    this_column_weights = this_block_weights
+                if self.asymmetric_cosine:
+                    denominator = np.outer(sumOfSquared_to_1_minus_alpha, sumOfSquared_to_alpha[block_col_index]) + self.shrink + 1e-6
                 else:
-                    this_column_weights = this_block_weights[:,col_index_in_block]
+                    denominator = np.outer(sumOfSquared, sumOfSquared[block_col_index]) + self.shrink + 1e-6
 
+                this_block_weights = np.multiply(this_block_weights, 1 / denominator)
 
-                columnIndex = col_index_in_block + start_col_block
-                this_column_weights[columnIndex] = 0.0
 
-                # Apply normalization and shrinkage, ensure denominator != 0
-                if self.normalize:
+            # Apply the specific denominator for Tanimoto
+            elif self.tanimoto_coefficient:
+                denominator = sumOfSquared[block_col_index] + sumOfSquared[:,None] - this_block_weights + self.shrink + 1e-6
+                this_block_weights = np.multiply(this_block_weights, 1 / denominator)
 
-                    if self.asymmetric_cosine:
-                        denominator = sumOfSquared_to_alpha[columnIndex] * sumOfSquared_to_1_minus_alpha + self.shrink + 1e-6
-                    else:
-                        denominator = sumOfSquared[columnIndex] * sumOfSquared + self.shrink + 1e-6
+            elif self.dice_coefficient:
+                denominator = sumOfSquared[block_col_index] + sumOfSquared[:,None] + self.shrink + 1e-6
+                this_block_weights = np.multiply(this_block_weights, 1 / denominator)
 
-                    this_column_weights = np.multiply(this_column_weights, 1 / denominator)
+            elif self.tversky_coefficient:
+                denominator = this_block_weights + \
+                              (sumOfSquared[block_col_index] - this_block_weights)*self.tversky_alpha + \
+                              (sumOfSquared[:,None] - this_block_weights)*self.tversky_beta + self.shrink + 1e-6
+                this_block_weights = np.multiply(this_block_weights, 1 / denominator)
 
+            # If no normalization or tanimoto is selected, apply only shrink
+            elif self.shrink != 0:
+                this_block_weights = this_block_weights/self.shrink
 
-                # Apply the specific denominator for Tanimoto
-                elif self.tanimoto_coefficient:
-                    denominator = sumOfSquared[columnIndex] + sumOfSquared - this_column_weights + self.shrink + 1e-6
-                    this_column_weights = np.multiply(this_column_weights, 1 / denominator)
 
-                elif self.dice_coefficient:
-                    denominator = sumOfSquared[columnIndex] + sumOfSquared + self.shrink + 1e-6
-                    this_column_weights = np.multiply(this_column_weights, 1 / denominator)
+            if self.TopK == 0:
+                W_dense[:, start_col_block:end_col_block] = this_block_weights
 
-                elif self.tversky_coefficient:
-                    denominator = this_column_weights + \
-                                  (sumOfSquared[columnIndex] - this_column_weights)*self.tversky_alpha + \
-                                  (sumOfSquared - this_column_weights)*self.tversky_beta + self.shrink + 1e-6
-                    this_column_weights = np.multiply(this_column_weights, 1 / denominator)
-
-                # If no normalization or tanimoto is selected, apply only shrink
-                elif self.shrink != 0:
-                    this_column_weights = this_column_weights/self.shrink
-
-
-                #this_column_weights = this_column_weights.toarray().ravel()
-
-                # Sort indices and select TopK
-                # Sorting is done in three steps. Faster then plain np.argsort for higher number of items
-                # - Partition the data to extract the set of relevant items
-                # - Sort only the relevant items
-                # - Get the original item index
-                relevant_items_partition = (-this_column_weights).argpartition(self.TopK-1)[0:self.TopK]
-                relevant_items_partition_sorting = np.argsort(-this_column_weights[relevant_items_partition])
-                top_k_idx = relevant_items_partition[relevant_items_partition_sorting]
+            else:
+                # Select the TopK of all the columns of the block with one partition, the order within
+                # the TopK is irrelevant as the sparse matrix will sort them
+                top_k_idx = np.argpartition(-this_block_weights, self.TopK-1, axis=0)[0:self.TopK]
+                top_k_values = np.take_along_axis(this_block_weights, top_k_idx, axis=0)
 
                 # Incrementally build sparse matrix, do not add zeros
-                notZerosMask = this_column_weights[top_k_idx] != 0.0
+                notZerosMask = top_k_values != 0.0
                 numNotZeros = np.sum(notZerosMask)
 
-                values.extend(this_column_weights[top_k_idx][notZerosMask])
-                rows.extend(top_k_idx[notZerosMask])
-                cols.extend(np.ones(numNotZeros) * columnIndex)
-
-
+                # Transpose to keep the elements of each column contiguous
+                values[sparse_data_pointer:sparse_data_pointer + numNotZeros] = top_k_values.T[notZerosMask.T]
+                rows[sparse_data_pointer:sparse_data_pointer + numNotZeros] = top_k_idx.T[notZerosMask.T]
+                cols[sparse_data_pointer:sparse_data_pointer + numNotZeros] = np.repeat(block_col_index, notZerosMask.sum(axis=0))
 
+                sparse_data_pointer += numNotZeros
 
 
             start_col_block += block_size
 
         # End while on columns
 
-        W_sparse = sps.csr_matrix((values, (rows, cols)),
+        if self.TopK == 0:
+            return W_dense
+
+        W_sparse = sps.csr_matrix((values[:sparse_data_pointer], (rows[:sparse_data_pointer], cols[:sparse_data_pointer])),
                                   shape=(self.n_columns, self.n_columns),
                                   dtype=np.float32)
 
 
-        return W_sparse
\ No newline at end of file
+        return W_sparse
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Similarity.Compute_Similarity import Compute_Similarity
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+
+
+
+def get_recall(W_exact, W_approximate):
+
+    W_exact = sps.csc_matrix(W_exact)
+    W_approximate = sps.csc_matrix(W_approximate)
+
+    n_found = W_exact.multiply(W_approximate != 0).getnnz(axis=0)
+    n_exact = W_exact.getnnz(axis=0)
+
+    return np.mean(n_found[n_exact > 0] / n_exact[n_exact > 0])
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        # Columns belong to clusters and share most of their rows with the columns of the same cluster
+        n_rows, n_columns, n_clusters = 3000, 600, 20
+
+        row_cluster = np.random.randint(n_clusters, size=n_rows)
+        column_cluster = np.random.randint(n_clusters, size=n_columns)
+
+        row_ids = np.repeat(np.arange(n_rows), 10)
+        col_ids = np.array([np.random.choice(np.flatnonzero(column_cluster == row_cluster[row]), 10) for row in range(n_rows)]).ravel()
+
+        self.data_matrix = sps.csr_matrix((np.random.random(len(row_ids)) + 0.5, (row_ids, col_ids)), shape=(n_rows, n_columns))
+
+
+    def test_same_output_format(self):
+
+        for similarity in ["cosine", "jaccard"]:
+
+            W_ann = Compute_Similarity(self.data_matrix, topK=20, shrink=5, similarity=similarity,
+                                       use_implementation="ann", random_seed=0).compute_similarity()
+
+            assert isinstance(W_ann, sps.csr_matrix) and W_ann.dtype == np.float32, "W_ann is not a float32 csr_matrix"
+            assert W_ann.shape == (self.data_matrix.shape[1], self.data_matrix.shape[1]), "W_ann has wrong shape"
+            assert W_ann.getnnz(axis=0).max() <= 20, "W_ann has more than TopK elements in a column"
+            assert W_ann.diagonal().sum() == 0.0, "W_ann contains the diagonal"
+
+
+    def test_recall_and_exact_values(self):
+
+        row_weights = np.random.random(self.data_matrix.shape[0])
+
+        for similarity_args in [{"similarity": "cosine", "row_weights": row_weights},
+                                {"similarity": "asymmetric", "asymmetric_alpha": 0.3},
+                                {"similarity": "jaccard"},
+                                {"similarity": "tversky", "tversky_alpha": 0.2, "tversky_beta": 0.7}]:
+
+            W_exact = Compute_Similarity_Python(self.data_matrix, topK=20, shrink=5, **similarity_args).compute_similarity()
+            W_ann = Compute_Similarity(self.data_matrix, topK=20, shrink=5, use_implementation="ann",
+                                       recall_target=0.99, target_similarity=0.2, random_seed=0, **similarity_args).compute_similarity()
+
+            recall = get_recall(W_exact, W_ann)
+
+            assert recall > 0.9, "W_ann recall for {} is {:.2f}".format(similarity_args["similarity"], recall)
+
+            # Candidates are always scored with the exact similarity
+            W_found = W_ann.multiply(W_exact != 0)
+            assert np.allclose(W_found.toarray(), W_exact.multiply(W_ann != 0).toarray(), atol=1e-6), \
+                "W_ann values not matching W_exact for {}".format(similarity_args["similarity"])
+
+
+    def test_column_range(self):
+
+        W_full = Compute_Similarity(self.data_matrix, topK=15, use_implementation="ann", random_seed=0).compute_similarity()
+        W_range = Compute_Similarity(self.data_matrix, topK=15, use_implementation="ann", random_seed=0).compute_similarity(start_col=50, end_col=120)
+
+        assert np.array_equal(W_full[:,50:120].toarray(), W_range[:,50:120].toarray()), "W_range not matching W_full"
+        assert W_range[:,0:50].nnz == 0 and W_range[:,120:].nnz == 0, "W_range contains columns outside the range"
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, os, json, tempfile
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Similarity.Compute_Similarity import Compute_Similarity
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+import Base.Similarity.Compute_Similarity_Auto as Compute_Similarity_Auto
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        self.data_matrix = sps.random(500, 1000, density=0.02, format="csr", dtype=np.float64)
+        Compute_Similarity_Auto._selected_implementation_cache.clear()
+
+
+    def test_auto_equals_python(self):
+
+        # Binary similarities have many ties, which the implementations may break differently
+        for similarity in ["cosine", "asymmetric"]:
+
+            W_auto = Compute_Similarity(self.data_matrix, topK=20, shrink=5, similarity=similarity, use_implementation="auto").compute_similarity()
+            W_python = Compute_Similarity_Python(self.data_matrix, topK=20, shrink=5, similarity=similarity).compute_similarity()
+
+            assert np.allclose(W_auto.toarray(), W_python.toarray(), atol=1e-5), "W_auto not matching W_python for {}".format(similarity)
+
+
+    def test_selection_args(self):
+
+        # The arguments of the selection and of the parallel implementation are accepted whatever is selected
+        for args in [{"n_sample_columns": 100}, {"n_sample_ranges": 2}, {"n_workers": 2}, {"n_workers": 2, "n_blocks_per_worker": 2}]:
+
+            for use_implementation in ["python", "cython", "parallel"]:
+
+                Compute_Similarity_Auto._selected_implementation_cache.clear()
+                cache_key = Compute_Similarity_Auto._get_cache_key(Compute_Similarity_Auto.get_data_fingerprint(self.data_matrix),
+                                                                   dict(topK=20, similarity="cosine", **args))
+                Compute_Similarity_Auto._selected_implementation_cache[cache_key] = use_implementation
+
+                W_auto = Compute_Similarity(self.data_matrix, topK=20, similarity="cosine", use_implementation="auto", **args).compute_similarity()
+                W_python = Compute_Similarity_Python(self.data_matrix, topK=20, similarity="cosine").compute_similarity()
+
+                assert np.allclose(W_auto.toarray(), W_python.toarray(), atol=1e-5), "W_auto not matching W_python with {} selected".format(use_implementation)
+
+        # The selection itself is measured with the sample arguments
+        W_auto = Compute_Similarity(self.data_matrix, topK=20, use_implementation="auto", n_sample_columns=100, n_sample_ranges=2).compute_similarity()
+        assert W_auto.shape == (1000, 1000)
+
+
+    def test_selection_cache(self):
+
+        cache_file_path = os.path.join(tempfile.mkdtemp(), "similarity_implementation.json")
+
+        use_implementation, _ = Compute_Similarity_Auto.select_similarity_implementation(self.data_matrix, cache_file_path=cache_file_path, topK=20)
+
+        with open(cache_file_path, "r") as cache_file:
+            file_cache = json.load(cache_file)
+
+        assert list(file_cache.values()) == [use_implementation] or (use_implementation == "cython" and list(file_cache.values()) == ["cython_pruned"]), \
+            "Selection not stored in the cache file"
+
+        # The selection is loaded from the file when not in memory
+        Compute_Similarity_Auto._selected_implementation_cache.clear()
+        file_cache = {key: "python" for key in file_cache.keys()}
+
+        with open(cache_file_path, "w") as cache_file:
+            json.dump(file_cache, cache_file)
+
+        use_implementation, _ = Compute_Similarity_Auto.select_similarity_implementation(self.data_matrix, cache_file_path=cache_file_path, topK=20)
+        assert use_implementation == "python", "Selection not loaded from the cache file"
+
+        # A different matrix has a different fingerprint
+        assert Compute_Similarity_Auto.get_data_fingerprint(self.data_matrix) != \
+               Compute_Similarity_Auto.get_data_fingerprint(self.data_matrix*2), "Different matrices have the same fingerprint"
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+from Base.Similarity.Compute_Similarity_Bias_Parametric import Compute_Similarity_Bias_Parametric, similarity_data_top_k
+
+
+
+def get_biased_similarity_Python(data_matrix, ICM_bias, **similarity_args):
+
+    data_matrix = data_matrix.copy()
+    data_matrix.data += ICM_bias
+
+    similarity = Compute_Similarity_Python(data_matrix, **similarity_args)
+
+    return similarity.compute_similarity().toarray()
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        n_features = 300
+        n_items = 200
+
+        self.data_matrix = sps.random(n_features, n_items, density=0.05, format="csc", dtype=np.float64)
+
+
+    def test_cosine_bias_list(self):
+
+        bias_parametric_similarity = Compute_Similarity_Bias_Parametric(self.data_matrix)
+
+        ICM_bias_list = [0.0, 1e-2, 1.0, 1e3]
+        similarity_args = {"topK": 20, "shrink": 5, "normalize": True, "similarity": "cosine"}
+
+        W_sparse_list = bias_parametric_similarity.compute_similarity_bias_list(ICM_bias_list, **similarity_args)
+
+        for ICM_bias, W_sparse in zip(ICM_bias_list, W_sparse_list):
+
+            W_dense_Python = get_biased_similarity_Python(self.data_matrix, ICM_bias, **similarity_args)
+
+            assert np.allclose(W_sparse.toarray(), W_dense_Python, atol=1e-4), \
+                "W_sparse_Bias_Parametric not matching control for bias {}".format(ICM_bias)
+
+
+    def test_asymmetric_cosine(self):
+
+        bias_parametric_similarity = Compute_Similarity_Bias_Parametric(self.data_matrix)
+
+        similarity_args = {"topK": 50, "shrink": 10, "normalize": True, "similarity": "asymmetric", "asymmetric_alpha": 0.3}
+
+        W_sparse = bias_parametric_similarity.compute_similarity(ICM_bias = 2.5, **similarity_args)
+        W_dense_Python = get_biased_similarity_Python(self.data_matrix, 2.5, **similarity_args)
+
+        assert np.allclose(W_sparse.toarray(), W_dense_Python, atol=1e-4), "W_sparse_Bias_Parametric not matching control"
+
+
+    def test_row_weights_no_normalization(self):
+
+        row_weights = np.random.random(self.data_matrix.shape[0])
+
+        bias_parametric_similarity = Compute_Similarity_Bias_Parametric(self.data_matrix, row_weights = row_weights)
+
+        similarity_args = {"topK": 30, "shrink": 3, "normalize": False, "similarity": "cosine"}
+
+        W_sparse = bias_parametric_similarity.compute_similarity(ICM_bias = 0.7, **similarity_args)
+        W_dense_Python = get_biased_similarity_Python(self.data_matrix, 0.7, row_weights = row_weights, **similarity_args)
+
+        assert np.allclose(W_sparse.toarray(), W_dense_Python, atol=1e-4), "W_sparse_Bias_Parametric not matching control"
+
+
+    def test_top_k_ties_lower_index(self):
+
+        n_rows, n_columns, TopK = 50, 40, 5
+
+        # Few distinct values, most columns have ties on their TopK-th value
+        dataMatrix = sps.random(n_rows, n_columns, density=0.4, format="csc", dtype=np.float64)
+        dataMatrix.data = np.random.randint(1, 4, dataMatrix.nnz).astype(np.float64)
+        dataMatrix.sort_indices()
+
+        values, rows, cols = similarity_data_top_k(dataMatrix.data, dataMatrix.indices, dataMatrix.indptr, n_columns, TopK)
+
+        for col in range(n_columns):
+
+            col_data = dataMatrix.data[dataMatrix.indptr[col]:dataMatrix.indptr[col+1]]
+            col_indices = dataMatrix.indices[dataMatrix.indptr[col]:dataMatrix.indptr[col+1]]
+
+            # Decreasing value, increasing index
+            expected_rows = col_indices[np.lexsort((col_indices, -col_data))[:TopK]]
+
+            assert np.array_equal(np.sort(rows[cols == col]), np.sort(expected_rows)), "Ties not broken by lower index in column {}".format(col)
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Similarity.Compute_Similarity import Compute_Similarity
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+
+
+
+def get_delta_matrix(data_matrix, n_changed_rows, n_new_rows):
+
+    n_rows, n_columns = data_matrix.shape
+
+    changed_rows = np.random.choice(n_rows, n_changed_rows, replace=False)
+
+    delta_matrix = sps.random(n_rows + n_new_rows, n_columns, density=0.03, format="lil")
+    unchanged_rows = np.setdiff1d(np.arange(n_rows), changed_rows)
+    delta_matrix[unchanged_rows] = 0
+
+    # One of the changed rows is removed
+    delta_matrix[changed_rows[:1]] = 0
+
+    return sps.csr_matrix(delta_matrix), np.concatenate((changed_rows, np.arange(n_rows, n_rows + n_new_rows)))
+
+
+
+def get_new_data_matrix(data_matrix, delta_matrix, changed_rows):
+
+    new_data_matrix = sps.vstack([data_matrix, sps.csr_matrix((delta_matrix.shape[0] - data_matrix.shape[0], data_matrix.shape[1]))], format="lil")
+    new_data_matrix[changed_rows] = delta_matrix[changed_rows]
+
+    return sps.csr_matrix(new_data_matrix)
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        self.data_matrix = sps.random(800, 300, density=0.03, format="csr", dtype=np.float64)
+
+
+    def test_update_equals_full_recompute(self):
+
+        for similarity in ["cosine", "jaccard"]:
+
+            similarity_object = Compute_Similarity(self.data_matrix, topK=15, shrink=5, similarity=similarity, use_implementation="incremental")
+            similarity_object.compute_similarity()
+
+            data_matrix = self.data_matrix
+
+            for n_changed_rows, n_new_rows in [(5, 0), (20, 10), (0, 3)]:
+
+                delta_matrix, changed_rows = get_delta_matrix(data_matrix, n_changed_rows, n_new_rows)
+                data_matrix = get_new_data_matrix(data_matrix, delta_matrix, changed_rows)
+
+                W_incremental = similarity_object.update_similarity(delta_matrix, changed_rows = changed_rows)
+                W_full = Compute_Similarity(data_matrix, topK=15, shrink=5, similarity=similarity, use_implementation="incremental").compute_similarity()
+
+                assert np.array_equal(W_incremental.toarray(), W_full.toarray()), "W_incremental not matching W_full for {}".format(similarity)
+
+                # Binary similarities have many ties, which the implementations may break differently
+                W_python = Compute_Similarity_Python(data_matrix, topK=15, shrink=5, similarity=similarity).compute_similarity()
+
+                assert np.allclose(np.sort(W_incremental.toarray(), axis=0), np.sort(W_python.toarray(), axis=0), atol=1e-5), \
+                    "W_incremental not matching W_python for {}".format(similarity)
+
+
+    def test_update_requires_incremental(self):
+
+        similarity_object = Compute_Similarity(self.data_matrix, topK=15, use_implementation="python")
+
+        with self.assertRaises(ValueError):
+            similarity_object.update_similarity(self.data_matrix)
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
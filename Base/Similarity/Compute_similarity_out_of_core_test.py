@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, os, tempfile
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+from Base.Similarity.Compute_Similarity_Out_Of_Core import Compute_Similarity_Out_Of_Core, save_data_matrix_npy
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        self.data_matrix = sps.random(1000, 500, density=0.02, format="csr", dtype=np.float64)
+        self.folder_path = tempfile.mkdtemp()
+
+        save_data_matrix_npy(self.data_matrix, self.folder_path)
+
+
+    def test_out_of_core_equals_python(self):
+
+        row_weights = np.random.random(self.data_matrix.shape[0])
+
+        for similarity, similarity_row_weights in [("cosine", row_weights), ("asymmetric", None), ("jaccard", None)]:
+
+            W_python = Compute_Similarity_Python(self.data_matrix, topK=20, shrink=5, similarity=similarity,
+                                                 row_weights=similarity_row_weights).compute_similarity()
+
+            # Small chunks and blocks to test their boundaries
+            W_out_of_core = Compute_Similarity_Out_Of_Core(self.folder_path, topK=20, shrink=5, similarity=similarity, row_weights=similarity_row_weights,
+                                                           max_chunk_work=500, max_block_nnz=1000).compute_similarity()
+
+            assert isinstance(W_out_of_core, sps.csr_matrix) and W_out_of_core.dtype == np.float32, "W_out_of_core is not a float32 csr_matrix"
+
+            # Binary similarities have many ties, which may be broken differently, the values must be the same
+            assert np.allclose(np.sort(W_out_of_core.toarray(), axis=0), np.sort(W_python.toarray(), axis=0), atol=1e-6), \
+                "W_out_of_core not matching W_python for {}".format(similarity)
+
+            if similarity != "jaccard":
+                assert np.allclose(W_out_of_core.toarray(), W_python.toarray(), atol=1e-6), "W_out_of_core not matching W_python for {}".format(similarity)
+
+
+    def test_column_range_and_shards(self):
+
+        similarity = Compute_Similarity_Out_Of_Core(self.data_matrix, topK=15, max_chunk_work=2000)
+
+        W_full = similarity.compute_similarity()
+        W_range = similarity.compute_similarity(start_col=50, end_col=120)
+
+        assert np.array_equal(W_full[:,50:120].toarray(), W_range[:,50:120].toarray()), "W_range not matching W_full"
+        assert W_range[:,0:50].nnz == 0 and W_range[:,120:].nnz == 0, "W_range contains columns outside the range"
+
+        assert not os.path.exists(similarity.shard_folder_path), "Shards not removed"
+        assert not os.path.exists(similarity.folder_path), "Temporary folder not removed"
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
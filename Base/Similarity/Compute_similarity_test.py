@@ -14,6 +14,9 @@ import numpy as np
 import scipy.sparse as sps
 
 from Base.Recommender_utils import similarityMatrixTopK
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+from Base.Similarity.Compute_Similarity_Parallel import Compute_Similarity_Parallel
+from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
 
 
 def areSparseEquals(Sparse1, Sparse2):
@@ -30,21 +33,19 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         TopK = 0
 
         data_matrix = np.array([[1,1,0,1],[0,1,1,1],[1,0,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
         W_dense_Cython = cosine_similarity.compute_similarity()
 
         cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = False)
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -58,23 +59,21 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_row_weighted(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         TopK = 0
 
         data_matrix = np.array([[1,2,0,1],[0,1,4,1],[3,0,1,0]])
-        data_matrix = sps.csr_matrix(data_matrix, dtype=np.float)
+        data_matrix = sps.csr_matrix(data_matrix, dtype=np.float64)
 
         row_weights = [2, 3, 0, 4]
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix.T, topK=TopK, normalize = False, row_weights = row_weights)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix.T, topK=TopK, normalize = False, row_weights = row_weights)
         W_dense_Cython = cosine_similarity.compute_similarity()
 
         cosine_similarity = Compute_Similarity_Python(data_matrix.T, topK=TopK, normalize = False, row_weights = row_weights)
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix.T, topK=TopK, normalize = False, row_weights = row_weights)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix.T, topK=TopK, normalize = False, row_weights = row_weights)
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -90,8 +89,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_external_cfr(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
         from sklearn.metrics.pairwise import cosine_similarity as Cosine_Similarity_Sklearn
 
 
@@ -104,13 +101,13 @@ class MyTestCase(unittest.TestCase):
         data_matrix = np.array([[1,2,0,1],[0,1,4,1],[1,3,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = True, shrink=shrink)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = True, shrink=shrink)
         W_dense_Cython = cosine_similarity.compute_similarity()
 
         cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = True, shrink=shrink)
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = True, shrink=shrink)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = True, shrink=shrink)
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -127,16 +124,16 @@ class MyTestCase(unittest.TestCase):
         data_matrix = sps.csr_matrix(data_matrix)
 
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = True, shrink=shrink,
-                                                     mode='jaccard')
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = True, shrink=shrink,
+                                                     similarity='jaccard')
         W_dense_Cython = cosine_similarity.compute_similarity()
 
         cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = True, shrink=shrink,
-                                                      mode='jaccard')
+                                                      similarity='jaccard')
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = True, shrink=shrink,
-                                                     mode='jaccard')
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = True, shrink=shrink,
+                                                     similarity='jaccard')
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -161,9 +158,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_normalize(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         import numpy.matlib
 
@@ -173,13 +167,13 @@ class MyTestCase(unittest.TestCase):
         data_matrix = np.array([[1,1,0,1],[0,1,1,1],[1,0,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = True, shrink=shrink)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = True, shrink=shrink)
         W_dense_Cython = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = True, shrink=shrink)
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = True, shrink=shrink)
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = True, shrink=shrink)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = True, shrink=shrink)
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -202,9 +196,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_adjusted(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         import numpy.matlib
 
@@ -214,16 +205,16 @@ class MyTestCase(unittest.TestCase):
         data_matrix = np.array([[1,2,0,1],[0,1,4,1],[1,3,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='adjusted')
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='adjusted')
         W_dense_Cython = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='adjusted')
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='adjusted')
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='adjusted')
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='adjusted')
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -251,9 +242,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_pearson(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         import numpy.matlib
 
@@ -263,16 +251,16 @@ class MyTestCase(unittest.TestCase):
         data_matrix = np.array([[1,2,0,1],[0,1,4,1],[1,3,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='pearson')
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='pearson')
         W_dense_Cython = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='pearson')
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='pearson')
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='pearson')
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='pearson')
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -300,9 +288,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_jaccard(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         import numpy.matlib
 
@@ -312,16 +297,16 @@ class MyTestCase(unittest.TestCase):
         data_matrix = np.array([[1,2,0,1],[0,1,4,1],[1,3,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='jaccard')
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='jaccard')
         W_dense_Cython = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='jaccard')
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='jaccard')
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = True,
-                                                     shrink=shrink, mode='jaccard')
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = True,
+                                                     shrink=shrink, similarity='jaccard')
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -346,9 +331,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_dense_big(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         TopK = 0
         n_items = 500
@@ -356,13 +338,13 @@ class MyTestCase(unittest.TestCase):
 
         data_matrix = sps.random(n_users, n_items, density=0.1)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
         W_dense_Cython = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = False)
         W_dense_Python = cosine_similarity.compute_similarity()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
         W_dense_Parallel = cosine_similarity.compute_similarity()
 
 
@@ -376,22 +358,19 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_TopK(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
         TopK=4
 
         data_matrix = np.array([[1,1,0,1],[0,1,1,1],[1,0,1,0]])
         data_matrix = sps.csr_matrix(data_matrix)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
         W_dense_Cython = cosine_similarity.compute_similarity().toarray()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = False)
         W_dense_Python = cosine_similarity.compute_similarity().toarray()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
         W_dense_Parallel = cosine_similarity.compute_similarity().toarray()
 
 
@@ -408,9 +387,6 @@ class MyTestCase(unittest.TestCase):
 
     def test_cosine_similarity_TopK_big(self):
 
-        from Base.Cython.cosine_similarity import Cosine_Similarity as Cosine_Similarity_Cython
-        from Base.cosine_similarity import Compute_Similarity as Cosine_Similarity_Python
-        from Base.cosine_similarity_parallel import Cosine_Similarity_Parallel as Cosine_Similarity_Parallel
 
 
         n_items = 500
@@ -420,13 +396,13 @@ class MyTestCase(unittest.TestCase):
 
         data_matrix = sps.random(n_users, n_items, density=0.1)
 
-        cosine_similarity = Cosine_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Cython(data_matrix, topK=TopK, normalize = False)
         W_dense_Cython = cosine_similarity.compute_similarity().toarray()
 
-        cosine_similarity = Cosine_Similarity_Python(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Python(data_matrix, topK=TopK, normalize = False)
         W_dense_Python = cosine_similarity.compute_similarity().toarray()
 
-        cosine_similarity = Cosine_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
+        cosine_similarity = Compute_Similarity_Parallel(data_matrix, topK=TopK, normalize = False)
         W_dense_Parallel = cosine_similarity.compute_similarity().toarray()
 
         W_dense_mul = data_matrix.T.dot(data_matrix)
@@ -439,6 +415,100 @@ class MyTestCase(unittest.TestCase):
         assert np.allclose(W_dense_Parallel, W_dense_mul, atol=1e-4), "W_dense_Parallel not matching control"
 
 
+    def test_parallel_equals_cython(self):
+
+        np.random.seed(42)
+
+        data_matrix = sps.random(400, 250, density=0.05, format="csr", dtype=np.float64)
+        row_weights = np.random.random(data_matrix.shape[0])
+
+        for similarity_args in [{"similarity": "cosine"},
+                                {"similarity": "cosine", "row_weights": row_weights},
+                                {"similarity": "asymmetric", "asymmetric_alpha": 0.3},
+                                {"similarity": "pearson"},
+                                {"similarity": "adjusted"},
+                                {"similarity": "jaccard"},
+                                {"similarity": "dice"},
+                                {"similarity": "tversky", "tversky_alpha": 0.7, "tversky_beta": 0.4},
+                                {"similarity": "cosine", "prune": True}]:
+
+            for TopK in [0, 20]:
+
+                W_Cython = Compute_Similarity_Cython(data_matrix, topK=TopK, shrink=5, **similarity_args).compute_similarity()
+                W_Parallel = Compute_Similarity_Parallel(data_matrix, topK=TopK, shrink=5, n_workers=3, **similarity_args).compute_similarity()
+
+                if TopK != 0:
+                    W_Cython = W_Cython.toarray()
+                    W_Parallel = W_Parallel.toarray()
+
+                assert np.allclose(W_Cython, W_Parallel, atol=1e-6), \
+                    "W_Parallel not matching W_Cython for {}, TopK {}".format(similarity_args, TopK)
+
+
+    def test_negative_similarity_TopK(self):
+
+        np.random.seed(42)
+
+        data_matrix = sps.random(300, 120, density=0.1, format="csr", dtype=np.float64)
+
+        # Centered similarities are mostly negative, the items not touched rank above them
+        for similarity in ["pearson", "adjusted"]:
+
+            for TopK in [50, 115]:
+
+                W_Cython = Compute_Similarity_Cython(data_matrix, topK=TopK, shrink=0, similarity=similarity).compute_similarity()
+                W_Python = Compute_Similarity_Python(data_matrix, topK=TopK, shrink=0, similarity=similarity).compute_similarity()
+
+                assert np.array_equal(W_Cython.toarray() != 0, W_Python.toarray() != 0), \
+                    "W_Cython pattern not matching W_Python for {}, TopK {}".format(similarity, TopK)
+
+                assert np.allclose(W_Cython.toarray(), W_Python.toarray(), atol=1e-6), \
+                    "W_Cython not matching W_Python for {}, TopK {}".format(similarity, TopK)
+
+
+    def test_cython_no_copy(self):
+
+        np.random.seed(42)
+
+        data_matrix = sps.random(400, 250, density=0.05, format="csc", dtype=np.float32)
+        data_matrix.sort_indices()
+        data_matrix_original = data_matrix.copy()
+
+        for similarity in ["cosine", "pearson", "adjusted", "jaccard"]:
+
+            W_copy = Compute_Similarity_Cython(data_matrix, topK=20, similarity=similarity).compute_similarity()
+            W_no_copy = Compute_Similarity_Cython(data_matrix, topK=20, similarity=similarity, copy=False).compute_similarity()
+
+            assert np.array_equal(W_copy.toarray(), W_no_copy.toarray()), "W_no_copy not matching W_copy for {}".format(similarity)
+            assert np.array_equal(data_matrix.toarray(), data_matrix_original.toarray()), "dataMatrix modified by {}".format(similarity)
+
+
+    def test_centering_before_float32(self):
+
+        np.random.seed(42)
+
+        # The deviations from the average are below the float32 resolution of the values
+        data_matrix = sps.random(300, 100, density=0.2, format="csr", dtype=np.float64)
+        data_matrix.data = 1e5 + data_matrix.data
+
+        for similarity, axis in [("pearson", 0), ("adjusted", 1)]:
+
+            data_centered = data_matrix.toarray()
+            nonzero_mask = data_centered != 0
+            average = data_centered.sum(axis=axis, keepdims=True) / np.maximum(nonzero_mask.sum(axis=axis, keepdims=True), 1)
+            data_centered = np.where(nonzero_mask, data_centered - average, 0.0)
+
+            norms = np.sqrt((data_centered**2).sum(axis=0))
+            W_control = data_centered.T.dot(data_centered) / np.outer(norms, norms)
+            W_control[np.arange(W_control.shape[0]),np.arange(W_control.shape[0])] = 0.0
+
+            W_dense_Python = Compute_Similarity_Python(data_matrix, topK=0, similarity=similarity).compute_similarity()
+            W_dense_Cython = Compute_Similarity_Cython(data_matrix, topK=0, similarity=similarity).compute_similarity()
+
+            assert np.allclose(W_dense_Python, W_control, atol=1e-4), "W_dense_Python {} not matching control".format(similarity)
+            assert np.allclose(W_dense_Cython, W_control, atol=1e-4), "W_dense_Cython {} not matching control".format(similarity)
+
+
 
 
 def runCompilationScript():
@@ -447,7 +517,7 @@ def runCompilationScript():
     # appropriate subfolder and not the project root
 
     compiledModuleSubfolder = "/Cython"
-    fileToCompile = 'cosine_similarity.pyx'
+    fileToCompile = 'Compute_Similarity_Cython.pyx'
 
     command = ['python',
                'compileCython.py',
@@ -21,7 +21,10 @@ cimport numpy as np
 
 from cpython.array cimport array, clone
 
-from libc.math cimport sqrt
+cimport cython
+from cython.parallel import prange, threadid
+
+from libc.math cimport sqrt, pow
 
 
 
@@ -41,13 +44,25 @@ cdef class Compute_Similarity_Cython:
     cdef int TopK
     cdef long n_columns, n_rows
 
-    cdef double[:] this_item_weights
-    cdef int[:] this_item_weights_mask, this_item_weights_id
-    cdef int this_item_weights_counter
+    cdef int n_threads
+
+    # Each thread has its own accumulator, mask and TopK heap, one row per thread
+    cdef double[:,:] this_item_weights
+    cdef int[:,:] this_item_weights_mask, this_item_weights_id
+    cdef int[:] this_item_weights_counter
+
+    cdef double[:,:] top_k_heap_values
+    cdef int[:,:] top_k_heap_ids
+
+    cdef int prune
+    cdef double max_row_weight, max_norm, min_norm, max_value
+    cdef double[:] sumOfValues_weighted
+    cdef double[:,:] this_user_buffer
 
     cdef int[:] user_to_item_row_ptr, user_to_item_cols
     cdef int[:] item_to_user_rows, item_to_user_col_ptr
-    cdef double[:] user_to_item_data, item_to_user_data
+    # Data is stored in float32 as the output, dot products and norms are accumulated in float64
+    cdef float[:] user_to_item_data, item_to_user_data
     cdef double[:] sumOfSquared, sumOfSquared_to_1_minus_alpha, sumOfSquared_to_alpha
     cdef int shrink, normalize, adjusted_cosine, pearson_correlation, tanimoto_coefficient, asymmetric_cosine, dice_coefficient, tversky_coefficient
     cdef float asymmetric_alpha, tversky_alpha, tversky_beta
@@ -55,11 +70,11 @@ cdef class Compute_Similarity_Cython:
     cdef int use_row_weights
     cdef double[:] row_weights
 
-    cdef double[:,:] W_dense
+    cdef float[:,:] W_dense
 
     def __init__(self, dataMatrix, topK = 100, shrink=0, normalize = True,
                  asymmetric_alpha = 0.5, tversky_alpha = 1.0, tversky_beta = 1.0,
-                 similarity = "cosine", row_weights = None):
+                 similarity = "cosine", row_weights = None, n_threads = 1, prune = False, copy = True):
         """
         Computes the cosine similarity on the columns of dataMatrix
         If it is computed on URM=|users|x|items|, pass the URM as is.
@@ -70,6 +85,13 @@ cdef class Compute_Similarity_Cython:
         :param normalize:           If True divide the dot product by the product of the norms
         :param row_weights:         Multiply the values in each row by a specified value. Array
         :param asymmetric_alpha     Coefficient alpha for the asymmetric cosine
+        :param n_threads:           Number of OpenMP threads used to compute the columns, the result does not depend on it
+        :param prune:               If True, for each column stop computing the dot products as soon as upper bounds
+                                    ensure the TopK items are known. Available for "cosine" and "asymmetric" on
+                                    non negative data, the result is the same
+        :param copy:                If False and dataMatrix is a float32 CSC, its buffers are used without copying them,
+                                    only the CSR structure is built. The values are never modified but the indices
+                                    are sorted in place, dataMatrix must not be modified while this object is used
         :param similarity:  "cosine"        computes Cosine similarity
                             "adjusted"      computes Adjusted Cosine, removing the average of the users
                             "asymmetric"    computes Asymmetric Cosine
@@ -131,14 +153,29 @@ cdef class Compute_Similarity_Cython:
                              " Passed value was '{}'".format(similarity))
 
 
+        if n_threads is None or n_threads < 1:
+            raise ValueError("Cosine_Similarity: value for paramether 'n_threads' must be a positive integer."
+                             " Passed value was '{}'".format(n_threads))
+
+        self.n_threads = n_threads
+        self.prune = prune
+
+        if self.prune and not (self.normalize and similarity in ["cosine", "asymmetric"]):
+            raise ValueError("Cosine_Similarity: prune is only available for 'cosine' and 'asymmetric' similarity with normalize = True."
+                             " Passed value was '{}'".format(similarity))
+
         self.TopK = min(topK, self.n_columns)
-        self.this_item_weights = np.zeros(self.n_columns, dtype=np.float64)
-        self.this_item_weights_id = np.zeros(self.n_columns, dtype=np.int32)
-        self.this_item_weights_mask = np.zeros(self.n_columns, dtype=np.int32)
-        self.this_item_weights_counter = 0
+        self.this_item_weights = np.zeros((self.n_threads, self.n_columns), dtype=np.float64)
+        self.this_item_weights_id = np.zeros((self.n_threads, self.n_columns), dtype=np.int32)
+        self.this_item_weights_mask = np.zeros((self.n_threads, self.n_columns), dtype=np.int32)
+        self.this_item_weights_counter = np.zeros(self.n_threads, dtype=np.int32)
 
-        # Copy data to avoid altering the original object
-        dataMatrix = dataMatrix.copy()
+        self.top_k_heap_values = np.zeros((self.n_threads, max(self.TopK, 1)), dtype=np.float64)
+        self.top_k_heap_ids = np.zeros((self.n_threads, max(self.TopK, 1)), dtype=np.int32)
+
+        if copy:
+            # Copy data to avoid altering the original object
+            dataMatrix = dataMatrix.copy()
 
 
 
@@ -149,12 +186,25 @@ cdef class Compute_Similarity_Cython:
         elif self.pearson_correlation:
             dataMatrix = self.applyPearsonCorrelation(dataMatrix)
         elif self.tanimoto_coefficient or self.dice_coefficient or self.tversky_coefficient:
+
+            if not copy:
+                # Only the values are replaced, the new matrix shares the structure of the original one
+                dataMatrix = sps.csc_matrix(dataMatrix, copy=False)
+                dataMatrix = sps.csc_matrix((dataMatrix.data.copy(), dataMatrix.indices, dataMatrix.indptr), shape=dataMatrix.shape, copy=False)
+
             dataMatrix = self.useOnlyBooleanInteractions(dataMatrix)
 
 
 
-        # Compute sum of squared values to be used in normalization
-        self.sumOfSquared = np.array(dataMatrix.power(2).sum(axis=0), dtype=np.float64).ravel()
+        # From now on the data is float32, all the statistics are computed on the float32 values
+        if not (isinstance(dataMatrix, sps.csc_matrix) and dataMatrix.dtype == np.float32):
+            dataMatrix = check_matrix(dataMatrix, 'csc', dtype=np.float32)
+
+        dataMatrix.sort_indices()
+        col_ids = np.repeat(np.arange(self.n_columns), np.diff(dataMatrix.indptr))
+
+        # Compute sum of squared values to be used in normalization, accumulated in float64
+        self.sumOfSquared = np.bincount(col_ids, weights=np.square(dataMatrix.data, dtype=np.float64), minlength=self.n_columns)
 
         # Tanimoto does not require the square root to be applied
         if not (self.tanimoto_coefficient or self.dice_coefficient or self.tversky_coefficient):
@@ -180,25 +230,61 @@ cdef class Compute_Similarity_Cython:
             self.row_weights = np.array(row_weights, dtype=np.float64)
 
 
+        if self.prune:
+
+            # Upper bounds rely on partial dot products never decreasing
+            if (dataMatrix.nnz > 0 and dataMatrix.data.min() < 0) or (self.use_row_weights and np.min(self.row_weights) < 0):
+                raise ValueError("Cosine_Similarity: prune requires non negative data and row_weights")
+
+            self.max_row_weight = 1.0
+
+            if self.use_row_weights:
+                self.max_row_weight = np.max(self.row_weights)
+
+            sumOfSquared_np = np.array(self.sumOfSquared)
+
+            self.max_norm = np.max(sumOfSquared_np, initial=0.0)
+            self.min_norm = np.min(sumOfSquared_np[sumOfSquared_np > 0], initial=self.max_norm)
+            self.max_value = np.max(dataMatrix.data, initial=0.0)
+
+            if self.use_row_weights:
+                self.sumOfValues_weighted = np.bincount(col_ids, weights=dataMatrix.data.astype(np.float64)*np.array(self.row_weights)[dataMatrix.indices],
+                                                        minlength=self.n_columns)
+            else:
+                self.sumOfValues_weighted = np.bincount(col_ids, weights=dataMatrix.data.astype(np.float64), minlength=self.n_columns)
+
+            self.this_user_buffer = np.zeros((self.n_threads, self.n_rows), dtype=np.float64)
+
 
 
 
-        dataMatrix = check_matrix(dataMatrix, 'csr')
 
-        self.user_to_item_row_ptr = dataMatrix.indptr
-        self.user_to_item_cols = dataMatrix.indices
-        self.user_to_item_data = np.array(dataMatrix.data, dtype=np.float64)
+        # The CSR structure is built from the CSC one, which is used as it is
+        dataMatrix_csr = dataMatrix.tocsr()
+
+        self.user_to_item_row_ptr = dataMatrix_csr.indptr
+        self.user_to_item_cols = dataMatrix_csr.indices
+        self.user_to_item_data = dataMatrix_csr.data
 
-        dataMatrix = check_matrix(dataMatrix, 'csc')
         self.item_to_user_rows = dataMatrix.indices
         self.item_to_user_col_ptr = dataMatrix.indptr
-        self.item_to_user_data = np.array(dataMatrix.data, dtype=np.float64)
+        self.item_to_user_data = dataMatrix.data
+
+        if self.prune:
+            # Visit the users of each item starting from the one with fewest interactions, the most
+            # expensive ones are the last and are those skipped when the TopK is already known
+            interactions_per_row = np.diff(self.user_to_item_row_ptr)
+            col_ids = np.repeat(np.arange(self.n_columns), np.diff(dataMatrix.indptr))
+            user_order = np.lexsort((interactions_per_row[dataMatrix.indices], col_ids))
+
+            self.item_to_user_rows = dataMatrix.indices[user_order]
+            self.item_to_user_data = dataMatrix.data[user_order]
 
 
 
 
         if self.TopK == 0:
-            self.W_dense = np.zeros((self.n_columns,self.n_columns))
+            self.W_dense = np.zeros((self.n_columns,self.n_columns), dtype=np.float32)
 
 
 
@@ -231,7 +317,7 @@ cdef class Compute_Similarity_Cython:
         cdef double colAverage
 
 
-        dataMatrix = check_matrix(dataMatrix, 'csc')
+        dataMatrix = check_matrix(dataMatrix, 'csc', dtype=np.float64)
 
 
         sumPerCol = np.array(dataMatrix.sum(axis=0), dtype=np.float64).ravel()
@@ -271,7 +357,7 @@ cdef class Compute_Similarity_Cython:
         cdef long rowIndex, innerIndex, start_pos, end_pos
         cdef double rowAverage
 
-        dataMatrix = check_matrix(dataMatrix, 'csr')
+        dataMatrix = check_matrix(dataMatrix, 'csr', dtype=np.float64)
 
         sumPerRow = np.array(dataMatrix.sum(axis=1), dtype=np.float64).ravel()
         interactionsPerRow = np.diff(dataMatrix.indptr)
@@ -333,22 +419,43 @@ cdef class Compute_Similarity_Cython:
 
 
 
-    cdef computeItemSimilarities(self, long item_id_input):
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void clearItemWeights(self, int thread_id) nogil:
+        """
+        Clean the data structures of thread_id from the previous item
+        """
+
+        cdef long item_index, item_id
+
+        for item_index in range(self.this_item_weights_counter[thread_id]):
+            item_id = self.this_item_weights_id[thread_id, item_index]
+            self.this_item_weights_mask[thread_id, item_id] = False
+            self.this_item_weights[thread_id, item_id] = 0.0
+
+        self.this_item_weights_counter[thread_id] = 0
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void computeItemSimilarities(self, long item_id_input, int thread_id) nogil:
         """
         For every item the cosine similarity against other items depends on whether they have users in common. The more
         common users the higher the similarity.
-        
+
         The basic implementation is:
         - Select the first item
         - Loop through all other items
         -- Given the two items, get the users they have in common
         -- Update the similarity for all common users
-        
+
         That is VERY slow due to the common user part, in which a long data structure is looped multiple times.
-        
+
         A better way is to use the data structure in a different way skipping the search part, getting directly the
         information we need.
-        
+
         The implementation here used is:
         - Select the first item
         - Initialize a zero valued array for the similarities
@@ -356,38 +463,26 @@ cdef class Compute_Similarity_Cython:
         - Loop through the users
         -- Given a user, get the items he rated (second item)
         -- Update the similarity of the items he rated
-        
-        
-        """
-
-        # Create template used to initialize an array with zeros
-        # Much faster than np.zeros(self.n_columns)
-        #cdef array[double] template_zero = array('d')
-        #cdef array[double] result = clone(template_zero, self.n_columns, zero=True)
 
+        The data structures used are the ones of thread_id, so that different threads can process different items
+        """
 
         cdef long user_index, user_id, item_index, item_id, item_id_second
-
-        cdef int[:] users_that_rated_item = self.getUsersThatRatedItem(item_id_input)
-        cdef int[:] items_rated_by_user
+        cdef long user_start_pos, user_end_pos, item_start_pos, item_end_pos
 
         cdef double rating_item_input, rating_item_second, row_weight
 
-        # Clean previous item
-        for item_index in range(self.this_item_weights_counter):
-            item_id = self.this_item_weights_id[item_index]
-            self.this_item_weights_mask[item_id] = False
-            self.this_item_weights[item_id] = 0.0
-
-        self.this_item_weights_counter = 0
+        self.clearItemWeights(thread_id)
 
 
+        user_start_pos = self.item_to_user_col_ptr[item_id_input]
+        user_end_pos = self.item_to_user_col_ptr[item_id_input+1]
 
         # Get users that rated the items
-        for user_index in range(len(users_that_rated_item)):
+        for user_index in range(user_start_pos, user_end_pos):
 
-            user_id = users_that_rated_item[user_index]
-            rating_item_input = self.item_to_user_data[self.item_to_user_col_ptr[item_id_input]+user_index]
+            user_id = self.item_to_user_rows[user_index]
+            rating_item_input = self.item_to_user_data[user_index]
 
             if self.use_row_weights:
                 row_weight = self.row_weights[user_id]
@@ -395,209 +490,578 @@ cdef class Compute_Similarity_Cython:
                 row_weight = 1.0
 
             # Get all items rated by that user
-            items_rated_by_user = self.getItemsRatedByUser(user_id)
+            item_start_pos = self.user_to_item_row_ptr[user_id]
+            item_end_pos = self.user_to_item_row_ptr[user_id+1]
 
-            for item_index in range(len(items_rated_by_user)):
+            for item_index in range(item_start_pos, item_end_pos):
 
-                item_id_second = items_rated_by_user[item_index]
+                item_id_second = self.user_to_item_cols[item_index]
 
                 # Do not compute the similarity on the diagonal
                 if item_id_second != item_id_input:
                     # Increment similairty
-                    rating_item_second = self.user_to_item_data[self.user_to_item_row_ptr[user_id]+item_index]
+                    rating_item_second = self.user_to_item_data[item_index]
 
-                    self.this_item_weights[item_id_second] += rating_item_input*rating_item_second*row_weight
+                    self.this_item_weights[thread_id, item_id_second] += rating_item_input*rating_item_second*row_weight
 
 
                     # Update global data structure
-                    if not self.this_item_weights_mask[item_id_second]:
+                    if not self.this_item_weights_mask[thread_id, item_id_second]:
 
-                        self.this_item_weights_mask[item_id_second] = True
-                        self.this_item_weights_id[self.this_item_weights_counter] = item_id_second
-                        self.this_item_weights_counter += 1
+                        self.this_item_weights_mask[thread_id, item_id_second] = True
+                        self.this_item_weights_id[thread_id, self.this_item_weights_counter[thread_id]] = item_id_second
+                        self.this_item_weights_counter[thread_id] += 1
 
 
 
 
-    def compute_similarity(self, start_col=None, end_col=None):
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void applyItemDenominator(self, long item_id_input, int thread_id) nogil:
         """
-        Compute the similarity for the given dataset
-        :param self:
-        :param start_col: column to begin with
-        :param end_col: column to stop before, end_col is excluded
-        :return:
+        Apply normalization and shrinkage to the similarities of item_id_input, ensure denominator != 0
+        Only the items having a nonzero dot product are considered, all the others have zero similarity
         """
 
-        cdef int print_block_size = 500
+        cdef long item_index, item_id
+        cdef double dot_product
 
-        cdef int itemIndex, innerItemIndex, item_id, local_topK
-        cdef long long topKItemIndex
+        for item_index in range(self.this_item_weights_counter[thread_id]):
 
-        cdef long long[:] top_k_idx
+            item_id = self.this_item_weights_id[thread_id, item_index]
+            dot_product = self.this_item_weights[thread_id, item_id]
 
-        # Declare numpy data type to use vetor indexing and simplify the topK selection code
-        cdef np.ndarray[long, ndim=1] top_k_partition, top_k_partition_sorting
-        cdef np.ndarray[np.float64_t, ndim=1] this_item_weights_np
-        #cdef double[:] this_item_weights
+            if self.normalize:
+                self.this_item_weights[thread_id, item_id] /= self.getNormalizationDenominator(item_id_input, item_id)
 
-        cdef long processedItems = 0
+            # Apply the specific denominator for Tanimoto
+            elif self.tanimoto_coefficient:
+                self.this_item_weights[thread_id, item_id] /= self.sumOfSquared[item_id_input] + self.sumOfSquared[item_id] -\
+                                                              dot_product + self.shrink + 1e-6
 
-        # Data structure to incrementally build sparse matrix
-        # Preinitialize max possible length
-        cdef double[:] values = np.zeros((self.n_columns*self.TopK))
-        cdef int[:] rows = np.zeros((self.n_columns*self.TopK,), dtype=np.int32)
-        cdef int[:] cols = np.zeros((self.n_columns*self.TopK,), dtype=np.int32)
-        cdef long sparse_data_pointer = 0
+            elif self.dice_coefficient:
+                self.this_item_weights[thread_id, item_id] /= self.sumOfSquared[item_id_input] + self.sumOfSquared[item_id] +\
+                                                              self.shrink + 1e-6
 
-        cdef int start_col_local = 0, end_col_local = self.n_columns
+            elif self.tversky_coefficient:
+                self.this_item_weights[thread_id, item_id] /= dot_product + \
+                                                              (self.sumOfSquared[item_id_input]-dot_product)*self.tversky_alpha + \
+                                                              (self.sumOfSquared[item_id]-dot_product)*self.tversky_beta +\
+                                                              self.shrink + 1e-6
 
-        cdef array[double] template_zero = array('d')
+            elif self.shrink != 0:
+                self.this_item_weights[thread_id, item_id] /= self.shrink
 
 
 
-        if start_col is not None and start_col>0 and start_col<self.n_columns:
-            start_col_local = start_col
 
-        if end_col is not None and end_col>start_col_local and end_col<self.n_columns:
-            end_col_local = end_col
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef long topKHeapPush(self, int thread_id, long heap_size, long heap_capacity, double item_weight, long item_id) nogil:
+        """
+        Add an element to the TopK heap of thread_id, whose root is the worst element selected so far
+        :param heap_capacity:   Maximum number of elements kept, at most TopK
+        :return: the new heap size
+        """
 
+        cdef long heap_position, child_position, best_child_position
 
+        if heap_size < heap_capacity:
 
+            # Add as a leaf and sift up while it is worse than its parent
+            heap_position = heap_size
+            heap_size += 1
 
+            while heap_position > 0:
+                child_position = heap_position
+                heap_position = (child_position - 1) // 2
 
+                if is_worse(item_weight, item_id, self.top_k_heap_values[thread_id, heap_position], self.top_k_heap_ids[thread_id, heap_position]):
+                    self.top_k_heap_values[thread_id, child_position] = self.top_k_heap_values[thread_id, heap_position]
+                    self.top_k_heap_ids[thread_id, child_position] = self.top_k_heap_ids[thread_id, heap_position]
+                else:
+                    heap_position = child_position
+                    break
 
-        start_time = time.time()
-        last_print_time = start_time
+            self.top_k_heap_values[thread_id, heap_position] = item_weight
+            self.top_k_heap_ids[thread_id, heap_position] = item_id
 
-        itemIndex = start_col_local
 
-        # Compute all similarities for each item
-        while itemIndex < end_col_local:
+        elif is_worse(self.top_k_heap_values[thread_id, 0], self.top_k_heap_ids[thread_id, 0], item_weight, item_id):
 
-            processedItems += 1
+            # Replace the root and sift down while a child is worse than it
+            heap_position = 0
 
-            # Computed similarities go in self.this_item_weights
-            self.computeItemSimilarities(itemIndex)
+            while True:
+                best_child_position = 2*heap_position + 1
 
+                if best_child_position >= heap_size:
+                    break
 
-            # Apply normalization and shrinkage, ensure denominator != 0
-            if self.normalize:
-                for innerItemIndex in range(self.n_columns):
+                child_position = best_child_position + 1
 
-                    if self.asymmetric_cosine:
-                        self.this_item_weights[innerItemIndex] /= self.sumOfSquared_to_alpha[itemIndex] * self.sumOfSquared_to_1_minus_alpha[innerItemIndex]\
-                                                             + self.shrink + 1e-6
+                if child_position < heap_size and \
+                    is_worse(self.top_k_heap_values[thread_id, child_position], self.top_k_heap_ids[thread_id, child_position],
+                             self.top_k_heap_values[thread_id, best_child_position], self.top_k_heap_ids[thread_id, best_child_position]):
+                    best_child_position = child_position
 
-                    else:
-                        self.this_item_weights[innerItemIndex] /= self.sumOfSquared[itemIndex] * self.sumOfSquared[innerItemIndex]\
-                                                             + self.shrink + 1e-6
+                if is_worse(self.top_k_heap_values[thread_id, best_child_position], self.top_k_heap_ids[thread_id, best_child_position], item_weight, item_id):
+                    self.top_k_heap_values[thread_id, heap_position] = self.top_k_heap_values[thread_id, best_child_position]
+                    self.top_k_heap_ids[thread_id, heap_position] = self.top_k_heap_ids[thread_id, best_child_position]
+                    heap_position = best_child_position
+                else:
+                    break
 
-            # Apply the specific denominator for Tanimoto
-            elif self.tanimoto_coefficient:
-                for innerItemIndex in range(self.n_columns):
-                    self.this_item_weights[innerItemIndex] /= self.sumOfSquared[itemIndex] + self.sumOfSquared[innerItemIndex] -\
-                                                         self.this_item_weights[innerItemIndex] + self.shrink + 1e-6
+            self.top_k_heap_values[thread_id, heap_position] = item_weight
+            self.top_k_heap_ids[thread_id, heap_position] = item_id
 
-            elif self.dice_coefficient:
-                for innerItemIndex in range(self.n_columns):
-                    self.this_item_weights[innerItemIndex] /= self.sumOfSquared[itemIndex] + self.sumOfSquared[innerItemIndex] +\
-                                                         self.shrink + 1e-6
+        return heap_size
 
-            elif self.tversky_coefficient:
-                for innerItemIndex in range(self.n_columns):
-                    self.this_item_weights[innerItemIndex] /= self.this_item_weights[innerItemIndex] + \
-                                                              (self.sumOfSquared[itemIndex]-self.this_item_weights[innerItemIndex])*self.tversky_alpha + \
-                                                              (self.sumOfSquared[innerItemIndex]-self.this_item_weights[innerItemIndex])*self.tversky_beta +\
-                                                              self.shrink + 1e-6
 
-            elif self.shrink != 0:
-                for innerItemIndex in range(self.n_columns):
-                    self.this_item_weights[innerItemIndex] /= self.shrink
 
 
-            if self.TopK == 0:
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef int selectItemTopK(self, long item_id_input, int thread_id,
+                            float[:] values, int[:] rows, int[:] cols, long sparse_data_pointer) nogil:
+        """
+        Select the TopK items among the ones having a nonzero dot product and write them, zeros excluded,
+        in values, rows, cols starting from sparse_data_pointer.
+        The selection uses a heap of size TopK whose root is the worst element selected so far. Ties are broken
+        in favour of the lower item index, therefore the result does not depend on the order items are visited.
+        The items not touched, item_id_input included, have similarity zero and rank above the negative ones. As in
+        a TopK over all the columns, the negative similarities only take the positions the others leave free.
+
+        :return: number of elements written
+        """
+
+        cdef long item_index, item_id, heap_size = 0
+        cdef long heap_position, n_negative = 0, n_negative_selected
+        cdef double item_weight
+        cdef int n_written = 0
+
+        for item_index in range(self.this_item_weights_counter[thread_id]):
+
+            item_id = self.this_item_weights_id[thread_id, item_index]
+            item_weight = self.this_item_weights[thread_id, item_id]
+
+            if item_weight < 0.0:
+                n_negative += 1
+            else:
+                heap_size = self.topKHeapPush(thread_id, heap_size, self.TopK, item_weight, item_id)
+
+
+        # Incrementally build sparse matrix, do not add zeros
+        for heap_position in range(heap_size):
+
+            if self.top_k_heap_values[thread_id, heap_position] != 0.0:
+
+                values[sparse_data_pointer + n_written] = self.top_k_heap_values[thread_id, heap_position]
+                rows[sparse_data_pointer + n_written] = self.top_k_heap_ids[thread_id, heap_position]
+                cols[sparse_data_pointer + n_written] = item_id_input
+
+                n_written += 1
+
+
+        n_negative_selected = self.TopK - (self.n_columns - n_negative)
+
+        if n_negative_selected > 0:
+
+            heap_size = 0
+
+            for item_index in range(self.this_item_weights_counter[thread_id]):
+
+                item_id = self.this_item_weights_id[thread_id, item_index]
+                item_weight = self.this_item_weights[thread_id, item_id]
+
+                if item_weight < 0.0:
+                    heap_size = self.topKHeapPush(thread_id, heap_size, n_negative_selected, item_weight, item_id)
+
+            for heap_position in range(heap_size):
+
+                values[sparse_data_pointer + n_written] = self.top_k_heap_values[thread_id, heap_position]
+                rows[sparse_data_pointer + n_written] = self.top_k_heap_ids[thread_id, heap_position]
+                cols[sparse_data_pointer + n_written] = item_id_input
+
+                n_written += 1
+
+        return n_written
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double getNormalizationDenominator(self, long item_id_input, long item_id) nogil:
+
+        if self.asymmetric_cosine:
+            return self.sumOfSquared_to_alpha[item_id_input] * self.sumOfSquared_to_1_minus_alpha[item_id] + self.shrink + 1e-6
+
+        return self.sumOfSquared[item_id_input] * self.sumOfSquared[item_id] + self.shrink + 1e-6
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double getMinNormalizationDenominator(self, long item_id_input) nogil:
+        """
+        Lowest denominator item_id_input can have with any other item having a nonzero norm
+        """
+
+        if self.asymmetric_cosine:
+            return self.sumOfSquared_to_alpha[item_id_input] * pow(self.min_norm, 2 * (1 - self.asymmetric_alpha)) + self.shrink + 1e-6
+
+        return self.sumOfSquared[item_id_input] * self.min_norm + self.shrink + 1e-6
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double getUntouchedUpperBound(self, long item_id_input, double remaining_norm, double remaining_dot_product) nogil:
+        """
+        Upper bound of the similarity of item_id_input with an item whose dot product is still zero.
+        That dot product is at most remaining_norm times the norm of the item (Cauchy-Schwarz) and at most
+        remaining_dot_product, each bound is maximized over all the possible norms
+        """
+
+        cdef double shrink_term = self.shrink + 1e-6
+        cdef double norm_coefficient, norm_exponent, best_norm = self.max_norm
+        cdef double cauchy_schwarz_bound, dot_product_bound
+
+        if not self.asymmetric_cosine:
+            # remaining_norm*n / (norm_input*n + shrink) is increasing in n
+            cauchy_schwarz_bound = remaining_norm*best_norm / (self.sumOfSquared[item_id_input]*best_norm + shrink_term)
+            dot_product_bound = remaining_dot_product / (self.sumOfSquared[item_id_input]*self.min_norm + shrink_term)
+
+            return min(cauchy_schwarz_bound, dot_product_bound)
+
+        norm_coefficient = self.sumOfSquared_to_alpha[item_id_input]
+        norm_exponent = 2 * (1 - self.asymmetric_alpha)
+
+        # remaining_norm*n / (norm_coefficient*n^norm_exponent + shrink) is increasing in n if norm_exponent <= 1,
+        # otherwise it has its maximum in (shrink / (norm_coefficient*(norm_exponent-1)))^(1/norm_exponent)
+        if norm_exponent > 1:
+            best_norm = min(pow(shrink_term / (norm_coefficient*(norm_exponent-1)), 1/norm_exponent), self.max_norm)
+
+        cauchy_schwarz_bound = remaining_norm*best_norm / (norm_coefficient*pow(best_norm, norm_exponent) + shrink_term)
+        dot_product_bound = remaining_dot_product / (norm_coefficient*pow(self.min_norm, norm_exponent) + shrink_term)
+
+        return min(cauchy_schwarz_bound, dot_product_bound)
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef int checkItemPruning(self, long item_id_input, int thread_id, double remaining_norm, double remaining_dot_product) nogil:
+        """
+        Checks whether the TopK items of item_id_input are already known, given the partial dot products in
+        this_item_weights and the part of item_id_input not processed yet.
+        Data and row weights are non negative, so each partial similarity is a lower bound of the final one.
+        The remaining part of a dot product is at most remaining_norm times the norm of the item (Cauchy-Schwarz)
+        and at most remaining_dot_product, the weighted sum of the remaining values times the maximum value.
+        The TopK is known if the TopK lower bounds are higher than the upper bound of every other item.
+        If so, the TopK items are left in the heap of thread_id
+
+        :return: True if the TopK is known
+        """
+
+        cdef long item_index, item_id, heap_size = 0, heap_position
+        cdef double dot_product, threshold, upper_bound
+        cdef int is_top_k_known = True
+
+        for item_index in range(self.this_item_weights_counter[thread_id]):
+
+            item_id = self.this_item_weights_id[thread_id, item_index]
+            heap_size = self.topKHeapPush(thread_id, heap_size, self.TopK,
+                                          self.this_item_weights[thread_id, item_id] / self.getNormalizationDenominator(item_id_input, item_id),
+                                          item_id)
+
+        if heap_size < self.TopK:
+            return False
+
+        threshold = self.top_k_heap_values[thread_id, 0] * (1 - PRUNE_TOLERANCE)
+
+        if self.getUntouchedUpperBound(item_id_input, remaining_norm, remaining_dot_product) * (1 + PRUNE_TOLERANCE) >= threshold:
+            return False
+
+        # Flag the items in the heap, then check the upper bound of all the others
+        for heap_position in range(heap_size):
+            self.this_item_weights_mask[thread_id, self.top_k_heap_ids[thread_id, heap_position]] = 2
+
+        for item_index in range(self.this_item_weights_counter[thread_id]):
+
+            item_id = self.this_item_weights_id[thread_id, item_index]
+
+            if self.this_item_weights_mask[thread_id, item_id] == 2:
+                continue
+
+            dot_product = self.this_item_weights[thread_id, item_id]
+            upper_bound = (dot_product + min(remaining_norm*self.sumOfSquared[item_id], remaining_dot_product)) / \
+                          self.getNormalizationDenominator(item_id_input, item_id)
+
+            if upper_bound * (1 + PRUNE_TOLERANCE) >= threshold:
+                is_top_k_known = False
+                break
 
-                for innerItemIndex in range(self.n_columns):
-                    self.W_dense[innerItemIndex,itemIndex] = self.this_item_weights[innerItemIndex]
+        for heap_position in range(heap_size):
+            self.this_item_weights_mask[thread_id, self.top_k_heap_ids[thread_id, heap_position]] = True
 
+        return is_top_k_known
+
+
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef int computeItemTopKPruned(self, long item_id_input, int thread_id,
+                                   float[:] values, int[:] rows, int[:] cols, long sparse_data_pointer) nogil:
+        """
+        Computes the dot products as computeItemSimilarities does, but periodically checks whether the TopK items
+        are already known. Users are visited from the one with fewest interactions, so the most expensive ones are
+        the last and are skipped when the check succeeds.
+        The dot products of the TopK items are then completed using only their own users and written, normalized,
+        in values, rows, cols starting from sparse_data_pointer.
+
+        :return: number of elements written, -1 if the TopK was not known before the last user, in which case
+                this_item_weights contains the complete dot products
+        """
+
+        cdef long user_index, user_id, item_index, item_id, item_id_second, heap_position, item_user_index
+        cdef long user_start_pos, user_end_pos, item_start_pos, item_end_pos
+        cdef long work_since_check = 0, check_interval = self.TopK
+        cdef double rating_item_input, rating_item_second, row_weight, item_weight
+        cdef double remaining_sum_of_squared, tolerance_sum_of_squared, remaining_norm
+        cdef double remaining_sum_of_values, tolerance_sum_of_values, remaining_dot_product, processed_dot_product
+        cdef int n_written = 0
+
+        self.clearItemWeights(thread_id)
+
+        user_start_pos = self.item_to_user_col_ptr[item_id_input]
+        user_end_pos = self.item_to_user_col_ptr[item_id_input+1]
+
+        remaining_sum_of_squared = self.sumOfSquared[item_id_input] * self.sumOfSquared[item_id_input]
+
+        remaining_sum_of_values = self.sumOfValues_weighted[item_id_input]
+
+        # Absolute margin against the rounding of the incremental subtraction
+        tolerance_sum_of_squared = remaining_sum_of_squared * PRUNE_TOLERANCE
+        tolerance_sum_of_values = remaining_sum_of_values * PRUNE_TOLERANCE
+
+        for user_index in range(user_start_pos, user_end_pos):
+
+            user_id = self.item_to_user_rows[user_index]
+            rating_item_input = self.item_to_user_data[user_index]
+
+            if self.use_row_weights:
+                row_weight = self.row_weights[user_id]
             else:
+                row_weight = 1.0
+
+            item_start_pos = self.user_to_item_row_ptr[user_id]
+            item_end_pos = self.user_to_item_row_ptr[user_id+1]
+
+            for item_index in range(item_start_pos, item_end_pos):
+
+                item_id_second = self.user_to_item_cols[item_index]
+
+                # Do not compute the similarity on the diagonal
+                if item_id_second != item_id_input:
+                    rating_item_second = self.user_to_item_data[item_index]
 
-                # Sort indices and select TopK
-                # Using numpy implies some overhead, unfortunately the plain C qsort function is even slower
-                #top_k_idx = np.argsort(this_item_weights) [-self.TopK:]
+                    self.this_item_weights[thread_id, item_id_second] += rating_item_input*rating_item_second*row_weight
 
-                # Sorting is done in three steps. Faster then plain np.argsort for higher number of items
-                # because we avoid sorting elements we already know we don't care about
-                # - Partition the data to extract the set of TopK items, this set is unsorted
-                # - Sort only the TopK items, discarding the rest
-                # - Get the original item index
-                #
+                    if not self.this_item_weights_mask[thread_id, item_id_second]:
 
+                        self.this_item_weights_mask[thread_id, item_id_second] = True
+                        self.this_item_weights_id[thread_id, self.this_item_weights_counter[thread_id]] = item_id_second
+                        self.this_item_weights_counter[thread_id] += 1
 
 
-                #this_item_weights_np = clone(template_zero, self.this_item_weights_counter, zero=False)
-                this_item_weights_np = np.zeros(self.n_columns, dtype=np.float64)
+            work_since_check += item_end_pos - item_start_pos
+            remaining_sum_of_squared -= rating_item_input*rating_item_input
+            remaining_sum_of_values -= rating_item_input*row_weight
 
-                # Add weights in the same ordering as the self.this_item_weights_id data structure
-                for innerItemIndex in range(self.this_item_weights_counter):
-                    item_id = self.this_item_weights_id[innerItemIndex]
-                    this_item_weights_np[innerItemIndex] = - self.this_item_weights[item_id]
+            # The check requires a pass on the items seen so far, do it only after an equivalent amount of work.
+            # The interval doubles after every failed check, so that checks cost at most a fraction of the work
+            if user_index + 1 < user_end_pos and self.this_item_weights_counter[thread_id] >= self.TopK and \
+                work_since_check >= check_interval and work_since_check >= self.this_item_weights_counter[thread_id]:
 
+                work_since_check = 0
+                check_interval = 2*max(check_interval, self.this_item_weights_counter[thread_id])
 
-                local_topK = min([self.TopK, self.this_item_weights_counter])
+                if remaining_sum_of_squared < 0.0:
+                    remaining_sum_of_squared = 0.0
 
-                # Get the unordered set of topK items
-                top_k_partition = np.argpartition(this_item_weights_np, local_topK-1)[0:local_topK]
-                # Sort only the elements in the partition
-                top_k_partition_sorting = np.argsort(this_item_weights_np[top_k_partition])
-                # Get original index
-                top_k_idx = top_k_partition[top_k_partition_sorting]
+                if remaining_sum_of_values < 0.0:
+                    remaining_sum_of_values = 0.0
 
+                remaining_norm = sqrt(remaining_sum_of_squared + tolerance_sum_of_squared) * self.max_row_weight
+                remaining_dot_product = (remaining_sum_of_values + tolerance_sum_of_values) * self.max_value
 
+                # No partial dot product can exceed processed_dot_product, if even that is not enough to
+                # beat the items not seen yet the check would fail and it is skipped
+                processed_dot_product = (self.sumOfValues_weighted[item_id_input] - remaining_sum_of_values) * self.max_value
 
-                # Incrementally build sparse matrix, do not add zeros
-                for innerItemIndex in range(len(top_k_idx)):
+                if self.getUntouchedUpperBound(item_id_input, remaining_norm, remaining_dot_product) * (1 + PRUNE_TOLERANCE) < \
+                    processed_dot_product / self.getMinNormalizationDenominator(item_id_input) and \
+                    self.checkItemPruning(item_id_input, thread_id, remaining_norm, remaining_dot_product):
 
-                    topKItemIndex = top_k_idx[innerItemIndex]
+                    # Scatter the users not processed yet, then complete the dot product of the TopK items
+                    for item_user_index in range(user_index + 1, user_end_pos):
 
-                    item_id = self.this_item_weights_id[topKItemIndex]
+                        user_id = self.item_to_user_rows[item_user_index]
 
-                    if self.this_item_weights[item_id] != 0.0:
+                        if self.use_row_weights:
+                            self.this_user_buffer[thread_id, user_id] = self.item_to_user_data[item_user_index] * self.row_weights[user_id]
+                        else:
+                            self.this_user_buffer[thread_id, user_id] = self.item_to_user_data[item_user_index]
 
-                        values[sparse_data_pointer] = self.this_item_weights[item_id]
-                        rows[sparse_data_pointer] = item_id
-                        cols[sparse_data_pointer] = itemIndex
 
-                        sparse_data_pointer += 1
+                    for heap_position in range(self.TopK):
 
+                        item_id = self.top_k_heap_ids[thread_id, heap_position]
+                        item_weight = self.this_item_weights[thread_id, item_id]
 
-            itemIndex += 1
+                        for item_user_index in range(self.item_to_user_col_ptr[item_id], self.item_to_user_col_ptr[item_id+1]):
+                            item_weight += self.item_to_user_data[item_user_index] * \
+                                           self.this_user_buffer[thread_id, self.item_to_user_rows[item_user_index]]
 
+                        item_weight /= self.getNormalizationDenominator(item_id_input, item_id)
 
-            if processedItems % print_block_size==0 or processedItems==end_col_local:
+                        if item_weight != 0.0:
+
+                            values[sparse_data_pointer + n_written] = item_weight
+                            rows[sparse_data_pointer + n_written] = item_id
+                            cols[sparse_data_pointer + n_written] = item_id_input
+
+                            n_written += 1
+
+
+                    for item_user_index in range(user_index + 1, user_end_pos):
+                        self.this_user_buffer[thread_id, self.item_to_user_rows[item_user_index]] = 0.0
+
+                    return n_written
+
+        return -1
 
-                current_time = time.time()
 
-                # Set block size to the number of items necessary in order to print every 30 seconds
-                if current_time - start_time != 0:
-                    itemPerSec = processedItems/(current_time - start_time)
+
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def compute_similarity(self, start_col=None, end_col=None):
+        """
+        Compute the similarity for the given dataset
+        Columns are processed in blocks, the columns of a block are distributed among n_threads threads, each one
+        writing the TopK of its columns in a preallocated slice of the output.
+        :param self:
+        :param start_col: column to begin with
+        :param end_col: column to stop before, end_col is excluded
+        :return:
+        """
+
+        cdef long print_block_size = 500*self.n_threads
+
+        cdef long itemIndex, innerItemIndex, item_id, block_start_col, block_end_col
+        cdef int thread_id, n_written
+
+        cdef long n_pruned = 0
+
+        cdef long processedItems = 0
+
+        cdef int start_col_local = 0, end_col_local = self.n_columns
+
+        if start_col is not None and start_col>0 and start_col<self.n_columns:
+            start_col_local = start_col
+
+        if end_col is not None and end_col>start_col_local and end_col<self.n_columns:
+            end_col_local = end_col
+
+
+        # Data structure to incrementally build sparse matrix
+        # Preinitialize max possible length, each column has its own slice of TopK elements
+        cdef long output_size = (end_col_local - start_col_local)*self.TopK
+        cdef float[:] values = np.zeros(output_size, dtype=np.float32)
+        cdef int[:] rows = np.zeros(output_size, dtype=np.int32)
+        cdef int[:] cols = np.zeros(output_size, dtype=np.int32)
+        cdef int[:] column_nnz = np.zeros(end_col_local - start_col_local, dtype=np.int32)
+
+
+
+        start_time = time.time()
+        last_print_time = start_time
+
+        block_start_col = start_col_local
+
+        # Compute all similarities for each item
+        while block_start_col < end_col_local:
+
+            block_end_col = min(block_start_col + print_block_size, end_col_local)
+
+            for itemIndex in prange(block_start_col, block_end_col, nogil=True, schedule='dynamic', num_threads=self.n_threads):
+
+                thread_id = threadid()
+                n_written = -1
+
+                # Computed similarities go in self.this_item_weights[thread_id]
+                if self.prune and self.TopK != 0:
+                    n_written = self.computeItemTopKPruned(itemIndex, thread_id, values, rows, cols,
+                                                           (itemIndex - start_col_local)*self.TopK)
+                else:
+                    self.computeItemSimilarities(itemIndex, thread_id)
+
+                if n_written >= 0:
+                    column_nnz[itemIndex - start_col_local] = n_written
+                    n_pruned += 1
+
                 else:
-                    itemPerSec = 1
 
-                print_block_size = int(itemPerSec*30)
+                    self.applyItemDenominator(itemIndex, thread_id)
+
+                    if self.TopK == 0:
+
+                        for innerItemIndex in range(self.this_item_weights_counter[thread_id]):
+                            item_id = self.this_item_weights_id[thread_id, innerItemIndex]
+                            self.W_dense[item_id,itemIndex] = self.this_item_weights[thread_id, item_id]
+
+                    else:
+                        column_nnz[itemIndex - start_col_local] = self.selectItemTopK(itemIndex, thread_id, values, rows, cols,
+                                                                                      (itemIndex - start_col_local)*self.TopK)
 
-                if current_time - last_print_time > 30  or processedItems==end_col_local:
 
-                    print("Similarity column {} ( {:2.0f} % ), {:.2f} column/sec, elapsed time {:.2f} min".format(
-                        processedItems, processedItems*1.0/(end_col_local-start_col_local)*100, itemPerSec, (time.time()-start_time) / 60))
+            processedItems += block_end_col - block_start_col
+            block_start_col = block_end_col
 
-                    last_print_time = current_time
 
-                    sys.stdout.flush()
-                    sys.stderr.flush()
+            current_time = time.time()
+
+            # Set block size to the number of items necessary in order to print every 30 seconds
+            if current_time - start_time != 0:
+                itemPerSec = processedItems/(current_time - start_time)
+            else:
+                itemPerSec = 1
+
+            print_block_size = max(int(itemPerSec*30), self.n_threads)
+
+            if current_time - last_print_time > 30  or block_start_col==end_col_local:
+
+                print("Similarity column {} ( {:2.0f} % ), {:.2f} column/sec, elapsed time {:.2f} min".format(
+                    processedItems, processedItems*1.0/(end_col_local-start_col_local)*100, itemPerSec, (time.time()-start_time) / 60))
+
+                last_print_time = current_time
+
+                sys.stdout.flush()
+                sys.stderr.flush()
 
         # End while on columns
 
+        if self.prune:
+            print("Similarity columns pruned {} ( {:2.0f} % )".format(
+                n_pruned, n_pruned*1.0/max(end_col_local-start_col_local, 1)*100))
+
 
         if self.TopK == 0:
 
@@ -605,11 +1069,15 @@ cdef class Compute_Similarity_Cython:
 
         else:
 
-            values = np.array(values[0:sparse_data_pointer])
-            rows = np.array(rows[0:sparse_data_pointer])
-            cols = np.array(cols[0:sparse_data_pointer])
+            # Keep only the filled positions of each column slice
+            filled_mask = np.arange(self.TopK) < np.array(column_nnz)[:,None]
+            filled_mask = filled_mask.ravel()
 
-            W_sparse = sps.csr_matrix((values, (rows, cols)),
+            values_np = np.array(values)[filled_mask]
+            rows_np = np.array(rows)[filled_mask]
+            cols_np = np.array(cols)[filled_mask]
+
+            W_sparse = sps.csr_matrix((values_np, (rows_np, cols_np)),
                                     shape=(self.n_columns, self.n_columns),
                                     dtype=np.float32)
 
@@ -618,6 +1086,19 @@ cdef class Compute_Similarity_Cython:
 
 
 
+# Relative margin used in the pruning bounds against rounding errors
+cdef double PRUNE_TOLERANCE = 1e-9
+
+
+cdef inline bint is_worse(double value_a, long id_a, double value_b, long id_b) nogil:
+    """
+    Returns True if element a should be ranked after element b, ties are broken in favour of the lower index
+    """
+    return value_a < value_b or (value_a == value_b and id_a > id_b)
+
+
+
+
 
 def cosine_common(X):
     """
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest
+
+import numpy as np
+import scipy.sparse as sps
+
+from Base.Similarity.Compute_Similarity_Python import Compute_Similarity_Python
+
+
+# Command to run compilation script
+# python compileCython.py Compute_Similarity_Cython.pyx build_ext --inplace
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        self.data_matrix = sps.random(400, 250, density=0.05, format="csr", dtype=np.float64)
+
+        self.data_matrix_boolean = self.data_matrix.copy()
+        self.data_matrix_boolean.data = np.ones_like(self.data_matrix_boolean.data)
+
+
+    def test_multithreaded_equals_serial(self):
+
+        from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+
+        for similarity in ["cosine", "asymmetric", "pearson", "adjusted", "jaccard", "dice", "tversky"]:
+
+            if similarity in ["jaccard", "dice", "tversky"]:
+                data_matrix = self.data_matrix_boolean
+            else:
+                data_matrix = self.data_matrix
+
+            for TopK in [0, 10]:
+
+                W_serial = Compute_Similarity_Cython(data_matrix, topK=TopK, shrink=5, similarity=similarity, n_threads=1).compute_similarity()
+                W_parallel = Compute_Similarity_Cython(data_matrix, topK=TopK, shrink=5, similarity=similarity, n_threads=4).compute_similarity()
+
+                if TopK != 0:
+                    W_serial = W_serial.toarray()
+                    W_parallel = W_parallel.toarray()
+
+                assert np.array_equal(W_serial, W_parallel), "W_parallel not matching W_serial for {}, TopK {}".format(similarity, TopK)
+
+
+    def test_multithreaded_equals_python(self):
+
+        from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+
+        row_weights = np.random.random(self.data_matrix.shape[0])
+
+        for similarity, similarity_row_weights in [("cosine", row_weights), ("asymmetric", row_weights),
+                                                   ("pearson", None), ("adjusted", None)]:
+
+            W_parallel = Compute_Similarity_Cython(self.data_matrix, topK=20, shrink=5, similarity=similarity,
+                                                   row_weights=similarity_row_weights, n_threads=3).compute_similarity()
+
+            W_python = Compute_Similarity_Python(self.data_matrix, topK=20, shrink=5, similarity=similarity,
+                                                 row_weights=similarity_row_weights).compute_similarity()
+
+            assert np.allclose(W_parallel.toarray(), W_python.toarray(), atol=1e-5), "W_parallel not matching W_python for {}".format(similarity)
+
+
+    def test_multithreaded_column_range(self):
+
+        from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+
+        W_full = Compute_Similarity_Cython(self.data_matrix, topK=15, n_threads=2).compute_similarity()
+        W_range = Compute_Similarity_Cython(self.data_matrix, topK=15, n_threads=2).compute_similarity(start_col=50, end_col=120)
+
+        assert np.array_equal(W_full[:,50:120].toarray(), W_range[:,50:120].toarray()), "W_range not matching W_full"
+        assert W_range[:,0:50].nnz == 0 and W_range[:,120:].nnz == 0, "W_range contains columns outside the range"
+
+
+    def test_pruned_equals_exhaustive(self):
+
+        from Base.Similarity.Cython.Compute_Similarity_Cython import Compute_Similarity_Cython
+
+        # Long tail data, few users interact with many items
+        n_rows, n_columns = 2000, 300
+        row_ids = np.random.zipf(1.5, size=20000) % n_rows
+        col_ids = np.random.zipf(1.3, size=20000) % n_columns
+
+        data_matrix = sps.csr_matrix((np.random.random(len(row_ids)) + 0.1, (row_ids, col_ids)), shape=(n_rows, n_columns))
+        row_weights = np.random.random(n_rows)
+
+        for similarity_args in [{"similarity": "cosine", "shrink": 0},
+                                {"similarity": "cosine", "shrink": 100, "row_weights": row_weights},
+                                {"similarity": "asymmetric", "shrink": 20, "asymmetric_alpha": 0.2},
+                                {"similarity": "asymmetric", "shrink": 20, "asymmetric_alpha": 0.8}]:
+
+            for TopK in [1, 5, 50]:
+
+                W_exhaustive = Compute_Similarity_Cython(data_matrix, topK=TopK, **similarity_args).compute_similarity()
+                W_pruned = Compute_Similarity_Cython(data_matrix, topK=TopK, prune=True, n_threads=2, **similarity_args).compute_similarity()
+
+                assert np.allclose(W_exhaustive.toarray(), W_pruned.toarray(), atol=1e-6), \
+                    "W_pruned not matching W_exhaustive for {}, TopK {}".format(similarity_args["similarity"], TopK)
+
+
+        with self.assertRaises(ValueError):
+            Compute_Similarity_Cython(data_matrix, topK=5, similarity="pearson", prune=True)
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
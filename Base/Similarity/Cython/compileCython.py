@@ -34,9 +34,11 @@ del sys.argv[1]
 extensionName = re.sub("\.pyx", "", fileToCompile)
 
 
+# OpenMP is required by the prange loops, without it they run on a single thread
 ext_modules = Extension(extensionName,
                 [fileToCompile],
-                extra_compile_args=['-O3'],
+                extra_compile_args=['-O3', '-fopenmp'],
+                extra_link_args=['-fopenmp'],
                 include_dirs=[numpy.get_include(),],
                 )
 
@@ -8,6 +8,9 @@ Created on 16/09/2017
 
 import pickle
 import numpy as np
+import scipy.sparse as sps
+
+from Base.Recommender_utils import check_matrix, get_available_memory_MB
 
 
 
@@ -17,15 +20,70 @@ class SimilarityMatrixRecommender(object):
     bot for user-based and Item-based models as well as a function to save the W_matrix
     """
 
+    # With sparse_weights = "auto" the similarity is stored as a dense W if it has at most DENSE_WEIGHTS_MAX_SIZE rows and
+    # columns and a density of at least DENSE_WEIGHTS_MIN_DENSITY, where the dense product is faster than the sparse one
+    DENSE_WEIGHTS_MAX_SIZE = 20000
+    DENSE_WEIGHTS_MIN_DENSITY = 0.05
+
+    # In _compute_pair_score the pairs are gathered from a dense copy of the product of the unique users and items
+    # if it has at most PAIR_SCORE_DENSE_MAX_CELLS cells, indexing the sparse product is much slower when it is dense
+    PAIR_SCORE_DENSE_MAX_CELLS = 1e7
+
+    # The dense product is computed in batches of users whose temporary arrays use at most this fraction of the
+    # available memory, or DENSE_BATCH_DEFAULT_BUDGET bytes if the available memory cannot be read
+    DENSE_BATCH_MEMORY_FRACTION = 0.25
+    DENSE_BATCH_DEFAULT_BUDGET = 8e8
+
     def __init__(self):
         super(SimilarityMatrixRecommender, self).__init__()
 
         self._compute_item_score = self._compute_score_item_based
 
+        # Number of threads used by the compiled top-N, see recommend_top_n
+        self.recommend_n_threads = 1
+
+
+
+    def _set_similarity_matrix(self, W, sparse_format):
+        """
+        Stores the similarity as W_sparse in sparse_format or, if sparse_weights is False, as the dense W, and clears
+        the recommendation cache.
+        If sparse_weights is "auto" the choice is done at every fit, see DENSE_WEIGHTS_MAX_SIZE, and sparse_weights
+        is set to the chosen value
+        """
+
+        if isinstance(self.sparse_weights, str) or getattr(self, "_sparse_weights_auto", False):
+
+            if self.sparse_weights not in [True, False, "auto"]:
+                raise ValueError("{}: value for paramether 'sparse_weights' not recognized. Acceptable values are True, False, 'auto', "
+                                 "provided was '{}'".format(self.RECOMMENDER_NAME, self.sparse_weights))
+
+            self._sparse_weights_auto = True
+
+            W_density = W.nnz/(W.shape[0]*W.shape[1]) if sps.issparse(W) else np.count_nonzero(W)/W.size
+            self.sparse_weights = max(W.shape) > self.DENSE_WEIGHTS_MAX_SIZE or W_density < self.DENSE_WEIGHTS_MIN_DENSITY
+
+        # Only one of the two is kept, the one used to compute the scores
+        if self.sparse_weights:
+            self.W_sparse = check_matrix(W, sparse_format)
+            self.__dict__.pop("W", None)
+
+        else:
+            # The rows of W are read sequentially in the product, so it must be C-contiguous
+            W = W.toarray() if sps.issparse(W) else W
+            self.W = np.ascontiguousarray(W, dtype=np.float32)
+            self.__dict__.pop("W_sparse", None)
+
+        self.clear_recommendation_cache()
+
+
 
 
     def _compute_score_item_based(self, user_id_array, items_to_compute = None):
 
+        if not self.sparse_weights:
+            return self._compute_score_item_based_dense(user_id_array, items_to_compute = items_to_compute)
+
         self._check_sparse_format(self.URM_train, "csr", "URM_train")
         self._check_sparse_format(self.W_sparse, "csc", "W_sparse")
 
@@ -44,8 +102,59 @@ class SimilarityMatrixRecommender(object):
 
 
 
+    def _get_dense_batch_size(self, bytes_per_user):
+        """
+        :param bytes_per_user:  size of the temporary arrays of the dense product for each user
+        :return: the number of users whose temporary arrays fit in DENSE_BATCH_MEMORY_FRACTION of the available memory
+        """
+
+        available_memory_MB = get_available_memory_MB()
+
+        if available_memory_MB is None:
+            memory_budget = self.DENSE_BATCH_DEFAULT_BUDGET
+        else:
+            memory_budget = available_memory_MB * 2**20 * self.DENSE_BATCH_MEMORY_FRACTION
+
+        return max(1, int(memory_budget // max(1, bytes_per_user)))
+
+
+
+    def _compute_score_item_based_dense(self, user_id_array, items_to_compute = None):
+        """
+        Product of the sparse user profiles and the dense W, each nonzero of a profile adds a row of W to the scores.
+        The users are split in batches whose product fits in the available memory, see _get_dense_batch_size
+        """
+
+        self._check_sparse_format(self.URM_train, "csr", "URM_train")
+
+        user_id_array = np.atleast_1d(user_id_array)
+        W = self.W if items_to_compute is None else self.W[:, items_to_compute]
+
+        item_scores_computed = np.empty((len(user_id_array), W.shape[1]), dtype=np.result_type(self.URM_train.dtype, W.dtype))
+        batch_size = self._get_dense_batch_size(W.shape[1] * item_scores_computed.itemsize)
+
+        for user_batch_start in range(0, len(user_id_array), batch_size):
+            user_batch_array = user_id_array[user_batch_start:user_batch_start + batch_size]
+            item_scores_computed[user_batch_start:user_batch_start + len(user_batch_array)] = self.URM_train[user_batch_array].dot(W)
+
+        if items_to_compute is None:
+            return item_scores_computed
+
+        item_scores = - np.ones((len(user_id_array), self.URM_train.shape[1]), dtype=np.float32)*np.inf
+        item_scores[:, items_to_compute] = item_scores_computed
+
+        return item_scores
+
+
+
+
+
+
     def _compute_score_user_based(self, user_id_array, items_to_compute = None):
 
+        if not self.sparse_weights:
+            return self._compute_score_user_based_dense(user_id_array, items_to_compute = items_to_compute)
+
         # URM_train must be CSR, so compute all predictions as it is often the faster
         self._check_sparse_format(self.W_sparse, "csr", "W_sparse")
 
@@ -64,12 +173,191 @@ class SimilarityMatrixRecommender(object):
 
 
 
+    def _compute_score_user_based_dense(self, user_id_array, items_to_compute = None):
+        """
+        Product of the dense rows of W and URM_train, computed transposed as sparse times dense.
+        The users are split in batches whose rows of W and product fit in the available memory, see _get_dense_batch_size
+        """
+
+        user_id_array = np.atleast_1d(user_id_array)
+        n_items = self.URM_train.shape[1]
+
+        item_scores = np.empty((len(user_id_array), n_items), dtype=np.result_type(self.URM_train.dtype, self.W.dtype))
+        batch_size = self._get_dense_batch_size(self.W.shape[1] * self.W.itemsize + 2 * n_items * item_scores.itemsize)
+
+        for user_batch_start in range(0, len(user_id_array), batch_size):
+            user_batch_array = user_id_array[user_batch_start:user_batch_start + batch_size]
+            item_scores[user_batch_start:user_batch_start + len(user_batch_array)] = self.URM_train.T.dot(self.W[user_batch_array].T).T
+
+        if items_to_compute is not None:
+            item_scores_all = item_scores
+            item_scores = - np.ones((len(user_id_array), n_items), dtype=np.float32)*np.inf
+            item_scores[:, items_to_compute] = item_scores_all[:, items_to_compute]
+
+        return item_scores
+
+
+
+
+
+    def _compute_item_score_sparse(self, user_id_array):
+        """
+        The scores of the item-based and user-based models are the sparse product of the user profiles and W_sparse,
+        they are only computed as sparse if W_sparse is a sparse matrix
+        """
+
+        if not self.sparse_weights or not sps.issparse(getattr(self, "W_sparse", None)):
+            return None
+
+        if self._compute_item_score == self._compute_score_item_based:
+
+            self._check_sparse_format(self.URM_train, "csr", "URM_train")
+            self._check_sparse_format(self.W_sparse, "csc", "W_sparse")
+
+            return sps.csr_matrix(self.URM_train[user_id_array].dot(self.W_sparse))
+
+        elif self._compute_item_score == self._compute_score_user_based:
+
+            self._check_sparse_format(self.W_sparse, "csr", "W_sparse")
+
+            return sps.csr_matrix(self.W_sparse[user_id_array].dot(self.URM_train))
+
+        return None
+
+
+
+
+
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
+        """
+        The scores are the sparse product of the rows of the requested users and the columns of the requested items,
+        item-based: URM_train[users] . W_sparse[:, items], user-based: W_sparse[users] . URM_train[:, items]
+        """
+
+        if not self.sparse_weights or not sps.issparse(getattr(self, "W_sparse", None)):
+            return super(SimilarityMatrixRecommender, self)._compute_pair_score(user_pair_array, item_pair_array)
+
+        user_id_array, user_index = np.unique(user_pair_array, return_inverse=True)
+        item_id_array, item_index = np.unique(item_pair_array, return_inverse=True)
+
+        if self._compute_item_score == self._compute_score_item_based:
+
+            self._check_sparse_format(self.URM_train, "csr", "URM_train")
+            self._check_sparse_format(self.W_sparse, "csc", "W_sparse")
+
+            # Computed transposed, so that the CSR conversion is done on the user profiles rather than on the item columns
+            pair_scores = self.W_sparse[:, item_id_array].T.dot(self.URM_train[user_id_array].T).T
+
+        elif self._compute_item_score == self._compute_score_user_based:
+
+            self._check_sparse_format(self.W_sparse, "csr", "W_sparse")
+
+            # The columns of URM_train are taken from its CSC copy, built again only if URM_train changes
+            cached_URM_train_csc = getattr(self, "_URM_train_csc_cache", None)
+
+            if cached_URM_train_csc is None or cached_URM_train_csc[0] is not self.URM_train:
+                self._URM_train_csc_cache = (self.URM_train, self.URM_train.tocsc())
+
+            pair_scores = self.W_sparse[user_id_array].dot(self._URM_train_csc_cache[1][:, item_id_array])
+
+        else:
+            return super(SimilarityMatrixRecommender, self)._compute_pair_score(user_pair_array, item_pair_array)
+
+        if pair_scores.shape[0] * pair_scores.shape[1] <= self.PAIR_SCORE_DENSE_MAX_CELLS:
+            return pair_scores.toarray()[user_index, item_index]
+
+        return np.asarray(sps.csr_matrix(pair_scores)[user_index, item_index]).ravel()
+
+
+
+
+
+
+
+
+    def _get_top_n_object(self):
+        """
+        Returns the compiled top-N object for the current URM_train and W_sparse, it is built again only if they change
+        :return: the object or None if the compiled top-N is not available for the current model
+        """
+
+        if not self.sparse_weights or not sps.issparse(getattr(self, "W_sparse", None)):
+            return None
+
+        if self._compute_item_score == self._compute_score_item_based:
+            item_based = True
+        elif self._compute_item_score == self._compute_score_user_based:
+            item_based = False
+        else:
+            return None
+
+        n_threads = getattr(self, "recommend_n_threads", 1)
+        cached_top_n = getattr(self, "_top_n_object_cache", None)
+
+        if cached_top_n is not None and cached_top_n[0] is self.URM_train and cached_top_n[1] is self.W_sparse and cached_top_n[2:4] == (item_based, n_threads):
+            return cached_top_n[4]
+
+        try:
+            from Base.Cython.Recommender_Top_N_Cython import Recommender_Top_N_Cython
+
+        except ImportError:
+            if cached_top_n is None:
+                print("Unable to load Cython Recommender_Top_N, reverting to Python")
+                self._top_n_object_cache = (None, None, None, None, None)
+            return None
+
+        top_n_object = Recommender_Top_N_Cython(self.URM_train, self.W_sparse, item_based = item_based, n_threads = n_threads)
+        self._top_n_object_cache = (self.URM_train, self.W_sparse, item_based, n_threads, top_n_object)
+
+        return top_n_object
+
+
+
+
+    def _compute_top_n_compiled(self, user_id_array, cutoff, remove_seen_flag, remove_top_pop_flag, remove_CustomItems_flag,
+                                return_sparse_scores):
+
+        top_n_object = self._get_top_n_object()
+
+        if top_n_object is None:
+            return None
+
+        removed_items_mask = self._get_removed_items_mask(remove_top_pop_flag, remove_CustomItems_flag)
+
+        ranking, _, scores = top_n_object.recommend(user_id_array, cutoff, remove_seen_flag = remove_seen_flag,
+                                                    removed_items_mask = removed_items_mask,
+                                                    return_sparse_scores = return_sparse_scores)
+
+        return ranking, scores
+
+
+
+
+    def recommend_top_n(self, user_id_array, cutoff, remove_seen_flag = True, remove_top_pop_flag = False, remove_CustomItems_flag = False):
+        """
+        Uses the compiled top-N if available, see Recommender.recommend_top_n
+        """
+
+        user_id_array = np.atleast_1d(user_id_array)
+        top_n_object = self._get_top_n_object()
+
+        if top_n_object is not None:
+            removed_items_mask = self._get_removed_items_mask(remove_top_pop_flag, remove_CustomItems_flag)
+
+            ranking, ranking_scores, _ = top_n_object.recommend(user_id_array, cutoff, remove_seen_flag = remove_seen_flag,
+                                                                removed_items_mask = removed_items_mask)
+            return ranking, ranking_scores
+
+        return super(SimilarityMatrixRecommender, self).recommend_top_n(user_id_array, cutoff, remove_seen_flag = remove_seen_flag,
+                                                                         remove_top_pop_flag = remove_top_pop_flag,
+                                                                         remove_CustomItems_flag = remove_CustomItems_flag)
+
 
 
 
     def _check_sparse_format(self, sparse_matrix, format, matrix_label):
 
-        attr_name = "_check_sparse_format_done_{}_{}_flag".format(sparse_matrix, format.upper())
+        attr_name = "_check_sparse_format_done_{}_{}_flag".format(matrix_label, format.upper())
 
         if hasattr(self, attr_name):
             return
@@ -85,6 +373,31 @@ class SimilarityMatrixRecommender(object):
 
 
 
+    def _get_model_dict(self):
+
+        if not self.sparse_weights:
+            return {"sparse_weights": self.sparse_weights,
+                    "W": self.W}
+
+        return {"sparse_weights": self.sparse_weights,
+                "W_sparse": self.W_sparse}
+
+
+
+    def _set_model_dict(self, data_dict):
+        """
+        As in _set_similarity_matrix only the matrix used to compute the scores is kept, the one of the previous fit is removed
+        """
+
+        super(SimilarityMatrixRecommender, self)._set_model_dict(data_dict)
+
+        if self.sparse_weights:
+            self.__dict__.pop("W", None)
+        else:
+            self.__dict__.pop("W_sparse", None)
+
+
+
     def saveModel(self, folder_path, file_name = None):
 
         if file_name is None:
@@ -92,11 +405,7 @@ class SimilarityMatrixRecommender(object):
 
         print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
 
-        dictionary_to_save = {"sparse_weights": self.sparse_weights}
-
-
-        dictionary_to_save["W_sparse"] = self.W_sparse
-
+        dictionary_to_save = self._get_model_dict()
 
         pickle.dump(dictionary_to_save,
                     open(folder_path + file_name, "wb"),
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, tempfile, shutil
+
+import numpy as np
+import scipy.sparse as sps
+
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+from KNN.UserKNNCFRecommender import UserKNNCFRecommender
+from GraphBased.P3alphaRecommender import P3alphaRecommender
+from MatrixFactorization.PureSVD import PureSVDRecommender
+from Base.NonPersonalizedRecommender import TopPop
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        np.random.seed(42)
+
+        # Some users have a long profile and many candidates, others only one interaction and fewer candidates than the cutoff
+        self.URM_train = sps.random(300, 400, density=0.05, format="csr", dtype=np.float64)
+        self.URM_train[np.arange(0, 300, 10)] = 0.0
+        self.URM_train[np.arange(0, 300, 10), np.random.randint(400, size=30)] = 1.0
+        self.URM_train = sps.csr_matrix(self.URM_train)
+        self.URM_train.eliminate_zeros()
+
+
+    def test_sparse_ranking_equals_dense(self):
+
+        for recommender_class in [ItemKNNCFRecommender, UserKNNCFRecommender]:
+
+            recommender = recommender_class(self.URM_train)
+            recommender.fit(topK=20, shrink=5)
+            recommender.set_items_to_ignore(np.arange(0, 400, 7))
+
+            user_id_array = np.arange(300)
+
+            for cutoff in [1, 10, 50]:
+
+                ranking_sparse, scores_sparse = recommender.recommend(user_id_array, cutoff=cutoff, remove_CustomItems_flag=True,
+                                                                      return_scores=True, sparse_scores=True)
+
+                ranking_dense, scores_dense = recommender.recommend(user_id_array, cutoff=cutoff, remove_CustomItems_flag=True,
+                                                                    return_scores=True)
+
+                assert sps.issparse(scores_sparse) and isinstance(scores_dense, np.ndarray), "Scores of the wrong type"
+
+                for user_id in user_id_array:
+
+                    assert len(ranking_sparse[user_id]) == cutoff, "Ranking has wrong length"
+
+                    # Items with equal scores may be ranked differently
+                    assert np.allclose(scores_dense[user_id, ranking_sparse[user_id]], scores_dense[user_id, ranking_dense[user_id]]), \
+                        "Sparse ranking not matching dense ranking for {}".format(recommender_class.RECOMMENDER_NAME)
+
+                    assert np.all(np.isfinite(scores_dense[user_id, ranking_sparse[user_id]])), "Sparse ranking contains removed items"
+
+
+    def test_sparse_ranking_python_equals_dense(self):
+
+        recommender = ItemKNNCFRecommender(self.URM_train)
+        recommender.fit(topK=20, shrink=5)
+        recommender.set_items_to_ignore(np.arange(0, 400, 7))
+
+        # The ranking is taken from the sparse scores without the compiled top-N
+        recommender._compute_top_n_compiled = lambda *args: None
+
+        user_id_array = np.random.permutation(300)
+
+        for remove_seen_flag in [True, False]:
+            for cutoff in [1, 10, 50]:
+
+                ranking_sparse = recommender.recommend(user_id_array, cutoff=cutoff, remove_seen_flag=remove_seen_flag, remove_CustomItems_flag=True)
+                scores_dense = recommender._compute_item_score(user_id_array)
+
+                ranking_dense = recommender._get_ranking_from_dense_scores(user_id_array, scores_dense, cutoff, remove_seen_flag, False, True)
+
+                for user_index in range(len(user_id_array)):
+
+                    assert len(ranking_sparse[user_index]) == cutoff, "Ranking has wrong length"
+
+                    # Items with equal scores may be ranked differently
+                    assert np.allclose(scores_dense[user_index, ranking_sparse[user_index]], scores_dense[user_index, ranking_dense[user_index]]), \
+                        "Sparse ranking not matching dense ranking for user {}".format(user_id_array[user_index])
+
+
+    def test_score_candidates_equals_dense(self):
+
+        user_id_array = np.arange(0, 300, 3)
+        candidate_item_lists = [np.random.choice(400, size=np.random.randint(0, 30), replace=False) for _ in user_id_array]
+
+        for recommender_class in [ItemKNNCFRecommender, UserKNNCFRecommender, P3alphaRecommender, PureSVDRecommender, TopPop]:
+
+            recommender = recommender_class(self.URM_train)
+            recommender.fit()
+
+            scores_dense = recommender._compute_item_score(user_id_array)
+            candidate_scores_list = recommender.score_candidates(user_id_array, candidate_item_lists)
+
+            assert len(candidate_scores_list) == len(user_id_array), "Wrong number of users"
+
+            for user_index, candidate_items in enumerate(candidate_item_lists):
+
+                assert candidate_scores_list[user_index].dtype == np.float32 and len(candidate_scores_list[user_index]) == len(candidate_items), \
+                    "Candidate scores of the wrong type for {}".format(recommender_class.RECOMMENDER_NAME)
+
+                assert np.allclose(candidate_scores_list[user_index], scores_dense[user_index, candidate_items], atol=1e-5), \
+                    "Candidate scores not matching dense scores for {}".format(recommender_class.RECOMMENDER_NAME)
+
+
+    def test_dense_weights_equal_sparse(self):
+
+        user_id_array = np.arange(300)
+        items_to_compute = np.arange(0, 400, 2)
+
+        for recommender_class in [ItemKNNCFRecommender, UserKNNCFRecommender]:
+
+            recommender_sparse = recommender_class(self.URM_train, sparse_weights = True)
+            recommender_sparse.fit(topK=100, shrink=5)
+
+            for sparse_weights in [False, "auto"]:
+
+                recommender_dense = recommender_class(self.URM_train, sparse_weights = sparse_weights)
+                recommender_dense.fit(topK=100, shrink=5)
+
+                # With this topK the density of W is above the threshold
+                assert not recommender_dense.sparse_weights and isinstance(recommender_dense.W, np.ndarray), "Dense W not selected"
+
+                assert np.allclose(recommender_sparse._compute_item_score(user_id_array),
+                                   recommender_dense._compute_item_score(user_id_array), atol=1e-5), \
+                    "Dense scores not matching sparse scores for {}".format(recommender_class.RECOMMENDER_NAME)
+
+                assert np.allclose(recommender_sparse._compute_item_score(user_id_array, items_to_compute = items_to_compute),
+                                   recommender_dense._compute_item_score(user_id_array, items_to_compute = items_to_compute), atol=1e-5), \
+                    "Dense scores of items_to_compute not matching sparse scores for {}".format(recommender_class.RECOMMENDER_NAME)
+
+                # Batches of a few users
+                recommender_dense.DENSE_BATCH_MEMORY_FRACTION = 1e-12
+
+                assert np.allclose(recommender_sparse._compute_item_score(user_id_array, items_to_compute = items_to_compute),
+                                   recommender_dense._compute_item_score(user_id_array, items_to_compute = items_to_compute), atol=1e-5), \
+                    "Dense scores in batches not matching sparse scores for {}".format(recommender_class.RECOMMENDER_NAME)
+
+                del recommender_dense.DENSE_BATCH_MEMORY_FRACTION
+
+            # Sparse again if the density after the topK is low
+            recommender_dense.fit(topK=5, shrink=5)
+            assert recommender_dense.sparse_weights and not hasattr(recommender_dense, "W"), "Sparse W not selected"
+
+
+
+    def test_load_dense_into_sparse(self):
+
+        folder_path = tempfile.mkdtemp() + "/"
+        user_id_array = np.arange(300)
+
+        try:
+            for recommender_class in [ItemKNNCFRecommender, UserKNNCFRecommender]:
+
+                recommender_dense = recommender_class(self.URM_train, sparse_weights = False)
+                recommender_dense.fit(topK=30, shrink=5)
+                recommender_dense.saveModel(folder_path, file_name = "dense")
+                recommender_dense.saveModelDirectory(folder_path, folder_name = "dense_directory")
+
+                ranking_saved = recommender_dense.recommend(user_id_array, cutoff = 10)
+
+                for load_function, load_args in [("loadModel", {"file_name": "dense"}),
+                                                 ("loadModelDirectory", {"folder_name": "dense_directory", "mmap": False})]:
+
+                    recommender_loaded = recommender_class(self.URM_train, sparse_weights = True)
+                    recommender_loaded.fit(topK=2, shrink=5)
+                    recommender_loaded.recommend(user_id_array, cutoff = 10)
+
+                    getattr(recommender_loaded, load_function)(folder_path, **load_args)
+
+                    assert not hasattr(recommender_loaded, "W_sparse"), "W_sparse of the previous fit not removed"
+                    assert recommender_loaded.recommend(user_id_array, cutoff = 10) == ranking_saved, \
+                        "Loaded model not matching saved model for {}".format(recommender_class.RECOMMENDER_NAME)
+        finally:
+            shutil.rmtree(folder_path)
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -152,3 +152,5 @@ class RP3betaRecommender(SimilarityMatrixRecommender, Recommender):
             self.W_sparse = similarityMatrixTopK(self.W, forceSparseOutput = True, k=self.topK)
             self.sparse_weights = True
 
+        self.clear_recommendation_cache()
+
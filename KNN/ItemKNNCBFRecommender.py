@@ -13,6 +13,7 @@ from Base.IR_feature_weighting import okapi_BM_25, TF_IDF
 import numpy as np
 
 from Base.Similarity.Compute_Similarity import Compute_Similarity
+from Base.Similarity.Compute_Similarity_Bias_Parametric import Compute_Similarity_Bias_Parametric
 
 
 class ItemKNNCBFRecommender(SimilarityMatrixRecommender, Recommender):
@@ -22,7 +23,16 @@ class ItemKNNCBFRecommender(SimilarityMatrixRecommender, Recommender):
 
     FEATURE_WEIGHTING_VALUES = ["BM25", "TF-IDF", "none"]
 
-    def __init__(self, ICM, URM_train, sparse_weights=True):
+    def __init__(self, ICM, URM_train, sparse_weights=True, bias_parametric_similarity_cache = None):
+        """
+        :param ICM:
+        :param URM_train:
+        :param sparse_weights:
+        :param bias_parametric_similarity_cache:    dictionary shared among instances using the same ICM, e.g., during
+                                                    the parameter search. If provided, the similarity with ICM_bias is computed
+                                                    with a Compute_Similarity_Bias_Parametric object, created once for each
+                                                    feature_weighting and stored in the dictionary
+        """
         super(ItemKNNCBFRecommender, self).__init__()
 
         self.ICM = ICM.copy()
@@ -32,6 +42,8 @@ class ItemKNNCBFRecommender(SimilarityMatrixRecommender, Recommender):
 
         self.sparse_weights = sparse_weights
 
+        self.bias_parametric_similarity_cache = bias_parametric_similarity_cache
+
 
     def fit(self, topK=50, shrink=100, similarity='cosine', normalize=True, feature_weighting = "none", ICM_bias = None, **similarity_args):
 
@@ -50,16 +62,24 @@ class ItemKNNCBFRecommender(SimilarityMatrixRecommender, Recommender):
             self.ICM = self.ICM.astype(np.float32)
             self.ICM = TF_IDF(self.ICM)
 
-        if ICM_bias is not None:
-            self.ICM.data += ICM_bias
+        if ICM_bias is not None and self.bias_parametric_similarity_cache is not None and "row_weights" not in similarity_args and \
+                similarity in Compute_Similarity_Bias_Parametric.SUPPORTED_SIMILARITIES:
 
-        similarity = Compute_Similarity(self.ICM.T, shrink=shrink, topK=topK, normalize=normalize, similarity = similarity, **similarity_args)
+            # The expensive products do not depend on the bias nor on the other hyperparameters, compute them only once
+            if feature_weighting not in self.bias_parametric_similarity_cache:
+                self.bias_parametric_similarity_cache[feature_weighting] = Compute_Similarity_Bias_Parametric(self.ICM.T)
 
+            bias_parametric_similarity = self.bias_parametric_similarity_cache[feature_weighting]
+            W = bias_parametric_similarity.compute_similarity(ICM_bias = ICM_bias, shrink=shrink, topK=topK, normalize=normalize,
+                                                              similarity = similarity, **similarity_args)
 
-        if self.sparse_weights:
-            self.W_sparse = similarity.compute_similarity()
-            self.W_sparse = check_matrix(self.W_sparse, 'csc')
         else:
-            self.W = similarity.compute_similarity()
-            self.W = self.W.toarray()
 
+            if ICM_bias is not None:
+                self.ICM.data += ICM_bias
+
+            similarity = Compute_Similarity(self.ICM.T, shrink=shrink, topK=topK, normalize=normalize, similarity = similarity, **similarity_args)
+            W = similarity.compute_similarity()
+
+
+        self._set_similarity_matrix(W, 'csc')
@@ -57,10 +57,5 @@ class ItemKNNCFRecommender(SimilarityMatrixRecommender, Recommender):
         similarity = Compute_Similarity(self.URM_train, shrink=shrink, topK=topK, normalize=normalize, similarity = similarity, **similarity_args)
 
 
-        if self.sparse_weights:
-            self.W_sparse = similarity.compute_similarity()
-            self.W_sparse = check_matrix(self.W_sparse, 'csc')
-        else:
-            self.W = similarity.compute_similarity()
-            self.W = self.W.toarray()
+        self._set_similarity_matrix(similarity.compute_similarity(), 'csc')
 
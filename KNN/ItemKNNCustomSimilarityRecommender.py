@@ -53,8 +53,8 @@ class ItemKNNCustomSimilarityRecommender(SimilarityMatrixRecommender, Recommende
                 self.W_sparse = check_matrix(item_weights, format='csr')
                 self.sparse_weights = True
 
-            return
-
         else:
             self.W_sparse = similarityMatrixTopK(item_weights, forceSparseOutput = True, k=self.topK)
             self.sparse_weights = True
+
+        self.clear_recommendation_cache()
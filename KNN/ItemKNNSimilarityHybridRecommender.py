@@ -50,3 +50,5 @@ class ItemKNNSimilarityHybridRecommender(SimilarityMatrixRecommender, Recommende
         else:
             self.W = similarityMatrixTopK(W, forceSparseOutput=False, k=self.topK)
 
+        self.clear_recommendation_cache()
+
@@ -60,10 +60,5 @@ class UserKNNCFRecommender(SimilarityMatrixRecommender, Recommender):
 
         similarity = Compute_Similarity(self.URM_train.T, shrink=shrink, topK=topK, normalize=normalize, similarity = similarity, **similarity_args)
 
-        if self.sparse_weights:
-            self.W_sparse = similarity.compute_similarity()
-            self.W_sparse = check_matrix(self.W_sparse, 'csr')
-        else:
-            self.W = similarity.compute_similarity()
-            self.W = self.W.toarray()
+        self._set_similarity_matrix(similarity.compute_similarity(), 'csr')
 
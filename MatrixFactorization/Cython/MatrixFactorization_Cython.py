@@ -50,6 +50,15 @@ class MatrixFactorization_Cython(Recommender, Incremental_Training_Early_Stoppin
         return item_scores
 
 
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
+
+        assert len(user_pair_array) == 0 or self.W.shape[0] > user_pair_array.max(),\
+                "MatrixFactorization_Cython: Cold users not allowed. Users in trained model are {}, requested prediction for users up to {}".format(
+                self.W.shape[0], user_pair_array.max())
+
+        return np.einsum("ij,ij->i", self.W[user_pair_array], self.H[item_pair_array])
+
+
     def fit(self, epochs=300, batch_size = 1000, num_factors=10, positive_threshold_BPR = None,
             learning_rate = 0.01, sgd_mode='sgd', user_reg = 0.0, positive_reg = 0.0, negative_reg = 0.0,
             **earlystopping_kwargs):
@@ -127,6 +136,8 @@ class MatrixFactorization_Cython(Recommender, Incremental_Training_Early_Stoppin
 
         sys.stdout.flush()
 
+        self.clear_recommendation_cache()
+
 
 
     def _prepare_model_for_validation(self):
@@ -234,6 +245,11 @@ class MatrixFactorization_Cython(Recommender, Incremental_Training_Early_Stoppin
 
 
 
+    def _get_model_dict(self):
+        return {"W": self.W,
+                "H": self.H}
+
+
     def saveModel(self, folder_path, file_name = None):
 
         if file_name is None:
@@ -241,8 +257,7 @@ class MatrixFactorization_Cython(Recommender, Incremental_Training_Early_Stoppin
 
         print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
 
-        dictionary_to_save = {"W": self.W,
-                              "H": self.H}
+        dictionary_to_save = self._get_model_dict()
 
 
         pickle.dump(dictionary_to_save,
@@ -40,6 +40,8 @@ class PureSVDRecommender(Recommender):
 
         print(self.RECOMMENDER_NAME + " Computing SVD decomposition... Done!")
 
+        self.clear_recommendation_cache()
+
 
     def _compute_score_SVD(self, user_id_array, items_to_compute = None):
 
@@ -56,24 +58,38 @@ class PureSVDRecommender(Recommender):
         return item_scores
 
 
+    def _compute_pair_score(self, user_pair_array, item_pair_array):
 
+        assert len(user_pair_array) == 0 or self.U.shape[0] > user_pair_array.max(),\
+                "PureSVDRecommender: Cold users not allowed. Users in trained model are {}, requested prediction for users up to {}".format(
+                self.U.shape[0], user_pair_array.max())
 
-    def saveModel(self, folder_path, file_name = None):
+        return np.einsum("ij,ji->i", self.U[user_pair_array, :], self.s_Vt[:, item_pair_array])
 
-        import pickle
 
-        if file_name is None:
-            file_name = self.RECOMMENDER_NAME
 
-        print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
 
-        data_dict = {
+    def _get_model_dict(self):
+
+        return {
             "U":self.U,
             "Sigma":self.Sigma,
             "VT":self.VT,
             "s_Vt":self.s_Vt
         }
 
+
+    def saveModel(self, folder_path, file_name = None):
+
+        import pickle
+
+        if file_name is None:
+            file_name = self.RECOMMENDER_NAME
+
+        print("{}: Saving model in file '{}'".format(self.RECOMMENDER_NAME, folder_path + file_name))
+
+        data_dict = self._get_model_dict()
+
         pickle.dump(data_dict,
                     open(folder_path + file_name, "wb"),
                     protocol=pickle.HIGHEST_PROTOCOL)
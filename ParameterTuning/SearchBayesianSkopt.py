@@ -7,12 +7,17 @@ Created on 14/12/18
 """
 
 import pickle, time, os
+import multiprocessing, queue
+import numpy as np
 
-from skopt import gp_minimize
+from skopt import gp_minimize, Optimizer
 from skopt.space import Real, Integer, Categorical
+from skopt.utils import check_random_state, cook_estimator, normalize_dimensions
 
 from ParameterTuning.SearchAbstractClass import SearchAbstractClass, writeLog
 from Base.Incremental_Training_Early_Stopping import Incremental_Training_Early_Stopping
+from Base.Evaluation.Evaluator import Evaluator
+from Base.Recommender_utils import get_available_memory_MB
 
 
 
@@ -20,6 +25,9 @@ class SearchBayesianSkopt(SearchAbstractClass):
 
     ALGORITHM_NAME = "SearchBayesianSkopt"
 
+    # Lie told to the optimizer for the running configurations, see skopt.Optimizer.ask
+    PARALLEL_STRATEGY_VALUES = ["cl_min", "cl_mean", "cl_max"]
+
 
     def __init__(self, recommender_class, evaluator_validation = None, evaluator_test = None):
 
@@ -43,7 +51,8 @@ class SearchBayesianSkopt(SearchAbstractClass):
                           xi = 0.01,
                           kappa = 1.96,
                           x0 = None,
-                          y0 = None):
+                          y0 = None,
+                          parallel_strategy = "cl_min"):
         """
         wrapper to change the params of the bayesian optimizator.
         for further details:
@@ -64,6 +73,7 @@ class SearchBayesianSkopt(SearchAbstractClass):
         self.noise = noise
         self.x0 = x0
         self.y0 = y0
+        self.parallel_strategy = parallel_strategy
 
 
     def _init_metadata_dict(self):
@@ -101,7 +111,15 @@ class SearchBayesianSkopt(SearchAbstractClass):
                output_file_name_root = None,
                save_model = "best",
                save_metadata = True,
+               n_processes = 1,
+               memory_per_process_MB = None,
                ):
+        """
+        :param n_processes:             Number of configurations trained and evaluated at the same time, each in its own
+                                        process. If None all the available cores are used.
+                                        The processes cannot start other processes, inside them the evaluators use n_processes = 1
+        :param memory_per_process_MB:   If not None, the processes are limited to those fitting in the available memory
+        """
 
         assert save_model in ["no", "all", "best"], "{}: parameter save_model must be in '['no', 'all', 'best']', provided was '{}'.".format(self.ALGORITHM_NAME, save_model)
         self.save_model = save_model
@@ -132,6 +150,20 @@ class SearchBayesianSkopt(SearchAbstractClass):
         self.n_jobs = 1
         self.save_metadata = save_metadata
 
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+
+        if memory_per_process_MB is not None:
+            available_memory_MB = get_available_memory_MB()
+
+            if available_memory_MB is not None:
+                n_processes = min(n_processes, max(1, int(available_memory_MB // memory_per_process_MB)))
+
+        if n_processes < 1:
+            raise ValueError("{}: value for paramether 'n_processes' must be a positive integer. Passed value was '{}'".format(self.ALGORITHM_NAME, n_processes))
+
+        self.n_processes = min(n_processes, self.n_calls)
+
 
         if self.save_metadata:
             self._init_metadata_dict()
@@ -161,30 +193,180 @@ class SearchBayesianSkopt(SearchAbstractClass):
 
 
 
-        self.result = gp_minimize(self._objective_function_list_input,
-                                  self.hyperparams_values,
-                                  base_estimator=None,
-                                  n_calls=self.n_calls,
-                                  n_random_starts=self.n_random_starts,
-                                  acq_func=self.acq_func,
-                                  acq_optimizer=self.acq_optimizer,
-                                  x0=self.x0,
-                                  y0=self.y0,
-                                  random_state=self.random_state,
-                                  verbose=self.verbose,
-                                  callback=None,
-                                  n_points=self.n_point,
-                                  n_restarts_optimizer=self.n_restarts_optimizer,
-                                  xi=self.xi,
-                                  kappa=self.kappa,
-                                  noise=self.noise,
-                                  n_jobs=self.n_jobs)
+        if self.n_processes > 1:
+            self.result = self._run_parallel_search()
+
+        else:
+            self.result = gp_minimize(self._objective_function_list_input,
+                                      self.hyperparams_values,
+                                      base_estimator=None,
+                                      n_calls=self.n_calls,
+                                      n_random_starts=self.n_random_starts,
+                                      acq_func=self.acq_func,
+                                      acq_optimizer=self.acq_optimizer,
+                                      x0=self.x0,
+                                      y0=self.y0,
+                                      random_state=self.random_state,
+                                      verbose=self.verbose,
+                                      callback=None,
+                                      n_points=self.n_point,
+                                      n_restarts_optimizer=self.n_restarts_optimizer,
+                                      xi=self.xi,
+                                      kappa=self.kappa,
+                                      noise=self.noise,
+                                      n_jobs=self.n_jobs)
 
         writeLog("{}: Search complete. Best config is {}: {}\n".format(self.ALGORITHM_NAME, self.best_solution_counter, self.best_solution_parameters), self.log_file)
 
 
 
 
+    def __getstate__(self):
+
+        # The processes of the parallel search do not write the log
+        state = self.__dict__.copy()
+        state["log_file"] = None
+
+        return state
+
+
+
+    def _ask_with_running(self, optimizer, running_x_list):
+        """
+        Proposes the next configuration while those in running_x_list are still being evaluated.
+        The running configurations are told to a copy of the optimizer with a constant lie, so that it proposes a different one
+        """
+
+        if len(running_x_list) == 0 or len(optimizer.yi) == 0:
+            return optimizer.ask()
+
+        if self.parallel_strategy == "cl_min":
+            y_lie = np.min(optimizer.yi)
+        elif self.parallel_strategy == "cl_mean":
+            y_lie = np.mean(optimizer.yi)
+        else:
+            y_lie = np.max(optimizer.yi)
+
+        optimizer_lie = optimizer.copy(random_state = optimizer.rng.randint(0, np.iinfo(np.int32).max))
+        optimizer_lie.tell(running_x_list, [y_lie]*len(running_x_list))
+
+        return optimizer_lie.ask()
+
+
+
+    def _run_parallel_search(self):
+        """
+        Ask/tell version of gp_minimize evaluating up to n_processes configurations at the same time.
+        A new configuration is proposed as soon as one is evaluated, its result is registered in the order of completion
+        :return: the skopt result of the last tell
+        """
+
+        if self.parallel_strategy not in self.PARALLEL_STRATEGY_VALUES:
+            raise ValueError("{}: value for paramether 'parallel_strategy' not recognized. Acceptable values are {}, provided was '{}'".format(
+                self.ALGORITHM_NAME, self.PARALLEL_STRATEGY_VALUES, self.parallel_strategy))
+
+        # Same optimizer gp_minimize builds
+        random_state = check_random_state(self.random_state)
+        space = normalize_dimensions(self.hyperparams_values)
+
+        base_estimator = cook_estimator("GP", space=space, random_state=random_state.randint(0, np.iinfo(np.int32).max), noise=self.noise)
+
+        if self.x0 is None:
+            x0 = []
+        elif not isinstance(self.x0[0], (list, tuple)):
+            x0 = [self.x0]
+        else:
+            x0 = list(self.x0)
+
+        optimizer = Optimizer(space, base_estimator,
+                              n_initial_points=self.n_random_starts + len(x0),
+                              acq_func=self.acq_func,
+                              acq_optimizer=self.acq_optimizer,
+                              random_state=random_state,
+                              acq_optimizer_kwargs={"n_points": self.n_point, "n_restarts_optimizer": self.n_restarts_optimizer, "n_jobs": self.n_jobs},
+                              acq_func_kwargs={"xi": self.xi, "kappa": self.kappa})
+
+        result = None
+
+        # As in gp_minimize the points in x0 without a y0 are evaluated first and count as calls
+        if len(x0) > 0 and self.y0 is not None:
+            result = optimizer.tell(x0, list(np.atleast_1d(self.y0)))
+            x_to_evaluate_list = []
+        else:
+            x_to_evaluate_list = x0
+
+        result_queue = queue.Queue()
+        running_x_list = []
+        n_submitted = 0
+        n_completed = 0
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            _parallel_search_worker_init(self)
+            pool = multiprocessing.get_context("fork").Pool(processes = self.n_processes)
+        else:
+            pool = multiprocessing.Pool(processes = self.n_processes, initializer = _parallel_search_worker_init, initargs = (self, ))
+
+        try:
+            with pool:
+                while n_completed < self.n_calls:
+
+                    while n_submitted < self.n_calls and len(running_x_list) < self.n_processes:
+
+                        if len(x_to_evaluate_list) > 0:
+                            next_x = x_to_evaluate_list.pop(0)
+                        else:
+                            next_x = self._ask_with_running(optimizer, running_x_list)
+
+                        running_x_list.append(next_x)
+                        pool.apply_async(_parallel_search_worker_evaluate, (next_x, ),
+                                         callback = result_queue.put, error_callback = result_queue.put)
+                        n_submitted += 1
+
+                    worker_result = result_queue.get()
+
+                    if isinstance(worker_result, BaseException):
+                        raise worker_result
+
+                    next_x, current_fit_parameters_dict, result_dict, recommender_model, train_time, evaluation_time = worker_result
+
+                    running_x_list.remove(next_x)
+                    n_completed += 1
+
+                    # The model is moved to this process only if it has to be saved or evaluated on the test data
+                    if self.save_model == "all" or self._is_new_best(result_dict):
+                        recommender_instance = self._rebuild_recommender(recommender_model)
+                    else:
+                        recommender_instance = None
+
+                    next_y = self._register_result(current_fit_parameters_dict, result_dict, recommender_instance, train_time, evaluation_time)
+
+                    result = optimizer.tell(next_x, next_y)
+
+        finally:
+            _parallel_search_worker_init(None)
+
+        return result
+
+
+
+    def _rebuild_recommender(self, recommender_model):
+        """
+        :param recommender_model:   attributes of the fitted model, see Recommender._get_model_dict, or the recommender itself
+        """
+
+        if not isinstance(recommender_model, dict):
+            return recommender_model
+
+        recommender_instance = self.recommender_class(*self.recommender_constructor_data.CONSTRUCTOR_POSITIONAL_ARGS,
+                                                      **self.recommender_constructor_data.CONSTRUCTOR_KEYWORD_ARGS)
+
+        recommender_instance._set_model_dict(recommender_model)
+
+        return recommender_instance
+
+
+
+
     def _evaluate(self, current_fit_parameters):
 
         start_time = time.time()
@@ -243,13 +425,11 @@ class SearchBayesianSkopt(SearchAbstractClass):
 
 
 
-    def _objective_function(self, current_fit_parameters_dict):
-
-        result_dict, _, recommender_instance, train_time, evaluation_time = self._evaluate(current_fit_parameters_dict)
-
-        current_result = - result_dict[self.metric_to_optimize]
+    def _get_fit_parameters_with_early_stopping(self, current_fit_parameters_dict, recommender_instance):
+        """
+        :return: the fit parameters, if the recommender uses Earlystopping with the selected number of epochs
+        """
 
-        # If the recommender uses Earlystopping, get the selected number of epochs
         if isinstance(recommender_instance, Incremental_Training_Early_Stopping):
 
             n_epochs_early_stopping_dict = recommender_instance.get_early_stopping_final_epochs_dict()
@@ -260,7 +440,33 @@ class SearchBayesianSkopt(SearchAbstractClass):
                 epoch_value = n_epochs_early_stopping_dict[epoch_label]
                 current_fit_parameters_dict[epoch_label] = epoch_value
 
+        return current_fit_parameters_dict
+
+
+
+    def _objective_function(self, current_fit_parameters_dict):
+
+        result_dict, _, recommender_instance, train_time, evaluation_time = self._evaluate(current_fit_parameters_dict)
+
+        current_fit_parameters_dict = self._get_fit_parameters_with_early_stopping(current_fit_parameters_dict, recommender_instance)
+
+        return self._register_result(current_fit_parameters_dict, result_dict, recommender_instance, train_time, evaluation_time)
+
+
+
+    def _is_new_best(self, result_dict):
+        return self.best_solution_val == None or self.best_solution_val < result_dict[self.metric_to_optimize]
+
+
+
+    def _register_result(self, current_fit_parameters_dict, result_dict, recommender_instance, train_time, evaluation_time):
+        """
+        Updates the metadata, the log, the best model and its evaluation on the test data with the result of a configuration
+        :param recommender_instance:    only used to save the model and to evaluate the new best one on the test data
+        :return: the value to minimize
+        """
 
+        current_result = - result_dict[self.metric_to_optimize]
 
 
         if self.save_metadata:
@@ -286,7 +492,7 @@ class SearchBayesianSkopt(SearchAbstractClass):
 
 
 
-        if self.best_solution_val == None or self.best_solution_val < result_dict[self.metric_to_optimize]:
+        if self._is_new_best(result_dict):
 
             writeLog("{}: New best config found. Config {}: {} - results: {}\n".format(self.ALGORITHM_NAME,
                                                                                        self.model_counter,
@@ -347,3 +553,60 @@ class SearchBayesianSkopt(SearchAbstractClass):
 
 
         return current_result
+
+
+
+
+
+
+# Set in the parent process before the fork, or by the initializer of each process
+_parallel_search_object = None
+
+# Only set in the processes of the pool
+_parallel_search_worker_single_process = False
+
+
+def _parallel_search_worker_init(search_object):
+
+    global _parallel_search_object
+
+    _parallel_search_object = search_object
+
+
+def _set_evaluators_single_process(search_object):
+    """
+    The processes of the pool are daemonic and cannot have children, the evaluators of the validation
+    and of the early stopping are set to evaluate in the same process
+    """
+
+    evaluator_list = [search_object.evaluator_validation] + list(search_object.recommender_constructor_data.FIT_KEYWORD_ARGS.values())
+
+    for evaluator_object in evaluator_list:
+        if isinstance(evaluator_object, Evaluator) and getattr(evaluator_object, "n_processes", 1) != 1:
+            evaluator_object.n_processes = 1
+
+
+def _parallel_search_worker_evaluate(current_fit_parameters_list_of_values):
+
+    global _parallel_search_worker_single_process
+
+    search_object = _parallel_search_object
+
+    # The objects are modified only in the processes of the pool
+    if not _parallel_search_worker_single_process:
+        _set_evaluators_single_process(search_object)
+        _parallel_search_worker_single_process = True
+
+    current_fit_parameters_dict = dict(zip(search_object.hyperparams_names, current_fit_parameters_list_of_values))
+
+    result_dict, _, recommender_instance, train_time, evaluation_time = search_object._evaluate(current_fit_parameters_dict)
+
+    current_fit_parameters_dict = search_object._get_fit_parameters_with_early_stopping(current_fit_parameters_dict, recommender_instance)
+
+    # The attributes of the fitted model are sent back, without the objects used in training e.g., the Cython ones
+    try:
+        recommender_model = dict(recommender_instance._get_model_dict())
+    except (NotImplementedError, AttributeError):
+        recommender_model = recommender_instance
+
+    return current_fit_parameters_list_of_values, current_fit_parameters_dict, result_dict, recommender_model, train_time, evaluation_time
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18/10/26
+
+@author: Maurizio Ferrari Dacrema
+"""
+
+import unittest, tempfile, shutil, pickle
+
+import numpy as np
+import scipy.sparse as sps
+
+from skopt.space import Integer, Categorical
+
+from Base.Evaluation.Evaluator import EvaluatorHoldout
+from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+from ParameterTuning.SearchAbstractClass import SearchInputRecommenderParameters
+from ParameterTuning.SearchBayesianSkopt import SearchBayesianSkopt
+
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder_path = tempfile.mkdtemp() + "/"
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_path)
+
+
+    def test_parallel_search(self):
+
+        np.random.seed(42)
+
+        URM_train = sps.random(300, 200, density=0.05, format="csr", dtype=np.float64)
+        URM_validation = sps.random(300, 200, density=0.02, format="csr", dtype=np.float64)
+        URM_test = sps.random(300, 200, density=0.02, format="csr", dtype=np.float64)
+
+        n_cases = 6
+
+        # The evaluator processes cannot be started inside the processes of the search
+        evaluator_validation = EvaluatorHoldout(URM_validation, [5], n_processes = 2)
+        evaluator_test = EvaluatorHoldout(URM_test, [5])
+
+        parameter_search = SearchBayesianSkopt(ItemKNNCFRecommender, evaluator_validation = evaluator_validation, evaluator_test = evaluator_test)
+
+        parameter_search.search(SearchInputRecommenderParameters(CONSTRUCTOR_POSITIONAL_ARGS = [URM_train]),
+                                {"topK": Integer(5, 100), "shrink": Integer(0, 100), "similarity": Categorical(["cosine"])},
+                                n_cases = n_cases,
+                                n_random_starts = 3,
+                                output_folder_path = self.folder_path,
+                                output_file_name_root = "ItemKNNCF",
+                                save_model = "best",
+                                n_processes = 2)
+
+        metadata_dict = pickle.load(open(self.folder_path + "ItemKNNCF_metadata", "rb"))
+
+        for key in ["parameters_list", "validation_result_list", "train_time_list", "evaluation_time_list"]:
+            assert len(metadata_dict[key]) == n_cases and all(value is not None for value in metadata_dict[key]), "Metadata '{}' not complete".format(key)
+
+        assert metadata_dict["best_parameters"] is not None
+        assert metadata_dict["best_result_test"] is not None
+        assert metadata_dict["test_result_list"][metadata_dict["best_parameters_index"]] is not None
+
+        best_validation_MAP = max(result_dict["MAP"] for result_dict in metadata_dict["validation_result_list"])
+        assert metadata_dict["best_result_validation"]["MAP"] == best_validation_MAP, "Best configuration not selected"
+
+        # The saved model is the one of the best configuration
+        recommender_loaded = ItemKNNCFRecommender(URM_train)
+        recommender_loaded.loadModel(self.folder_path, file_name = "ItemKNNCF_best_model")
+
+        recommender_best = ItemKNNCFRecommender(URM_train)
+        recommender_best.fit(**metadata_dict["best_parameters"])
+
+        user_id_array = np.arange(300)
+        assert np.allclose(recommender_loaded._compute_item_score(user_id_array), recommender_best._compute_item_score(user_id_array)), \
+            "Saved model not matching the best configuration"
+
+
+
+if __name__ == '__main__':
+
+    unittest.main()
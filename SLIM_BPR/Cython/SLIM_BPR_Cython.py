@@ -162,6 +162,8 @@ class SLIM_BPR_Cython(SimilarityMatrixRecommender, Recommender, Incremental_Trai
 
         sys.stdout.flush()
 
+        self.clear_recommendation_cache()
+
 
 
 
@@ -93,6 +93,8 @@ class SLIM_BPR(Recommender):
 
         del self.S
 
+        self.clear_recommendation_cache()
+
 
     def epochIteration(self):
 
@@ -266,4 +266,6 @@ class SLIM_BPR_Mono(Recommender):
         self.loadModelIntoDenseMatrix(self.basePath + self.outputModelName)
 
         if deleteFiles:
-            self.removeTemporaryFiles()
\ No newline at end of file
+            self.removeTemporaryFiles()
+
+        self.clear_recommendation_cache()
\ No newline at end of file
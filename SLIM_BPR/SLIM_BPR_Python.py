@@ -265,6 +265,8 @@ class SLIM_BPR_Python(BPR_Sampling, SimilarityMatrixRecommender, Recommender):
 
         sys.stdout.flush()
 
+        self.clear_recommendation_cache()
+
 
 
     def writeCurrentConfig(self, currentEpoch, results_run, logFile):
@@ -322,6 +322,8 @@ class SLIM_BPR_Theano(BPR_Sampling, Recommender):
 
         self._clear_theano_train_data()
 
+        self.clear_recommendation_cache()
+
 
     def fitAndValidate(self, epochs=30, logFile=None, URM_test=None, filterTopPop = False, minRatingsPerUser=1,
             batch_size = 1000, validate_every_N_epochs = 1, start_validation_after_N_epochs = 0):
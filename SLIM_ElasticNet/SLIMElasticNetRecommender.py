@@ -154,6 +154,8 @@ class SLIMElasticNetRecommender(SimilarityMatrixRecommender, Recommender):
         self.W_sparse = sps.csr_matrix((values[:numCells], (rows[:numCells], cols[:numCells])),
                                        shape=(n_items, n_items), dtype=np.float32)
 
+        self.clear_recommendation_cache()
+
 
 
 
@@ -253,6 +255,8 @@ class MultiThreadSLIM_ElasticNet(SLIMElasticNetRecommender, SimilarityMatrixReco
         # generate the sparse weight matrix
         self.W_sparse = sps.csc_matrix((values, (rows, cols)), shape=(n_items, n_items), dtype=np.float32)
 
+        self.clear_recommendation_cache()
+
     #
     # def fitThreading(self, X):
     #
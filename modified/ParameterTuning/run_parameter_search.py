@@ -9,6 +9,7 @@ Created on 22/11/17
 from Base.NonPersonalizedRecommender import TopPop, Random, GlobalEffects
 from KNN.UserKNNCFRecommender import UserKNNCFRecommender
 from KNN.ItemKNNCFRecommender import ItemKNNCFRecommender
+from KNN.ItemKNNCBFRecommender import ItemKNNCBFRecommender
 from SLIM_BPR.Cython.SLIM_BPR_Cython import SLIM_BPR_Cython
 from SLIM_ElasticNet.SLIMElasticNetRecommender import SLIMElasticNetRecommender
 from GraphBased.P3alphaRecommender import P3alphaRecommender
@@ -332,9 +333,16 @@ def runParameterSearch_Content(recommender_class, URM_train, ICM_object, ICM_nam
         similarity_type_list = ['cosine', 'jaccard', "asymmetric", "dice", "tversky"]
 
 
+    constructor_keyword_args = {}
+
+    # The similarity products needed to change ICM_bias are computed once and shared by all the cases of the search
+    if allow_bias_ICM and recommender_class is ItemKNNCBFRecommender:
+        constructor_keyword_args["bias_parametric_similarity_cache"] = {}
+
+
     recommender_parameters = SearchInputRecommenderParameters(
         CONSTRUCTOR_POSITIONAL_ARGS = [ICM_object, URM_train],
-        CONSTRUCTOR_KEYWORD_ARGS = {},
+        CONSTRUCTOR_KEYWORD_ARGS = constructor_keyword_args,
         FIT_POSITIONAL_ARGS = [],
         FIT_KEYWORD_ARGS = {}
     )